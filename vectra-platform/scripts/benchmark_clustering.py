@@ -0,0 +1,66 @@
+# scripts/benchmark_clustering.py
+# Compares the refinery's entry-point clustering engines (haversine ball-tree
+# DBSCAN vs exact grid DBSCAN on local ENU meters) on synthetic p7-cell scans.
+# Usage (from vectra-platform/): python scripts/benchmark_clustering.py --scans 1000 10000 50000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "services", "refinery-worker"))
+from app.logic.clustering import LocationHeuristics  # noqa: E402
+
+def make_scans(n: int, hub_share: float, seed: int = 42) -> pd.DataFrame:
+    """One ~150 m cell: a dense hub (loading dock), a few doors and background noise."""
+    rng = np.random.default_rng(seed)
+    lat0, lon0 = 40.7128, -74.0060
+    n_hub = int(n * hub_share)
+    n_doors = (n - n_hub) // 2
+    doors = rng.uniform(-60, 60, (6, 2))
+    xy = np.concatenate([
+        rng.normal(0, 5, (n_hub, 2)),
+        doors[rng.integers(0, len(doors), n_doors)] + rng.normal(0, 4, (n_doors, 2)),
+        rng.uniform(-75, 75, (n - n_hub - n_doors, 2)),
+    ])
+    return pd.DataFrame({
+        "latitude": lat0 + xy[:, 1] / 111320.0,
+        "longitude": lon0 + xy[:, 0] / (111320.0 * np.cos(np.radians(lat0))),
+    })
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def run(sizes, hub_share: float, eps: float, min_samples: int, repeat: int, max_sklearn: int):
+    engines = {name: LocationHeuristics(eps, min_samples, engine=name) for name in ("sklearn", "grid")}
+    print(f"eps={eps}m min_samples={min_samples} hub_share={hub_share} (best of {repeat})")
+    for n in sizes:
+        scans = make_scans(n, hub_share)
+        grid_s, grid_labels = best_of(lambda: engines["grid"]._cluster_labels(scans), repeat)
+        line = f"  scans={n:<8,} grid {grid_s * 1e3:10.2f} ms"
+        # Haversine DBSCAN materializes every neighborhood: O(n^2) memory on dense hubs
+        if n <= max_sklearn:
+            sk_s, sk_labels = best_of(lambda: engines["sklearn"]._cluster_labels(scans), repeat)
+            agree = (sk_labels == grid_labels).mean()
+            line += f"   sklearn {sk_s * 1e3:10.2f} ms  x{sk_s / grid_s:,.1f}  label agreement {agree:.4%}"
+        else:
+            line += "   sklearn skipped (--max-sklearn)"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scans", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--hub-share", type=float, default=0.6)
+    parser.add_argument("--eps", type=float, default=20.0)
+    parser.add_argument("--min-samples", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-sklearn", type=int, default=20000)
+    args = parser.parse_args()
+    run(args.scans, args.hub_share, args.eps, args.min_samples, args.repeat, args.max_sklearn)
@@ -0,0 +1,58 @@
+# scripts/benchmark_geohash.py
+# Compares the shared vectorized geohash kernels against row-by-row pygeohash.
+# Usage (from vectra-platform/): python scripts/benchmark_geohash.py --rows 1000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pygeohash as pgh
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.common.python import geohash as vgh  # noqa: E402
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def run(rows: int, precision: int, repeat: int):
+    rng = np.random.default_rng(42)
+    # NYC-sized bounding box, same shape as a consumer batch
+    df = pd.DataFrame({
+        "latitude": rng.uniform(40.5, 40.9, rows),
+        "longitude": rng.uniform(-74.2, -73.7, rows),
+    })
+    lat, lon = df["latitude"].to_numpy(), df["longitude"].to_numpy()
+
+    expected = df.apply(lambda x: pgh.encode(x["latitude"], x["longitude"], precision=precision), axis=1).to_numpy()
+    assert (vgh.encode(lat, lon, precision) == expected).all(), "vectorized encode disagrees with pygeohash"
+
+    cases = {
+        "pygeohash df.apply": lambda: df.apply(lambda x: pgh.encode(x["latitude"], x["longitude"], precision=precision), axis=1),
+        "pygeohash list comp": lambda: [pgh.encode(a, b, precision=precision) for a, b in zip(lat, lon)],
+        "vgh.encode (str)": lambda: vgh.encode(lat, lon, precision),
+        "vgh.encode_int (uint64)": lambda: vgh.encode_int(lat, lon, precision),
+        "vgh.decode": lambda: vgh.decode(expected),
+        "vgh.neighbors": lambda: vgh.neighbors(expected),
+    }
+
+    baseline = None
+    print(f"rows={rows} precision={precision} (best of {repeat})")
+    for name, fn in cases.items():
+        elapsed = best_of(fn, repeat)
+        baseline = baseline or elapsed
+        print(f"  {name:<26} {elapsed * 1e3:9.3f} ms  {rows / elapsed:14,.0f} rows/s  x{baseline / elapsed:,.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--precision", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.precision, args.repeat)
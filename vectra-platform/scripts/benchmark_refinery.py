@@ -0,0 +1,163 @@
+# scripts/benchmark_refinery.py
+# End-to-end refinery benchmark on synthetic traces (generate_synthetic_training_data.py),
+# with local stand-ins for the services: Postgres is the Parquet file (served as the
+# same BatchTraces the COPY loader returns) and OSRM is either a fixed-latency echo
+# matcher or the local road snapper (--segments). Reports throughput, p50/p99 per
+# stage, peak RSS and accuracy against the generator's ground truth.
+# Usage (from vectra-platform/):
+#   python scripts/generate_synthetic_training_data.py --out data/synthetic
+#   python scripts/benchmark_refinery.py data/synthetic --cells 2000 --engine grid
+import argparse
+import math
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "refinery-worker"))
+sys.path.insert(0, ROOT)
+
+METERS_PER_DEGREE = 111320.0
+
+class ParquetTraceStore:
+    """Postgres stand-in: answers load_batch_traces from an in-memory frame."""
+    def __init__(self, traces: pd.DataFrame):
+        self.df = traces.sort_values("geohash", kind="stable").reset_index(drop=True)
+        keys = self.df["geohash"].to_numpy(dtype=object)
+        self.cells = pd.Index(keys).unique()
+        self.starts = np.searchsorted(keys, self.cells, side="left")
+        self.ends = np.searchsorted(keys, self.cells, side="right")
+
+    def dirty_cells(self) -> list:
+        """Cells with at least one SCAN, like dirty_geohashes after a full ingest."""
+        return sorted(self.df.loc[self.df["event_type"] == "SCAN", "geohash"].unique())
+
+    def load_batch_traces(self, candidates):
+        from app.db.repository import BatchTraces, search_cells
+        pos = self.cells.get_indexer(search_cells(candidates))
+        pos = pos[pos >= 0]
+        rows = np.concatenate([np.arange(s, e) for s, e in zip(self.starts[pos], self.ends[pos])]) if len(pos) else []
+        return BatchTraces(self.df.iloc[rows])
+
+class EchoMatcher:
+    """OSRM stand-in: returns points unchanged after the latency of a pipelined batch."""
+    def __init__(self, latency_ms: float, max_in_flight: int):
+        self.latency_s = latency_ms / 1000.0
+        self.max_in_flight = max_in_flight
+
+    def snap_many(self, points, bearings=None):
+        time.sleep(self.latency_s * math.ceil(len(points) / self.max_in_flight))
+        return list(points)
+
+def percentiles(values) -> str:
+    ms = np.asarray(values) * 1e3
+    if not len(ms):
+        return "n/a"
+    return f"p50 {np.percentile(ms, 50):8.2f} ms  p99 {np.percentile(ms, 99):8.2f} ms  total {ms.sum() / 1e3:8.2f} s"
+
+def meters(lon_a, lat_a, lon_b, lat_b):
+    return np.hypot((lon_a - lon_b) * METERS_PER_DEGREE * np.cos(np.radians(lat_a)), (lat_a - lat_b) * METERS_PER_DEGREE)
+
+def peak_rss_mb() -> tuple:
+    # ru_maxrss is KiB on Linux; children covers pool workers
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1024, children / 1024
+
+def run(data_dir: str, n_cells: int, batch_size: int, workers: int, segments: str, latency_ms: float, max_in_flight: int):
+    # Imported late: the worker heuristics read CLUSTERING_ENGINE from the environment
+    from app.main import _worker_state, init_worker, process_single_geohash, snap_parking_points, timed_process_geohash
+    from app.logic.road_snapper import LocalRoadSnapper
+
+    traces = pd.read_parquet(os.path.join(data_dir, "traces.parquet"))
+    truth_path = os.path.join(data_dir, "truth.parquet")
+    truth = pd.read_parquet(truth_path) if os.path.exists(truth_path) else None
+    store = ParquetTraceStore(traces)
+    cells = store.dirty_cells()[:n_cells]
+    matcher = LocalRoadSnapper.from_file(segments) if segments else EchoMatcher(latency_ms, max_in_flight)
+    heuristics = _worker_state()["heuristics"]
+    print(f"{len(traces):,} fixes, {len(cells):,} cells, engine={heuristics.engine}, batch={batch_size}, "
+          f"workers={workers or 'in-process'}, osrm={'local snapper' if segments else f'echo {latency_ms} ms'}")
+
+    stages = {"load": [], "slice": [], "entry_point": [], "parking": [], "process": [], "snap": []}
+    rows = []
+    executor = ProcessPoolExecutor(workers, initializer=init_worker) if workers else None
+    start = time.perf_counter()
+    for i in range(0, len(cells), batch_size):
+        batch = cells[i:i + batch_size]
+        t = time.perf_counter()
+        batch_traces = store.load_batch_traces(batch)
+        stages["load"].append(time.perf_counter() - t)
+
+        results = []
+        if executor:
+            futures = [executor.submit(timed_process_geohash, g, batch_traces.scans(g), batch_traces.traces(g)) for g in batch]
+            for f in futures:
+                result, _, busy = f.result()
+                stages["process"].append(busy)
+                if result:
+                    results.append(result)
+        else:
+            # Per-stage timings in-process; the full pipeline runs separately so
+            # "process" includes its own overhead exactly as the workers see it
+            for g in batch:
+                t = time.perf_counter()
+                scans, cell_traces = batch_traces.scans(g), batch_traces.traces(g)
+                stages["slice"].append(time.perf_counter() - t)
+                t = time.perf_counter()
+                ep_point, _ = heuristics.find_entry_point(scans)
+                stages["entry_point"].append(time.perf_counter() - t)
+                if ep_point:
+                    t = time.perf_counter()
+                    heuristics.find_parking_candidate(cell_traces, ep_point)
+                    stages["parking"].append(time.perf_counter() - t)
+                t = time.perf_counter()
+                result = process_single_geohash(g, scans, cell_traces)
+                stages["process"].append(time.perf_counter() - t)
+                if result:
+                    results.append(result)
+
+        t = time.perf_counter()
+        rows.extend(snap_parking_points(matcher, results))
+        stages["snap"].append(time.perf_counter() - t)
+    wall = time.perf_counter() - start
+    if executor:
+        executor.shutdown()
+
+    per_cell = ("slice", "entry_point", "parking", "process")
+    print(f"throughput: {len(cells) / wall:,.1f} geohashes/s ({wall:.2f} s wall, {len(rows):,} refined)")
+    for name, values in stages.items():
+        if values:
+            print(f"  {name:<12} ({'per cell' if name in per_cell else 'per batch'}) {percentiles(values)}")
+    own, children = peak_rss_mb()
+    print(f"peak RSS: {own:,.0f} MB main, {children:,.0f} MB largest worker")
+
+    if truth is not None and rows:
+        # Cells refine independently; compare each to the address it contains, if any
+        out = pd.DataFrame(rows).merge(truth.drop_duplicates("geohash"), left_on="id", right_on="geohash")
+        if len(out):
+            ep_err = meters(out["ep_lon"], out["ep_lat"], out["door_lon"], out["door_lat"])
+            nav_err = meters(out["nav_lon"], out["nav_lat"], out["parking_lon"], out["parking_lat"])
+            print(f"accuracy ({len(out):,} address cells): entry point p50 {np.median(ep_err):.1f} m  "
+                  f"p90 {np.percentile(ep_err, 90):.1f} m | parking p50 {np.median(nav_err):.1f} m  "
+                  f"p90 {np.percentile(nav_err, 90):.1f} m")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data", help="directory with traces.parquet (and truth.parquet)")
+    parser.add_argument("--cells", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=0, help="0 = in-process with per-stage timings")
+    parser.add_argument("--engine", choices=("sklearn", "grid"), default=None)
+    parser.add_argument("--segments", default=None, help="road_segments.npz: snap with the local snapper")
+    parser.add_argument("--osrm-latency-ms", type=float, default=5.0)
+    parser.add_argument("--osrm-in-flight", type=int, default=32)
+    args = parser.parse_args()
+    if args.engine:
+        os.environ["CLUSTERING_ENGINE"] = args.engine
+    run(args.data, args.cells, args.batch_size, args.workers, args.segments, args.osrm_latency_ms, args.osrm_in_flight)
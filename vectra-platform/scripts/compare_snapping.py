@@ -0,0 +1,71 @@
+# scripts/compare_snapping.py
+# Agreement and latency of the local road snapper vs a running OSRM instance.
+# Points are sampled around segment midpoints of the index (a curbside offset
+# plus a heading noisy around the road's), or read from a CSV with
+# latitude, longitude[, bearing] columns.
+# Usage (from vectra-platform/):
+#   python scripts/compare_snapping.py road_segments.npz --osrm http://localhost:5000 --points 2000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "services", "refinery-worker"))
+from app.logic.osrm_clinent import OSRMMatcher  # noqa: E402
+from app.logic.road_snapper import LocalRoadSnapper, METERS_PER_DEGREE  # noqa: E402
+
+def sample_points(snapper: LocalRoadSnapper, n: int, offset_m: float, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(snapper.segments), n)
+    mid = snapper.segments[idx].mean(axis=1)
+    angle = rng.uniform(0, 2 * np.pi, n)
+    dist = rng.uniform(0, offset_m, n)
+    lat = mid[:, 1] + dist * np.cos(angle) / METERS_PER_DEGREE
+    lon = mid[:, 0] + dist * np.sin(angle) / (METERS_PER_DEGREE * np.cos(np.radians(mid[:, 1])))
+    bearing = (snapper.heading[idx] + rng.normal(0, 10, n)) % 360
+    return pd.DataFrame({"latitude": lat, "longitude": lon, "bearing": bearing})
+
+def meters(a: Point, b: Point) -> float:
+    return float(np.hypot((a.x - b.x) * METERS_PER_DEGREE * np.cos(np.radians(a.y)), (a.y - b.y) * METERS_PER_DEGREE))
+
+def run(segments_path: str, osrm_host: str, n: int, offset_m: float, csv_path: str, tolerance_m: float):
+    snapper = LocalRoadSnapper.from_file(segments_path)
+    df = pd.read_csv(csv_path) if csv_path else sample_points(snapper, n, offset_m)
+    points = [Point(x, y) for x, y in zip(df["longitude"], df["latitude"])]
+    bearings = df["bearing"].tolist() if "bearing" in df else None
+
+    start = time.perf_counter()
+    local = snapper.snap_many(points, bearings)
+    local_s = time.perf_counter() - start
+
+    # Cold cache, full precision: measures OSRM itself, not the snap cache
+    osrm = OSRMMatcher(osrm_host, cache_size=1, decimals=7, bearing_bucket_deg=1)
+    start = time.perf_counter()
+    remote = osrm.snap_many(points, bearings)
+    osrm_s = time.perf_counter() - start
+
+    gap = np.array([meters(a, b) for a, b in zip(local, remote)])
+    snapped_local = np.array([not a.equals(p) for a, p in zip(local, points)])
+    snapped_osrm = np.array([not b.equals(p) for b, p in zip(remote, points)])
+
+    print(f"points={len(points):,}  local snapped {snapped_local.mean():.1%}  osrm snapped {snapped_osrm.mean():.1%}")
+    print(f"  agreement (<= {tolerance_m} m): {(gap <= tolerance_m).mean():.2%}")
+    print(f"  distance local vs osrm: p50 {np.percentile(gap, 50):.2f} m  p90 {np.percentile(gap, 90):.2f} m  "
+          f"p99 {np.percentile(gap, 99):.2f} m  max {gap.max():.2f} m")
+    print(f"  latency: local {local_s / len(points) * 1e6:,.1f} us/pt  osrm {osrm_s / len(points) * 1e6:,.1f} us/pt "
+          f"(x{osrm_s / local_s:,.1f})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("segments")
+    parser.add_argument("--osrm", default="http://localhost:5000")
+    parser.add_argument("--points", type=int, default=2000)
+    parser.add_argument("--offset-m", type=float, default=15.0)
+    parser.add_argument("--csv", default=None)
+    parser.add_argument("--tolerance-m", type=float, default=2.0)
+    args = parser.parse_args()
+    run(args.segments, args.osrm, args.points, args.offset_m, args.csv, args.tolerance_m)
@@ -0,0 +1,73 @@
+# scripts/extract_road_segments.py
+# Builds the refinery's local road-snapping index input (SNAP_ENGINE=local) from
+# the same .osm.pbf the OSRM image is built from (infrastructure/osrm).
+# Usage (from vectra-platform/): python scripts/extract_road_segments.py map.osm.pbf road_segments.npz
+# Requires pyosmium (pip install -r scripts/requirements.txt); only needed where the file is built.
+import argparse
+import time
+
+import numpy as np
+
+try:
+    import osmium
+except ImportError as e:
+    raise SystemExit("pyosmium is required: pip install -r scripts/requirements.txt") from e
+
+# Ways the OSRM car profile routes on (approximation of car.lua's highway whitelist)
+DRIVABLE = {
+    "motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+    "secondary", "secondary_link", "tertiary", "tertiary_link", "unclassified",
+    "residential", "living_street", "service", "road",
+}
+NO_ACCESS = {"no", "private", "agricultural", "forestry", "emergency", "psv", "delivery"}
+IMPLIED_ONEWAY = {"motorway", "motorway_link", "trunk_link", "primary_link"}
+
+class RoadSegments(osmium.SimpleHandler):
+    def __init__(self):
+        super().__init__()
+        self.coords = []  # per way: (n, 2) lon/lat in travel direction
+        self.oneway = []
+
+    def way(self, w):
+        highway = w.tags.get("highway")
+        if highway not in DRIVABLE or w.tags.get("area") == "yes":
+            return
+        if w.tags.get("access") in NO_ACCESS or w.tags.get("motor_vehicle") in NO_ACCESS:
+            return
+        try:
+            line = np.array([(n.lon, n.lat) for n in w.nodes], dtype=np.float64)
+        except osmium.InvalidLocationError:
+            return # Way leaves the extract
+        if len(line) < 2:
+            return
+
+        oneway = w.tags.get("oneway")
+        if oneway == "-1":
+            line, is_oneway = line[::-1], True
+        elif oneway in ("yes", "true", "1"):
+            is_oneway = True
+        elif oneway == "no":
+            is_oneway = False
+        else:
+            is_oneway = highway in IMPLIED_ONEWAY or w.tags.get("junction") in ("roundabout", "circular")
+        self.coords.append(line)
+        self.oneway.append(is_oneway)
+
+def extract(pbf_path: str, out_path: str):
+    start = time.perf_counter()
+    handler = RoadSegments()
+    handler.apply_file(pbf_path, locations=True)
+
+    # Explode polylines into (start, end) segments
+    segments = np.concatenate([np.stack([c[:-1], c[1:]], axis=1) for c in handler.coords])
+    oneway = np.repeat(np.array(handler.oneway, dtype=bool), [len(c) - 1 for c in handler.coords])
+    np.savez_compressed(out_path, segments=segments, oneway=oneway)
+    print(f"{len(handler.coords):,} ways -> {len(segments):,} segments "
+          f"({oneway.mean():.1%} oneway) in {time.perf_counter() - start:.1f}s -> {out_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pbf")
+    parser.add_argument("out", nargs="?", default="road_segments.npz")
+    args = parser.parse_args()
+    extract(args.pbf, args.out)
@@ -55,6 +55,18 @@ CREATE TABLE IF NOT EXISTS refined_locations (
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Work queue for the refinery: one row per geohash with unrefined SCANs.
+-- Upserted by the stream consumer, leased with FOR UPDATE SKIP LOCKED
+-- (claimed_until) and deleted when the refinery commits the cell's result.
+CREATE TABLE IF NOT EXISTS dirty_geohashes (
+    geohash VARCHAR(12) PRIMARY KEY,
+    last_event_at TIMESTAMPTZ NOT NULL,
+    pending_count INTEGER NOT NULL DEFAULT 0,
+    claimed_until TIMESTAMPTZ
+);
+
+CREATE INDEX idx_dirty_last_event ON dirty_geohashes (last_event_at);
+
 -- The Feedback table (Ground Truth)
 CREATE TABLE IF NOT EXISTS location_feedback (
     id SERIAL PRIMARY KEY,
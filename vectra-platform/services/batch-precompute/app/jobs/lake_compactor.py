@@ -0,0 +1,208 @@
+import datetime
+import json
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+import structlog
+from services.common.python import lake
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+SOURCES_KEY = b"vectra.compacted_from" # Parquet footer metadata of compacted files
+
+def s3_filesystem() -> pafs.S3FileSystem:
+    if not settings.S3_ENDPOINT:
+        return pafs.S3FileSystem(access_key=settings.AWS_ACCESS_KEY, secret_key=settings.AWS_SECRET_KEY)
+    endpoint = urlparse(settings.S3_ENDPOINT)
+    return pafs.S3FileSystem(
+        access_key=settings.AWS_ACCESS_KEY, secret_key=settings.AWS_SECRET_KEY,
+        endpoint_override=endpoint.netloc, scheme=endpoint.scheme or "https"
+    )
+
+def plan_groups(files, target_bytes: int):
+    """Greedy packing of (key, size) files, in key (= arrival) order, into groups of ~target_bytes."""
+    groups, current, current_bytes = [], [], 0
+    for key, size in files:
+        if current and current_bytes + size > target_bytes:
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(key)
+        current_bytes += size
+    if current:
+        groups.append(current)
+    return [g for g in groups if len(g) > 1]
+
+class LakeCompactor:
+    """
+    Offline job: merges the stream consumer's small per-batch Parquet files into
+    ~LAKE_TARGET_FILE_MB files per Hive partition and rewrites traces/_manifest.json
+    (every data file with its partition and size) so readers can skip listing.
+    Run periodically (e.g. hourly CronJob).
+
+    Crash safety: before a group is merged, a journal object under
+    traces/_compaction/ names the output and its inputs; it is removed once the
+    inputs are deleted. The next run only re-checks journaled groups: a complete
+    output means its leftover inputs go, otherwise the partial output goes.
+    """
+    def __init__(self, filesystem: pafs.FileSystem = None, bucket: str = None):
+        self.fs = filesystem or s3_filesystem()
+        self.root = bucket or settings.S3_BUCKET_NAME
+        self.target_bytes = settings.LAKE_TARGET_FILE_MB * 1024 * 1024
+        self.small_bytes = settings.LAKE_SMALL_FILE_MB * 1024 * 1024
+
+    def _path(self, key: str) -> str:
+        return f"{self.root}/{key}"
+
+    def _key(self, path: str) -> str:
+        return path[len(self.root) + 1:]
+
+    def _list(self) -> dict:
+        """{partition path: [FileInfo of data files]}"""
+        selector = pafs.FileSelector(self._path(lake.LAKE_PREFIX), recursive=True, allow_not_found=True)
+        partitions = defaultdict(list)
+        for info in self.fs.get_file_info(selector):
+            key = self._key(info.path)
+            if info.type == pafs.FileType.File and key.endswith(".parquet"):
+                partitions[key.rsplit("/", 1)[0]].append(info)
+        return partitions
+
+    def _load_manifest(self) -> dict:
+        try:
+            with self.fs.open_input_stream(self._path(lake.MANIFEST_KEY)) as f:
+                return json.loads(f.read())
+        except (FileNotFoundError, OSError):
+            return {"files": []}
+
+    def _journal_key(self, out_key: str) -> str:
+        return f"{lake.JOURNAL_PREFIX}/{out_key.rsplit('/', 1)[-1][:-len('.parquet')]}.json"
+
+    def _finish_interrupted(self) -> int:
+        """Completes or rolls back the groups journaled by an interrupted run; returns files removed."""
+        selector = pafs.FileSelector(self._path(lake.JOURNAL_PREFIX), allow_not_found=True)
+        removed = 0
+        for journal in self.fs.get_file_info(selector):
+            with self.fs.open_input_stream(journal.path) as f:
+                entry = json.loads(f.read())
+            out_path = self._path(entry["output"])
+            try:
+                # Footer only written on close: readable means the output is complete
+                metadata = pq.read_metadata(out_path, filesystem=self.fs).metadata or {}
+                complete = json.loads(metadata.get(SOURCES_KEY, b"[]")) == entry["sources"]
+            except (FileNotFoundError, OSError, pa.ArrowInvalid):
+                complete = False
+            if complete:
+                stale = entry["sources"]
+            else:
+                stale = [entry["output"]]
+            for key in stale:
+                if self.fs.get_file_info(self._path(key)).type == pafs.FileType.File:
+                    self.fs.delete_file(self._path(key))
+                    removed += 1
+            self.fs.delete_file(journal.path)
+            logger.info("Interrupted compaction recovered", output=entry["output"], completed=complete)
+        return removed
+
+    def compact_group(self, partition: str, keys: list) -> dict:
+        """Merges one group of files into a compacted file; returns its manifest entry."""
+        out_key = f"{partition}/compacted-{uuid.uuid4().hex}.parquet"
+        journal_path = self._path(self._journal_key(out_key))
+        with self.fs.open_output_stream(journal_path) as f:
+            f.write(json.dumps({"output": out_key, "sources": keys}).encode())
+        schema, writer, pending, pending_rows, rows = None, None, [], 0, 0
+
+        def flush():
+            # Row groups sorted by cell and time: min/max statistics prune geohash filters
+            table = pa.concat_tables(pending).sort_by([("geohash", "ascending"), ("timestamp_ms", "ascending")])
+            writer.write_table(table, row_group_size=lake.ROW_GROUP_ROWS)
+
+        sink = self.fs.open_output_stream(self._path(out_key))
+        completed = False
+        try:
+            for key in keys:
+                table = pq.read_table(self._path(key), filesystem=self.fs)
+                if writer is None:
+                    schema = table.schema.with_metadata({SOURCES_KEY: json.dumps(keys).encode()})
+                    options = {k: v for k, v in lake.write_options().items() if k != "row_group_size"}
+                    writer = pq.ParquetWriter(sink, schema, **options)
+                pending.append(table.cast(schema))
+                pending_rows += table.num_rows
+                rows += table.num_rows
+                # Bounded memory: at most one row group buffered
+                if pending_rows >= lake.ROW_GROUP_ROWS:
+                    flush()
+                    pending, pending_rows = [], 0
+            if pending:
+                flush()
+            completed = True
+        finally:
+            if writer is not None:
+                writer.close()
+            sink.close()
+            if not completed:
+                # A partial file would duplicate rows of the inputs that stay
+                self.fs.delete_file(self._path(out_key))
+                self.fs.delete_file(journal_path)
+
+        # The compacted file is durable: its inputs can go
+        for key in keys:
+            self.fs.delete_file(self._path(key))
+        self.fs.delete_file(journal_path)
+        size = self.fs.get_file_info(self._path(out_key)).size
+        return {"key": out_key, "bytes": size, "rows": rows, "sources": len(keys)}
+
+    def _write_manifest(self, partitions: dict, rows: dict):
+        files = []
+        for partition, infos in sorted(partitions.items()):
+            values = dict(part.split("=", 1) for part in partition.split("/")[1:])
+            for info in sorted(infos, key=lambda i: i.path):
+                key = self._key(info.path)
+                entry = {"key": key, "partition": values, "bytes": info.size}
+                if key in rows:
+                    entry["rows"] = rows[key]
+                files.append(entry)
+        manifest = {
+            "version": 1,
+            "updated_at": datetime.datetime.utcnow().isoformat() + "Z",
+            "partitioning": ["date", "geohash_p4"],
+            "files": files,
+        }
+        with self.fs.open_output_stream(self._path(lake.MANIFEST_KEY)) as f:
+            f.write(json.dumps(manifest).encode())
+
+    def run(self):
+        logger.info("Starting Lake Compaction...")
+        self.fs.create_dir(self._path(lake.JOURNAL_PREFIX), recursive=True)
+        leftovers = self._finish_interrupted()
+        partitions = self._list()
+        rows = {entry["key"]: entry["rows"] for entry in self._load_manifest()["files"] if "rows" in entry}
+
+        # Young files may still be rewritten by a retrying consumer batch (same key)
+        cutoff = time.time() - settings.LAKE_COMPACTION_MIN_FILE_AGE_SECONDS
+        compacted = {}
+        for partition, infos in sorted(partitions.items()):
+            small = sorted(
+                (self._key(i.path), i.size) for i in infos
+                if i.size < self.small_bytes and i.mtime is not None and i.mtime.timestamp() < cutoff
+            )
+            for keys in plan_groups(small, self.target_bytes):
+                try:
+                    entry = self.compact_group(partition, keys)
+                    compacted[entry["key"]] = entry
+                    rows[entry["key"]] = entry["rows"]
+                    logger.info("Partition compacted", partition=partition, **entry)
+                except Exception as e:
+                    logger.error("Partition compaction failed", partition=partition, error=str(e))
+
+        self._write_manifest(self._list() if compacted else partitions, rows)
+        logger.info("Lake Compaction Complete.", partitions=len(partitions), compacted_files=len(compacted),
+                    merged_files=sum(e["sources"] for e in compacted.values()), leftovers_removed=leftovers)
+
+if __name__ == "__main__":
+    compactor = LakeCompactor()
+    compactor.run()
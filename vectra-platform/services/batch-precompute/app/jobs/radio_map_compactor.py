@@ -0,0 +1,149 @@
+import datetime
+import numpy as np
+import structlog
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+from cassandra.query import BatchStatement, BatchType, tuple_factory
+from services.common.python import geohash as vgh
+from app.core.config import settings
+
+logger = structlog.get_logger()
+
+BIN_PRECISION = 8 # Same synthetic reference points as the Wi-Fi locator
+
+SELECT_CELLS = "SELECT DISTINCT geohash_p6 FROM radio_map"
+# Single-partition filter: only scans up to the watermark, the locator replays the rest
+SELECT_SCANS = (
+    "SELECT latitude, longitude, bssids FROM radio_map WHERE geohash_p6 = ? AND created_at <= ? ALLOW FILTERING"
+)
+INSERT_BIN = """
+    INSERT INTO radio_map_compacted (geohash_p6, bin_p8, latitude, longitude, scan_count,
+                                     rssi_mean, rssi_var, rssi_hits, compacted_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def compact_cell(pages):
+    """
+    Aggregates raw scans (pages of (latitude, longitude, bssids) tuples) into p8 bins.
+    Returns a list of (bin_p8, lat, lon, scan_count, rssi_mean, rssi_var, rssi_hits).
+    """
+    vocabulary = {}
+    lats, lons, sizes, cols, vals = [], [], [], [], []
+    for page in pages:
+        if not page:
+            continue
+        page_lats, page_lons, maps = zip(*page)
+        lats.append(np.asarray(page_lats, dtype=np.float64))
+        lons.append(np.asarray(page_lons, dtype=np.float64))
+        sizes.append(np.fromiter((len(m) for m in maps), dtype=np.intp, count=len(maps)))
+        cols.append(np.fromiter((vocabulary.setdefault(mac, len(vocabulary)) for m in maps for mac in m), dtype=np.intp))
+        vals.append(np.fromiter((v for m in maps for v in m.values()), dtype=np.float64))
+
+    if not lats:
+        return []
+
+    lats, lons = np.concatenate(lats), np.concatenate(lons)
+    cell_ids, row_of_scan = np.unique(vgh.encode_int(lats, lons, BIN_PRECISION), return_inverse=True)
+    row_of_scan = row_of_scan.reshape(-1)
+    rows = np.repeat(row_of_scan, np.concatenate(sizes))
+    cols, vals = np.concatenate(cols), np.concatenate(vals)
+
+    # Sum, sum of squares and count per (bin, BSSID) in one scatter each
+    shape = (len(cell_ids), len(vocabulary))
+    sums, sq_sums = np.zeros(shape), np.zeros(shape)
+    hits = np.zeros(shape, dtype=np.int64)
+    np.add.at(sums, (rows, cols), vals)
+    np.add.at(sq_sums, (rows, cols), vals ** 2)
+    np.add.at(hits, (rows, cols), 1)
+
+    heard = hits > 0
+    means = np.divide(sums, hits, out=np.zeros(shape), where=heard)
+    variances = np.maximum(np.divide(sq_sums, hits, out=np.zeros(shape), where=heard) - means ** 2, 0.0)
+
+    counts = np.bincount(row_of_scan, minlength=len(cell_ids))
+    bin_lats = np.bincount(row_of_scan, weights=lats, minlength=len(cell_ids)) / counts
+    bin_lons = np.bincount(row_of_scan, weights=lons, minlength=len(cell_ids)) / counts
+
+    macs = np.array(list(vocabulary), dtype=object)
+    bins = []
+    for row, key in enumerate(vgh.int_to_str(cell_ids, BIN_PRECISION)):
+        heard_cols = np.nonzero(heard[row])[0]
+        names = macs[heard_cols]
+        bins.append((
+            key, float(bin_lats[row]), float(bin_lons[row]), int(counts[row]),
+            dict(zip(names, means[row, heard_cols].tolist())),
+            dict(zip(names, variances[row, heard_cols].tolist())),
+            dict(zip(names, hits[row, heard_cols].tolist()))
+        ))
+    return bins
+
+class RadioMapCompactor:
+    """
+    Offline job: rewrites every radio_map partition into radio_map_compacted so the
+    Wi-Fi locator never re-aggregates raw scans on the request path.
+    Run periodically (e.g. nightly CronJob); each run recompacts cells from scratch.
+    """
+    def __init__(self):
+        profile = ExecutionProfile(
+            load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+            request_timeout=settings.CASSANDRA_REQUEST_TIMEOUT,
+            row_factory=tuple_factory
+        )
+        cluster = Cluster(
+            contact_points=settings.CASSANDRA_HOSTS,
+            port=settings.CASSANDRA_PORT,
+            execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+            protocol_version=4
+        )
+        self.session = cluster.connect(settings.CASSANDRA_KEYSPACE)
+        self.select_scans = self.session.prepare(SELECT_SCANS)
+        self.select_scans.fetch_size = settings.COMPACTION_FETCH_SIZE
+        self.insert_bin = self.session.prepare(INSERT_BIN)
+
+    def _pages(self, ghash: str, watermark: datetime.datetime):
+        result = self.session.execute(self.select_scans, (ghash, watermark))
+        while True:
+            yield result.current_rows
+            if not result.has_more_pages:
+                break
+            result.fetch_next_page()
+
+    def compact(self, ghash: str) -> int:
+        # The bins hold exactly the scans up to compacted_at; the locator replays
+        # created_at > compacted_at, so a scan landing during the read is counted
+        # once. The lag keeps writes still in flight (and skewed clocks) on the
+        # replay side of the watermark.
+        compacted_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.COMPACTION_WATERMARK_LAG_SECONDS)
+        bins = compact_cell(self._pages(ghash, compacted_at))
+
+        # radio_map has no TTL, so bins only ever appear; upserts are sufficient
+        futures = []
+        step = settings.COMPACTION_BATCH_STATEMENTS
+        for start in range(0, len(bins), step):
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED) # Single partition
+            for b in bins[start:start + step]:
+                batch.add(self.insert_bin, (ghash, *b, compacted_at))
+            futures.append(self.session.execute_async(batch))
+        for f in futures:
+            f.result()
+        return len(bins)
+
+    def run(self, geohashes=None):
+        logger.info("Starting Radio Map Compaction...")
+        if geohashes is None:
+            geohashes = [row[0] for row in self.session.execute(SELECT_CELLS)]
+
+        total_bins = 0
+        for ghash in geohashes:
+            try:
+                n_bins = self.compact(ghash)
+                total_bins += n_bins
+                logger.info("Cell compacted", geohash=ghash, bins=n_bins)
+            except Exception as e:
+                logger.error("Cell compaction failed", geohash=ghash, error=str(e))
+
+        logger.info("Radio Map Compaction Complete.", cells=len(geohashes), bins=total_bins)
+
+if __name__ == "__main__":
+    compactor = RadioMapCompactor()
+    compactor.run()
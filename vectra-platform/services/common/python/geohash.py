@@ -0,0 +1,156 @@
+"""
+Vectorized geohash kernels shared by all services.
+
+Works on whole NumPy arrays instead of one point at a time. Cells are handled
+as integer-packed IDs (the 5*precision interleaved lon/lat bits of the geohash,
+lon first) and only converted to base32 strings at the edges.
+"""
+import numpy as np
+from typing import Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_BYTES = np.frombuffer(BASE32.encode("ascii"), dtype=np.uint8)
+_BASE32_LOOKUP = np.full(256, 255, dtype=np.uint8)
+_BASE32_LOOKUP[_BASE32_BYTES] = np.arange(32, dtype=np.uint8)
+
+MAX_PRECISION = 12 # 60 bits, fits in a uint64
+
+# Neighbor ring order: N, NE, E, SE, S, SW, W, NW as (d_lat, d_lon) cell steps
+NEIGHBOR_OFFSETS = np.array(
+    [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)], dtype=np.int64
+)
+
+_U = np.uint64
+
+def _spread(x: np.ndarray) -> np.ndarray:
+    """Inserts a zero bit between each of the low 32 bits (Morton spread)."""
+    x = x & _U(0x00000000FFFFFFFF)
+    x = (x | (x << _U(16))) & _U(0x0000FFFF0000FFFF)
+    x = (x | (x << _U(8))) & _U(0x00FF00FF00FF00FF)
+    x = (x | (x << _U(4))) & _U(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x << _U(2))) & _U(0x3333333333333333)
+    x = (x | (x << _U(1))) & _U(0x5555555555555555)
+    return x
+
+def _compact(x: np.ndarray) -> np.ndarray:
+    """Inverse of _spread: gathers the even bits into the low 32 bits."""
+    x = x & _U(0x5555555555555555)
+    x = (x | (x >> _U(1))) & _U(0x3333333333333333)
+    x = (x | (x >> _U(2))) & _U(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x >> _U(4))) & _U(0x00FF00FF00FF00FF)
+    x = (x | (x >> _U(8))) & _U(0x0000FFFF0000FFFF)
+    x = (x | (x >> _U(16))) & _U(0x00000000FFFFFFFF)
+    return x
+
+def _bits(precision: int) -> Tuple[int, int]:
+    """(lat_bits, lon_bits) for a precision; lon gets the extra bit when odd."""
+    if not 1 <= precision <= MAX_PRECISION:
+        raise ValueError(f"precision must be in [1, {MAX_PRECISION}], got {precision}")
+    total = 5 * precision
+    return total // 2, total - total // 2
+
+def _quantize(values: np.ndarray, lo: float, span: float) -> np.ndarray:
+    scaled = np.floor((np.asarray(values, dtype=np.float64) - lo) / span * 4294967296.0)
+    return np.clip(scaled, 0, 4294967295).astype(np.uint64)
+
+def _interleave(lat_idx: np.ndarray, lon_idx: np.ndarray, precision: int) -> np.ndarray:
+    """Packs per-axis cell indices (at this precision) into cell IDs."""
+    lat_bits, lon_bits = _bits(precision)
+    lat32 = lat_idx.astype(np.uint64) << _U(32 - lat_bits)
+    lon32 = lon_idx.astype(np.uint64) << _U(32 - lon_bits)
+    morton = (_spread(lon32) << _U(1)) | _spread(lat32)
+    return morton >> _U(64 - 5 * precision)
+
+def _deinterleave(cell_ids: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Unpacks cell IDs into per-axis cell indices (at this precision)."""
+    lat_bits, lon_bits = _bits(precision)
+    morton = np.asarray(cell_ids, dtype=np.uint64) << _U(64 - 5 * precision)
+    lon32 = _compact(morton >> _U(1))
+    lat32 = _compact(morton)
+    return lat32 >> _U(32 - lat_bits), lon32 >> _U(32 - lon_bits)
+
+def encode_int(lat, lon, precision: int = 7) -> np.ndarray:
+    """Encodes lat/lon arrays into integer-packed cell IDs (uint64)."""
+    _bits(precision)
+    # Quantize both axes to 32 bits once; truncating the interleaved word to
+    # 5*precision bits is the same as quantizing at that precision.
+    lat32 = _quantize(lat, -90.0, 180.0)
+    lon32 = _quantize(lon, -180.0, 360.0)
+    morton = (_spread(lon32) << _U(1)) | _spread(lat32)
+    return morton >> _U(64 - 5 * precision)
+
+def int_to_str(cell_ids, precision: int = 7) -> np.ndarray:
+    """Converts cell IDs to geohash strings (object array of str)."""
+    cell_ids = np.asarray(cell_ids, dtype=np.uint64)
+    shifts = _U(5) * np.arange(precision - 1, -1, -1, dtype=np.uint64)
+    digits = (cell_ids[..., None] >> shifts) & _U(31)
+    chars = _BASE32_BYTES[digits.astype(np.intp)]
+    return np.ascontiguousarray(chars).view(f"S{precision}")[..., 0].astype(str).astype(object)
+
+def str_to_int(hashes) -> Tuple[np.ndarray, int]:
+    """
+    Converts geohash strings (all of the same precision) to cell IDs.
+    Returns (cell_ids, precision).
+    """
+    raw = np.asarray(hashes, dtype="S")
+    precision = raw.dtype.itemsize
+    chars = raw.reshape(-1).view(np.uint8).reshape(-1, precision)
+    digits = _BASE32_LOOKUP[chars]
+    if np.any(digits == 255):
+        raise ValueError("invalid geohash character")
+    shifts = _U(5) * np.arange(precision - 1, -1, -1, dtype=np.uint64)
+    cell_ids = np.bitwise_or.reduce(digits.astype(np.uint64) << shifts, axis=1)
+    return cell_ids.reshape(raw.shape), precision
+
+def encode(lat, lon, precision: int = 7) -> np.ndarray:
+    """Encodes lat/lon arrays into geohash strings (object array of str)."""
+    return int_to_str(encode_int(lat, lon, precision), precision)
+
+def decode_int(cell_ids, precision: int = 7) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Cell IDs -> (lat, lon, lat_err, lon_err) of cell centers, as in pygeohash.decode_exactly."""
+    lat_bits, lon_bits = _bits(precision)
+    lat_idx, lon_idx = _deinterleave(cell_ids, precision)
+    lat_step = 180.0 / (1 << lat_bits)
+    lon_step = 360.0 / (1 << lon_bits)
+    lat = -90.0 + (lat_idx.astype(np.float64) + 0.5) * lat_step
+    lon = -180.0 + (lon_idx.astype(np.float64) + 0.5) * lon_step
+    return lat, lon, np.full(lat.shape, lat_step / 2), np.full(lon.shape, lon_step / 2)
+
+def decode(hashes) -> Tuple[np.ndarray, np.ndarray]:
+    """Geohash strings -> (lat, lon) cell centers."""
+    cell_ids, precision = str_to_int(hashes)
+    lat, lon, _, _ = decode_int(cell_ids, precision)
+    return lat, lon
+
+def neighbors_int(cell_ids, precision: int = 7, ring: int = 1) -> np.ndarray:
+    """
+    Cell IDs of the square ring at Chebyshev distance `ring` around each cell,
+    shape (n, 8 * ring). Longitude wraps at the antimeridian; latitude clamps at
+    the poles (so polar rings may contain duplicates).
+    """
+    lat_bits, lon_bits = _bits(precision)
+    lat_idx, lon_idx = _deinterleave(np.atleast_1d(cell_ids), precision)
+    if ring == 1:
+        offsets = NEIGHBOR_OFFSETS
+    else:
+        steps = np.arange(-ring, ring + 1)
+        d_lat, d_lon = np.meshgrid(steps, steps, indexing="ij")
+        on_ring = np.maximum(np.abs(d_lat), np.abs(d_lon)) == ring
+        offsets = np.stack([d_lat[on_ring], d_lon[on_ring]], axis=1)
+
+    lat_n = np.clip(lat_idx.astype(np.int64)[:, None] + offsets[:, 0], 0, (1 << lat_bits) - 1)
+    lon_n = np.mod(lon_idx.astype(np.int64)[:, None] + offsets[:, 1], 1 << lon_bits)
+    return _interleave(lat_n, lon_n, precision)
+
+def neighbors(hashes, ring: int = 1) -> np.ndarray:
+    """Geohash strings -> (n, 8 * ring) object array of neighbor geohash strings."""
+    cell_ids, precision = str_to_int(np.atleast_1d(hashes))
+    return int_to_str(neighbors_int(cell_ids, precision, ring), precision)
+
+def encode_one(lat: float, lon: float, precision: int = 7) -> str:
+    """Scalar convenience wrapper, drop-in for pygeohash.encode."""
+    return encode(np.array([lat]), np.array([lon]), precision)[0]
+
+def neighbors_one(ghash: str) -> list:
+    """Scalar convenience wrapper: the 8 neighbors of one geohash."""
+    return list(neighbors([ghash])[0])
@@ -0,0 +1,64 @@
+"""
+Layout of the raw-trace Parquet lake, shared by its writer (stream-consumer)
+and its maintenance jobs (batch-precompute lake compaction).
+
+    traces/date=YYYY-MM-DD/geohash_p4=xxxx/part-<batch>.parquet
+    traces/date=YYYY-MM-DD/geohash_p4=xxxx/compacted-<id>.parquet
+    traces/_manifest.json
+    traces/_compaction/<id>.json      (in-flight compactions, see LakeCompactor)
+
+Partition values live in the path only (Hive style, readers add them back as
+columns). Files are zstd-compressed with dictionary-encoded low-cardinality
+columns; the compaction job rewrites small files into ~128 MB ones.
+"""
+import io
+from typing import Iterator, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+LAKE_PREFIX = "traces"
+MANIFEST_KEY = f"{LAKE_PREFIX}/_manifest.json"
+JOURNAL_PREFIX = f"{LAKE_PREFIX}/_compaction" # Underscore: skipped by Hive dataset discovery
+PARTITION_PRECISION = 4 # ~39 x 20 km: a metro area is a handful of partitions per day
+DICTIONARY_COLUMNS = ["driver_id", "vehicle_id", "event_type"]
+ROW_GROUP_ROWS = 1_000_000
+
+def write_options(row_group_rows: int = ROW_GROUP_ROWS) -> dict:
+    """Keyword arguments for pq.write_table / pq.ParquetWriter."""
+    return {
+        "compression": "zstd",
+        "use_dictionary": DICTIONARY_COLUMNS,
+        "write_statistics": True,
+        "row_group_size": row_group_rows,
+    }
+
+def partition_path(date: str, geohash_p4: str) -> str:
+    return f"{LAKE_PREFIX}/date={date}/geohash_p4={geohash_p4}"
+
+def split_partitions(table: pa.Table) -> Iterator[Tuple[str, pa.Table]]:
+    """
+    Splits a trace batch (timestamp_ms and geohash columns) into its lake
+    partitions, yielding (partition path, rows sorted by geohash and time).
+    """
+    if table.num_rows == 0:
+        return
+    day = table["timestamp_ms"].to_numpy() // 86_400_000
+    p4 = pc.utf8_slice_codeunits(table["geohash"], 0, PARTITION_PRECISION).to_numpy(zero_copy_only=False).astype(str)
+    # One sort groups partitions and clusters rows by cell inside each file (row-group pruning)
+    order = np.lexsort((table["timestamp_ms"].to_numpy(), table["geohash"].to_numpy(zero_copy_only=False).astype(str), p4, day))
+    day, p4 = day[order], p4[order]
+    table = table.take(pa.array(order))
+    boundaries = np.flatnonzero((day[1:] != day[:-1]) | (p4[1:] != p4[:-1])) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(day)]])
+    dates = np.datetime_as_string(day[starts].astype("datetime64[D]"))
+    for start, end, date in zip(starts, ends, dates):
+        yield partition_path(str(date), p4[start]), table.slice(start, end - start)
+
+def to_parquet_bytes(table: pa.Table) -> bytes:
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, **write_options())
+    return buffer.getvalue()
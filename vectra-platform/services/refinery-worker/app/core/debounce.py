@@ -0,0 +1,79 @@
+import time
+from typing import Dict, Iterable, List, Optional
+
+class _CellActivity:
+    __slots__ = ("scans", "first_seen", "last_seen", "not_before")
+
+    def __init__(self, now: float):
+        self.scans = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.not_before = 0.0
+
+class GeohashDebouncer:
+    """
+    Time-windowed buffer of per-geohash SCAN activity for the streaming refinery.
+    A cell becomes due when any of these holds:
+      - it has collected `scan_threshold` new SCANs (busy cell: refine now),
+      - no SCAN arrived for `idle_seconds` (a visit ended: refine once),
+      - it has been pending for `max_wait_seconds` (steady trickle: cap staleness).
+    Cells handed back with retry() are due again once their delay has passed.
+    """
+    def __init__(self, scan_threshold: int = 20, idle_seconds: float = 15.0, max_wait_seconds: float = 120.0):
+        self.scan_threshold = scan_threshold
+        self.idle_seconds = idle_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.pending: Dict[str, _CellActivity] = {}
+        self._popped: Dict[str, _CellActivity] = {} # Last pop_due result, for retry()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, geohashes: Iterable[str], now: Optional[float] = None):
+        """Records one SCAN per entry (repeats count multiple times)."""
+        now = time.monotonic() if now is None else now
+        for ghash in geohashes:
+            cell = self.pending.get(ghash)
+            if cell is None:
+                cell = self.pending[ghash] = _CellActivity(now)
+            cell.scans += 1
+            cell.last_seen = now
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        """Removes and returns due cells, longest-pending first."""
+        now = time.monotonic() if now is None else now
+        due = [
+            (cell.first_seen, ghash) for ghash, cell in self.pending.items()
+            if now >= cell.not_before and (
+                cell.scans >= self.scan_threshold
+                or now - cell.last_seen >= self.idle_seconds
+                or now - cell.first_seen >= self.max_wait_seconds
+            )
+        ]
+        due.sort()
+        if limit is not None:
+            due = due[:limit]
+        self._popped = {ghash: self.pending.pop(ghash) for _, ghash in due}
+        return [ghash for _, ghash in due]
+
+    def retry(self, geohashes: Iterable[str], delay_seconds: float, now: Optional[float] = None) -> int:
+        """
+        Puts cells from the last pop_due back, due again after `delay_seconds`
+        and merged with SCANs recorded since. Cells pending for longer than
+        `max_wait_seconds` are dropped (the caller's backstop owns them).
+        Returns the number put back.
+        """
+        now = time.monotonic() if now is None else now
+        requeued = 0
+        for ghash in geohashes:
+            popped = self._popped.pop(ghash, None)
+            if popped is None or now - popped.first_seen >= self.max_wait_seconds:
+                continue
+            cell = self.pending.get(ghash)
+            if cell is not None:
+                popped.scans += cell.scans
+                popped.last_seen = cell.last_seen
+            popped.not_before = now + delay_seconds
+            self.pending[ghash] = popped
+            requeued += 1
+        return requeued
@@ -0,0 +1,302 @@
+import io
+import csv
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from typing import Dict, Iterable, List
+from services.common.python import geohash as vgh
+
+# One round-trip per batch: the recent traces of the candidate cells and their
+# neighbors. Moving fixes are kept (not just SCAN/STOP/slow rows) because the
+# parking heuristics derive each stop's arrival heading from the approach.
+# The lookback bounds a batch's cost by traffic, not table age (and prunes the
+# monthly partitions).
+BATCH_TRACES_SQL = """
+    SELECT geohash, driver_id, vehicle_id,
+           (EXTRACT(EPOCH FROM timestamp) * 1000)::BIGINT AS timestamp_ms,
+           ST_Y(geom) AS latitude, ST_X(geom) AS longitude,
+           speed, event_type
+    FROM raw_gps_traces
+    WHERE geohash = ANY(%(cells)s)
+      AND timestamp >= NOW() - make_interval(days => %(lookback_days)s)
+    ORDER BY geohash
+"""
+
+TRACE_DTYPES = {
+    "geohash": "string",
+    "driver_id": "string",
+    "vehicle_id": "string",
+    "timestamp_ms": "int64",
+    "latitude": "float64",
+    "longitude": "float64",
+    "speed": "float64",
+    "event_type": "category",
+}
+# Same columns for Arrow's CSV reader (multithreaded, exact float parsing)
+TRACE_ARROW_TYPES = {
+    "geohash": pa.string(),
+    "driver_id": pa.string(),
+    "vehicle_id": pa.string(),
+    "timestamp_ms": pa.int64(),
+    "latitude": pa.float64(),
+    "longitude": pa.float64(),
+    "speed": pa.float64(),
+    "event_type": pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+# Claims are leases, not deletes: a claimed row stays in the queue with
+# claimed_until set and is only removed by the transaction that commits the
+# batch's results, so a worker dying mid-batch delays the cell by one lease
+# instead of losing it. SKIP LOCKED lets several refinery instances claim
+# concurrently; expired leases are claimable again.
+CLAIM_DIRTY_SQL = """
+    WITH claimed AS (
+        SELECT geohash FROM dirty_geohashes
+        WHERE (claimed_until IS NULL OR claimed_until < NOW())
+          AND last_event_at <= NOW() - make_interval(secs => %(min_age)s)
+        ORDER BY last_event_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE dirty_geohashes d
+    SET claimed_until = NOW() + make_interval(secs => %(lease)s)
+    FROM claimed
+    WHERE d.geohash = claimed.geohash
+    RETURNING d.geohash, d.last_event_at, d.pending_count, d.claimed_until
+"""
+
+# Streaming mode: claim specific cells (those the debouncer found due)
+CLAIM_CELLS_SQL = """
+    WITH claimed AS (
+        SELECT geohash FROM dirty_geohashes
+        WHERE geohash = ANY(%(cells)s)
+          AND (claimed_until IS NULL OR claimed_until < NOW())
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE dirty_geohashes d
+    SET claimed_until = NOW() + make_interval(secs => %(lease)s)
+    FROM claimed
+    WHERE d.geohash = claimed.geohash
+    RETURNING d.geohash, d.last_event_at, d.pending_count, d.claimed_until
+"""
+
+# Acknowledges a batch's claims (only those still held: claimed_until is the
+# lease token). Cells re-marked since the claim keep their new SCANs and are
+# released for the next batch instead of being deleted.
+CLAIMS_CTE = """
+    WITH done (geohash, pending_count, claimed_until) AS (
+        SELECT * FROM unnest(%(cells)s::varchar[], %(counts)s::int[], %(leases)s::timestamptz[])
+    )
+"""
+ACK_DIRTY_SQL = CLAIMS_CTE + """
+    DELETE FROM dirty_geohashes d
+    USING done
+    WHERE d.geohash = done.geohash AND d.claimed_until = done.claimed_until
+      AND d.pending_count = done.pending_count
+"""
+RELEASE_REMARKED_SQL = CLAIMS_CTE + """
+    UPDATE dirty_geohashes d
+    SET claimed_until = NULL, pending_count = GREATEST(d.pending_count - done.pending_count, 0)
+    FROM done
+    WHERE d.geohash = done.geohash AND d.claimed_until = done.claimed_until
+"""
+
+# Gives claims back untouched after a failed batch (the lease would expire anyway)
+RELEASE_DIRTY_SQL = CLAIMS_CTE + """
+    UPDATE dirty_geohashes d
+    SET claimed_until = NULL
+    FROM done
+    WHERE d.geohash = done.geohash AND d.claimed_until = done.claimed_until
+"""
+
+# Bulk upsert of a batch's results: COPY into a per-transaction staging table,
+# then a single set-based upsert (points built server-side from raw coordinates)
+STAGING_DDL = """
+    CREATE TEMP TABLE refined_staging (
+        id VARCHAR(20), nav_lon FLOAT8, nav_lat FLOAT8,
+        ep_lon FLOAT8, ep_lat FLOAT8, conf FLOAT8
+    ) ON COMMIT DROP
+"""
+STAGING_COLUMNS = ("id", "nav_lon", "nav_lat", "ep_lon", "ep_lat", "conf")
+UPSERT_REFINED_SQL = """
+    INSERT INTO refined_locations (id, nav_point, entry_point, confidence_score, updated_at)
+    SELECT id,
+           ST_SetSRID(ST_MakePoint(nav_lon, nav_lat), 4326),
+           ST_SetSRID(ST_MakePoint(ep_lon, ep_lat), 4326),
+           conf, NOW()
+    FROM refined_staging
+    ON CONFLICT (id) DO UPDATE SET
+        nav_point = EXCLUDED.nav_point,
+        entry_point = EXCLUDED.entry_point,
+        updated_at = NOW()
+"""
+
+
+class BatchTraces:
+    """
+    All trace rows for one refinery batch, sorted by geohash.
+    Per-cell lookups are row-range slices of the same frame (no re-query, no copy).
+    """
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        keys = self.df["geohash"].to_numpy(dtype=object)
+        # Row ranges of each geohash in the sorted frame
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1 if len(keys) else np.empty(0, dtype=np.int64)
+        starts = np.concatenate([[0], boundaries]) if len(keys) else boundaries
+        ends = np.concatenate([boundaries, [len(keys)]]) if len(keys) else boundaries
+        self.ranges: Dict[str, tuple] = {keys[s]: (int(s), int(e)) for s, e in zip(starts, ends)}
+
+    def cell(self, ghash: str) -> pd.DataFrame:
+        start, end = self.ranges.get(ghash, (0, 0))
+        return self.df.iloc[start:end]
+
+    def scans(self, ghash: str) -> pd.DataFrame:
+        """SCAN events of the center cell (the address is here)."""
+        df = self.cell(ghash)
+        return df[df["event_type"] == "SCAN"]
+
+    def traces(self, ghash: str) -> pd.DataFrame:
+        """Center cell + 8 neighbors (parking could be anywhere near)."""
+        frames = [self.cell(g) for g in [ghash] + vgh.neighbors_one(ghash) if g in self.ranges]
+        if not frames:
+            return self.df.iloc[0:0]
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def search_cells(candidates: Iterable[str]) -> List[str]:
+    """Union of candidate cells and their neighbor rings."""
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    rings = vgh.neighbors(candidates).reshape(-1)
+    return sorted(set(candidates).union(rings))
+
+
+def parse_trace_csv(source) -> pd.DataFrame:
+    """BATCH_TRACES_SQL rows in Postgres CSV (unquoted empty field = NULL) -> TRACE_DTYPES frame."""
+    table = pa_csv.read_csv(
+        source,
+        read_options=pa_csv.ReadOptions(column_names=list(TRACE_ARROW_TYPES)),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=TRACE_ARROW_TYPES, strings_can_be_null=True, quoted_strings_can_be_null=False
+        )
+    )
+    return table.to_pandas(types_mapper={pa.string(): pd.StringDtype()}.get)
+
+
+def load_batch_traces(engine, candidates: Iterable[str], lookback_days: int = 90) -> BatchTraces:
+    """
+    Streams the batch's rows of the last `lookback_days` with COPY ... TO STDOUT
+    (server-side CSV, parsed by Arrow's CSV reader) instead of per-geohash
+    pd.read_sql round-trips.
+    CSV rather than binary COPY: binary rows can only be walked field by field
+    in Python (~10x slower to decode, see scripts/benchmark_trace_load.py).
+    """
+    cells = search_cells(candidates)
+    buffer = io.BytesIO()
+    if cells:
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            # COPY can't take bind parameters; mogrify quotes them client-side
+            query = cursor.mogrify(BATCH_TRACES_SQL, {"cells": cells, "lookback_days": lookback_days}).decode()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT CSV)", buffer)
+        finally:
+            conn.close()
+    if buffer.tell() == 0:
+        return BatchTraces(pd.DataFrame({c: pd.Series(dtype=t) for c, t in TRACE_DTYPES.items()}))
+
+    buffer.seek(0)
+    return BatchTraces(parse_trace_csv(buffer))
+
+
+def _claim(engine, sql: str, params: dict) -> List[tuple]:
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        claimed = cursor.fetchall()
+        conn.commit()
+        return claimed
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def claim_dirty_geohashes(engine, limit: int, min_age_seconds: float = 0, lease_seconds: float = 600) -> List[tuple]:
+    """
+    Leases up to `limit` of the oldest unclaimed dirty cells for `lease_seconds`,
+    optionally only those idle for at least `min_age_seconds`.
+    Returns (geohash, last_event_at, pending_count, claimed_until) tuples.
+    """
+    return _claim(engine, CLAIM_DIRTY_SQL, {"limit": limit, "min_age": min_age_seconds, "lease": lease_seconds})
+
+
+def claim_geohashes(engine, cells: List[str], lease_seconds: float = 600) -> List[tuple]:
+    """Leases the given cells, skipping absent, leased or locked ones."""
+    if not cells:
+        return []
+    return _claim(engine, CLAIM_CELLS_SQL, {"cells": list(cells), "lease": lease_seconds})
+
+
+def _claims_params(claimed: List[tuple]) -> dict:
+    # Sorted like the stream consumer's upsert to keep row-lock order consistent
+    claimed = sorted(claimed)
+    return {
+        "cells": [c[0] for c in claimed],
+        "counts": [c[2] for c in claimed],
+        "leases": [c[3] for c in claimed],
+    }
+
+
+def release_dirty_geohashes(engine, claimed: List[tuple]):
+    """Ends the leases of claimed cells without consuming them (e.g. after a failed batch)."""
+    if not claimed:
+        return
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(RELEASE_DIRTY_SQL, _claims_params(claimed))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def upsert_refined_locations(engine, rows: List[dict], claimed: List[tuple] = ()):
+    """
+    Writes a batch of refined rows (id, nav_lon, nav_lat, ep_lon, ep_lat, conf)
+    in one transaction: one COPY and one INSERT ... SELECT ... ON CONFLICT.
+    The batch's claims are acknowledged in the same transaction, so a cell
+    leaves the queue exactly when its result is durable.
+    """
+    if not rows and not claimed:
+        return
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if rows:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # repr floats round-trip exactly through CSV
+            writer.writerows([r[c] for c in STAGING_COLUMNS] for r in rows)
+            buffer.seek(0)
+            cursor.execute(STAGING_DDL)
+            cursor.copy_expert(f"COPY refined_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT CSV)", buffer)
+            cursor.execute(UPSERT_REFINED_SQL)
+        if claimed:
+            params = _claims_params(claimed)
+            cursor.execute(ACK_DIRTY_SQL, params)
+            cursor.execute(RELEASE_REMARKED_SQL, params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -2,14 +2,23 @@ import pandas as pd
 import numpy as np
 from sklearn.cluster import DBSCAN
 from shapely.geometry import Point
+from typing import Optional, Tuple
+from app.logic.grid_dbscan import grid_dbscan, project_enu
+from app.logic.kinematics import stop_segments, circular_mean
+
+CLUSTERING_ENGINES = ("sklearn", "grid")
 
 class LocationHeuristics:
-    def __init__(self, eps_meters=20, min_samples=3):
+    def __init__(self, eps_meters=20, min_samples=3, engine="sklearn"):
+        if engine not in CLUSTERING_ENGINES:
+            raise ValueError(f"engine must be one of {CLUSTERING_ENGINES}, got {engine!r}")
         # Earth Radius in meters
         self.kms_per_radian = 6371.0088
+        self.eps_meters = eps_meters
         # Convert eps from meters to radians for Haversine
         self.eps_radians = (eps_meters / 1000.0) / self.kms_per_radian
         self.min_samples = min_samples
+        self.engine = engine
 
     def calculate_confidence(self, cluster_df: pd.DataFrame, std_dev_meters: float) -> float:
         """
@@ -29,25 +38,15 @@ class LocationHeuristics:
         
         return round(size_score * variance_penalty, 2)
 
-    def find_entry_point(self, scan_events: pd.DataFrame) -> Point:
+    def find_entry_point(self, scan_events: pd.DataFrame) -> Tuple[Optional[Point], float]:
         """
         Optimized: Uses Haversine metric for true distance clustering.
+        Returns (Point, confidence), (None, 0.0) without scans.
         """
         if len(scan_events) == 0:
-            return None
+            return None, 0.0
             
-        # Convert Lat/Lon to Radians for Scikit-Learn
-        coords_rad = np.radians(scan_events[['latitude', 'longitude']].values)
-        
-        # Optimization: metric='haversine' is O(n^2) but accurate for earth distances
-        db = DBSCAN(
-            eps=self.eps_radians, 
-            min_samples=self.min_samples, 
-            metric='haversine', 
-            algorithm='ball_tree'
-        ).fit(coords_rad)
-        
-        labels = db.labels_
+        labels = self._cluster_labels(scan_events)
         unique_labels, counts = np.unique(labels, return_counts=True)
         
         # Remove noise (-1)
@@ -58,14 +57,13 @@ class LocationHeuristics:
             
         if len(unique_labels) == 0:
             # Fallback: Weighted Mean of all points based on accuracy
-            return self._weighted_centroid(scan_events)
-            
-        dominant_label = unique_labels[np.argmax(counts)]
-        
-        # Get points in cluster (convert back to degrees later)
-        cluster_mask = (labels == dominant_label)
-        cluster_data = scan_events[cluster_mask]
-        
+            cluster_data = scan_events
+        else:
+            dominant_label = unique_labels[np.argmax(counts)]
+
+            # Get points in cluster (convert back to degrees later)
+            cluster_mask = (labels == dominant_label)
+            cluster_data = scan_events[cluster_mask]
 
         # Calculate Standard Deviation of the cluster in meters (approx)
         # 1 deg lat approx 111km -> 111,000m
@@ -79,6 +77,24 @@ class LocationHeuristics:
         conf = self.calculate_confidence(cluster_data, geo_std_dev)
         return final_pt, conf
 
+    def _cluster_labels(self, scan_events: pd.DataFrame) -> np.ndarray:
+        if self.engine == "grid":
+            # Same DBSCAN labels on local ENU meters, without materializing neighborhoods
+            xy = project_enu(scan_events['latitude'].to_numpy(), scan_events['longitude'].to_numpy())
+            return grid_dbscan(xy, self.eps_meters, self.min_samples)
+
+        # Convert Lat/Lon to Radians for Scikit-Learn
+        coords_rad = np.radians(scan_events[['latitude', 'longitude']].values)
+        
+        # Optimization: metric='haversine' is O(n^2) but accurate for earth distances
+        db = DBSCAN(
+            eps=self.eps_radians, 
+            min_samples=self.min_samples, 
+            metric='haversine', 
+            algorithm='ball_tree'
+        ).fit(coords_rad)
+        return db.labels_
+
     def _weighted_centroid(self, df: pd.DataFrame) -> Point:
         """
         Optimization: Trust points with better GPS accuracy (lower 'accuracy_m')
@@ -86,7 +102,10 @@ class LocationHeuristics:
         """
         # Inverse variance weighting (1 / accuracy^2)
         # Avoid division by zero with small epsilon
-        weights = 1 / (df['accuracy_m']**2 + 1e-6)
+        if 'accuracy_m' in df:
+            weights = 1 / (df['accuracy_m']**2 + 1e-6)
+        else:
+            weights = None # raw_gps_traces doesn't persist accuracy: plain mean
         
         # Time Decay: Newer points get higher weight (e.g., last 30 days)
         # Simple linear decay factor could be added here
@@ -96,27 +115,38 @@ class LocationHeuristics:
         
         return Point(lon, lat)
 
-    def find_parking_candidate(self, trace_history: pd.DataFrame, entry_point: Point) -> Point:
-        # (Keep existing logic but apply weighted centroid if multiple candidates exist)
-        parking_candidates = trace_history[
-            (trace_history['event_type'].isin(['STOP', 'ARRIVED'])) |
-            (trace_history['speed'] < 1.0)
-        ]
-        
-        if len(parking_candidates) == 0:
-            return None
+    def find_parking_candidate(self, trace_history: pd.DataFrame, entry_point: Point):
+        """
+        Returns (parking point, arrival bearing) from the dwell segments near the
+        entry point; the bearing is the circular mean of their arrival headings
+        (None when unknown). (None, None) when nobody stopped nearby.
+        """
+        if len(trace_history) == 0:
+            return None, None
+
+        # Dwell segments + arrival headings for every driver in one vectorized pass
+        stops = stop_segments(trace_history)
+        if len(stops) == 0:
+            return None, None
 
         # Optimization: Spatial Filter
         # Only consider parking spots within 100m of the computed Entry Point
         # (Simple box filter first for speed)
         ep_lat, ep_lon = entry_point.y, entry_point.x
         mask = (
-            (parking_candidates['latitude'].between(ep_lat - 0.001, ep_lat + 0.001)) &
-            (parking_candidates['longitude'].between(ep_lon - 0.001, ep_lon + 0.001))
+            (stops['latitude'].between(ep_lat - 0.001, ep_lat + 0.001)) &
+            (stops['longitude'].between(ep_lon - 0.001, ep_lon + 0.001))
+        ).to_numpy()
+        nearby = stops[mask]
+
+        if len(nearby) == 0:
+            return None, None
+
+        # Weighting segments by their fixes = centroid of all nearby stopped points
+        weights = nearby['n_points'].to_numpy(dtype=np.float64)
+        point = Point(
+            np.average(nearby['longitude'], weights=weights),
+            np.average(nearby['latitude'], weights=weights)
         )
-        nearby_parking = parking_candidates[mask]
-        
-        if len(nearby_parking) == 0:
-            return None
-            
-        return self._weighted_centroid(nearby_parking)
\ No newline at end of file
+        bearing = circular_mean(nearby['arrival_bearing'].to_numpy(dtype=np.float64))
+        return point, (None if np.isnan(bearing) else bearing)
@@ -0,0 +1,164 @@
+"""
+Exact DBSCAN on a uniform grid for small, locally projected point sets.
+
+Points are bucketed into square cells of side eps/sqrt(2), so every pair sharing
+a cell is within eps. A cell holding min_samples points is all-core without any
+distance test, and distances are only computed between cells at most two steps
+apart. Labels (including cluster numbering and border-point ties) match
+sklearn.cluster.DBSCAN on the same coordinates.
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8 # Mean radius, same as the haversine path
+
+# Cell steps that can hold a point within eps (5x5 block around the cell)
+_OFFSETS = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3) if (dx, dy) != (0, 0)]
+
+# Points nearest the other cell tried first when probing two dense cells
+_PROBE_FIRST = 64
+_PROBE_CHUNK = 1024
+
+
+def project_enu(lat, lon) -> np.ndarray:
+    """
+    Local east/north meters around the centroid (equirectangular).
+    Accurate to well under a millimeter over a geohash p7 cell; not meant for
+    sets spanning many kilometers or the antimeridian.
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+    lat0, lon0 = lat_rad.mean(), lon_rad.mean()
+    x = EARTH_RADIUS_M * (lon_rad - lon0) * np.cos(lat0)
+    y = EARTH_RADIUS_M * (lat_rad - lat0)
+    return np.column_stack([x, y])
+
+
+def _within(a: np.ndarray, b: np.ndarray, eps_sq: float) -> np.ndarray:
+    """(len(a), len(b)) boolean matrix of pairs within eps."""
+    dx = a[:, 0, None] - b[None, :, 0]
+    dy = a[:, 1, None] - b[None, :, 1]
+    return dx * dx + dy * dy <= eps_sq
+
+
+def _rect_gap_sq(xy: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Squared distance of each point to the axis-aligned rectangle [lo, hi]."""
+    gap = np.maximum(np.maximum(lo - xy, xy - hi), 0.0)
+    return gap[:, 0] ** 2 + gap[:, 1] ** 2
+
+
+def _facing(xy: np.ndarray, lo: np.ndarray, side: float, eps_sq: float) -> np.ndarray:
+    """Points within eps of the cell at `lo`, closest first."""
+    gap_sq = _rect_gap_sq(xy, lo, lo + side)
+    keep = np.flatnonzero(gap_sq <= eps_sq)
+    return xy[keep[np.argsort(gap_sq[keep], kind="stable")]]
+
+
+def _cells_linked(a: np.ndarray, lo_a: np.ndarray, b: np.ndarray, lo_b: np.ndarray, side: float, eps_sq: float) -> bool:
+    """Whether any pair of core points from two cells is within eps."""
+    if len(a) * len(b) <= _PROBE_FIRST * _PROBE_FIRST:
+        return bool(_within(a, b, eps_sq).any())
+    # Only points near the other cell can reach across; try the closest ones first
+    a = _facing(a, lo_b, side, eps_sq)
+    b = _facing(b, lo_a, side, eps_sq)
+    if not len(a) or not len(b):
+        return False
+    if _within(a[:_PROBE_FIRST], b[:_PROBE_FIRST], eps_sq).any():
+        return True
+    for start in range(0, len(a), _PROBE_CHUNK):
+        if _within(a[start:start + _PROBE_CHUNK], b, eps_sq).any():
+            return True
+    return False
+
+
+def _find(parent: list, i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]] # Path halving
+        i = parent[i]
+    return i
+
+
+def grid_dbscan(xy: np.ndarray, eps: float, min_samples: int) -> np.ndarray:
+    """
+    DBSCAN labels for (n, 2) planar coordinates; -1 marks noise.
+    Neighborhoods include the point itself, as in scikit-learn.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    n = len(xy)
+    labels = np.full(n, -1, dtype=np.intp)
+    if n == 0:
+        return labels
+
+    eps_sq = float(eps) ** 2
+    side = eps / np.sqrt(2.0)
+    origin = xy.min(axis=0)
+    cells, cell_of, counts = np.unique(
+        np.floor((xy - origin) / side).astype(np.int64), axis=0, return_inverse=True, return_counts=True
+    )
+    cell_of = cell_of.reshape(-1)
+    n_cells = len(cells)
+
+    # Points of each cell, ascending index (stable sort keeps input order)
+    order = np.argsort(cell_of, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    members = [order[starts[c]:starts[c + 1]] for c in range(n_cells)]
+
+    lookup = {(int(cx), int(cy)): c for c, (cx, cy) in enumerate(cells)}
+    adjacent = [
+        [lookup[key] for key in ((int(cx) + dx, int(cy) + dy) for dx, dy in _OFFSETS) if key in lookup]
+        for cx, cy in cells
+    ]
+
+    # 1. Core points: dense cells are all-core; sparse cells count their neighbors
+    core = np.zeros(n, dtype=bool)
+    for c in range(n_cells):
+        if counts[c] >= min_samples:
+            core[members[c]] = True
+            continue
+        if not adjacent[c]:
+            continue
+        others = np.concatenate([members[a] for a in adjacent[c]])
+        n_neighbors = counts[c] + _within(xy[members[c]], xy[others], eps_sq).sum(axis=1)
+        core[members[c]] = n_neighbors >= min_samples
+
+    core_members = [m[core[m]] for m in members]
+    has_core = np.array([len(m) > 0 for m in core_members])
+    if not has_core.any():
+        return labels
+
+    # 2. Core cells are internally connected; union adjacent core cells that share an eps pair
+    parent = list(range(n_cells))
+    for c in np.flatnonzero(has_core):
+        for a in adjacent[c]:
+            if a <= c or not has_core[a]:
+                continue
+            root_c, root_a = _find(parent, c), _find(parent, a)
+            if root_c == root_a: # Already joined through other cells, skip the distance test
+                continue
+            lo_c, lo_a = origin + cells[c] * side, origin + cells[a] * side
+            if _cells_linked(xy[core_members[c]], lo_c, xy[core_members[a]], lo_a, side, eps_sq):
+                parent[root_a] = root_c
+    component = np.array([_find(parent, c) for c in range(n_cells)], dtype=np.intp)
+
+    # Number clusters by their lowest core index, the order DBSCAN seeds them in
+    core_idx = np.flatnonzero(core)
+    core_component = component[cell_of[core_idx]]
+    first = np.full(n_cells, n, dtype=np.int64)
+    np.minimum.at(first, core_component, core_idx)
+    rank = np.empty(n_cells, dtype=np.intp)
+    rank[np.argsort(first, kind="stable")] = np.arange(n_cells)
+    labels[core_idx] = rank[core_component]
+
+    # 3. Border points (only in sparse cells) join the earliest-seeded reachable cluster
+    for c in np.flatnonzero(counts < min_samples):
+        border = members[c][~core[members[c]]]
+        if not len(border):
+            continue
+        reachable = np.concatenate([core_members[a] for a in [c] + adjacent[c]])
+        if not len(reachable):
+            continue
+        hit = _within(xy[border], xy[reachable], eps_sq)
+        candidate = np.where(hit, labels[reachable][None, :], np.iinfo(np.intp).max)
+        best = candidate.min(axis=1)
+        labels[border] = np.where(hit.any(axis=1), best, -1)
+
+    return labels
@@ -0,0 +1,129 @@
+"""
+Per-driver trace kinematics on contiguous NumPy arrays.
+
+All drivers are processed in one pass: rows are sorted by (driver, time) once
+and every quantity is a shifted-array difference masked at driver boundaries,
+so there is no per-group pandas work.
+"""
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+METERS_PER_DEGREE = 111320.0
+MIN_MOVE_M = 2.0 # Below this, consecutive fixes are GPS jitter: no heading
+STOP_EVENTS = ("STOP", "ARRIVED")
+STOP_SPEED_MPS = 1.0
+
+def circular_mean(bearings: np.ndarray, labels: Optional[np.ndarray] = None, n_labels: Optional[int] = None):
+    """
+    Mean direction in degrees [0, 360), ignoring NaN. With `labels`, one mean per
+    label (NaN where a label has no bearing).
+    """
+    bearings = np.asarray(bearings, dtype=np.float64)
+    valid = ~np.isnan(bearings)
+    rad = np.radians(bearings[valid])
+    if labels is None:
+        if not valid.any():
+            return np.nan
+        return float(np.degrees(np.arctan2(np.sin(rad).sum(), np.cos(rad).sum())) % 360)
+    if n_labels is None:
+        n_labels = int(np.max(labels)) + 1 if len(labels) else 0
+    labels = np.asarray(labels)[valid]
+    sin = np.bincount(labels, weights=np.sin(rad), minlength=n_labels)
+    cos = np.bincount(labels, weights=np.cos(rad), minlength=n_labels)
+    counts = np.bincount(labels, minlength=n_labels)
+    return np.where(counts > 0, np.degrees(np.arctan2(sin, cos)) % 360, np.nan)
+
+def trace_kinematics(traces: pd.DataFrame) -> dict:
+    """
+    Sorts traces by (driver, time) and derives per-point deltas from the
+    previous fix of the same driver. Returns contiguous arrays (sorted order):
+    driver (codes), driver_names, t_ms, lat, lon, dist_m, dt_s, speed_mps
+    (derived), heading (degrees, NaN without real movement), turn (signed
+    heading change in degrees), last_heading (forward-filled heading), stopped.
+    """
+    if "driver_id" in traces:
+        driver, driver_names = pd.factorize(traces["driver_id"])
+    else:
+        driver, driver_names = np.zeros(len(traces), dtype=np.intp), np.array([None])
+    t = traces["timestamp_ms"].to_numpy(dtype=np.int64)
+    order = np.lexsort((t, driver))
+    driver, t = driver[order], t[order]
+    lat = traces["latitude"].to_numpy(dtype=np.float64)[order]
+    lon = traces["longitude"].to_numpy(dtype=np.float64)[order]
+    reported = traces["speed"].to_numpy(dtype=np.float64)[order]
+    events = traces["event_type"].isin(STOP_EVENTS).to_numpy()[order]
+
+    n = len(t)
+    same = np.zeros(n, dtype=bool)
+    same[1:] = driver[1:] == driver[:-1]
+    d_north = np.zeros(n)
+    d_east = np.zeros(n)
+    dt_s = np.full(n, np.nan)
+    d_north[1:] = (lat[1:] - lat[:-1]) * METERS_PER_DEGREE
+    d_east[1:] = (lon[1:] - lon[:-1]) * METERS_PER_DEGREE * np.cos(np.radians(lat[1:]))
+    dt_s[1:] = (t[1:] - t[:-1]) / 1000.0
+    dist_m = np.where(same, np.hypot(d_north, d_east), np.nan)
+    dt_s = np.where(same, dt_s, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt_s > 0, dist_m / dt_s, np.nan)
+
+    moved = same & (dist_m >= MIN_MOVE_M)
+    heading = np.where(moved, np.degrees(np.arctan2(d_east, d_north)) % 360, np.nan)
+
+    # Last known heading at each point (forward fill within the driver)
+    last_idx = np.maximum.accumulate(np.where(moved, np.arange(n), -1))
+    known = (last_idx >= 0) & (driver[np.maximum(last_idx, 0)] == driver)
+    last_heading = np.where(known, heading[np.maximum(last_idx, 0)], np.nan)
+    turn = np.full(n, np.nan)
+    turn[1:] = np.where(same[1:], (heading[1:] - last_heading[:-1] + 180) % 360 - 180, np.nan)
+
+    # Reported speed when present, derived otherwise
+    effective_speed = np.where(np.isnan(reported), speed, reported)
+    stopped = events | (effective_speed < STOP_SPEED_MPS)
+
+    return {
+        "driver": driver, "driver_names": driver_names, "t_ms": t, "lat": lat, "lon": lon,
+        "dist_m": dist_m, "dt_s": dt_s, "speed_mps": speed, "heading": heading, "turn": turn,
+        "last_heading": last_heading, "same_driver": same, "stopped": stopped,
+    }
+
+def stop_segments(traces: pd.DataFrame) -> pd.DataFrame:
+    """
+    Detects dwell segments in a set of traces (any number of drivers).
+
+    A point is stopped if it is a STOP/ARRIVED event or slower than 1 m/s; a
+    segment is a maximal run of stopped points of one driver. Each segment gets
+    its dwell start/end, centroid and arrival bearing: the heading of the last
+    real movement (>= MIN_MOVE_M) of that driver into the segment's first point.
+
+    Returns one row per segment: driver_id, start_ms, end_ms, dwell_s, n_points,
+    latitude, longitude, arrival_bearing (NaN when unknown).
+    """
+    columns = ["driver_id", "start_ms", "end_ms", "dwell_s", "n_points", "latitude", "longitude", "arrival_bearing"]
+    if len(traces) == 0:
+        return pd.DataFrame(columns=columns)
+
+    k = trace_kinematics(traces)
+    stopped, same, t = k["stopped"], k["same_driver"], k["t_ms"]
+
+    # Runs of stopped points per driver
+    starts_mask = stopped & ~(np.concatenate([[False], stopped[:-1]]) & same)
+    if not starts_mask.any():
+        return pd.DataFrame(columns=columns)
+    stop_idx = np.flatnonzero(stopped)
+    seg_of_stop = np.cumsum(starts_mask)[stop_idx] - 1
+    seg_start = np.flatnonzero(starts_mask)
+    n_points = np.bincount(seg_of_stop)
+    seg_end = stop_idx[np.cumsum(n_points) - 1]
+
+    return pd.DataFrame({
+        "driver_id": np.asarray(k["driver_names"], dtype=object)[k["driver"][seg_start]],
+        "start_ms": t[seg_start],
+        "end_ms": t[seg_end],
+        "dwell_s": (t[seg_end] - t[seg_start]) / 1000.0,
+        "n_points": n_points,
+        "latitude": np.bincount(seg_of_stop, weights=k["lat"][stop_idx]) / n_points,
+        "longitude": np.bincount(seg_of_stop, weights=k["lon"][stop_idx]) / n_points,
+        "arrival_bearing": k["last_heading"][seg_start],
+    })
@@ -1,4 +1,9 @@
+import threading
 import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+from cachetools import LRUCache
 from shapely.geometry import Point
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 import structlog
@@ -8,15 +13,30 @@ from urllib3.util.retry import Retry
 
 logger = structlog.get_logger()
 
+BEARING_RANGE_DEG = 20 # OSRM "value,range": we allow a deviation of ±20 degrees
+
 class OSRMMatcher:
     _session = None
+    _executor = None
 
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, redis_client=None, max_in_flight: int = 32,
+                 cache_size: int = 100_000, cache_ttl_seconds: int = 604800,
+                 decimals: int = 5, bearing_bucket_deg: int = 20):
         self.base_url = base_url
+        self.max_in_flight = max_in_flight
         # Optimization: Singleton Session per Process
         if OSRMMatcher._session is None:
             OSRMMatcher._session = self._create_session()
 
+        # Snap cache: quantized (lat, lon, bearing bucket) -> (lon, lat).
+        # Process-local LRU in front of an optional shared Redis tier.
+        self.redis = redis_client
+        self.cache = LRUCache(maxsize=cache_size)
+        self.cache_lock = threading.Lock()
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.decimals = decimals # 5 decimals ~ 1.1 m, well inside OSRM snapping noise
+        self.bearing_bucket_deg = bearing_bucket_deg
+
     def _create_session(self):
         """
         Create a robust session with connection pooling and retries.
@@ -31,46 +51,123 @@ class OSRMMatcher:
         adapter = HTTPAdapter(
             max_retries=retry_strategy,
             pool_connections=10,  # Keep 10 connections open
-            pool_maxsize=10
+            pool_maxsize=self.max_in_flight # One per in-flight snap
         )
         session.mount("http://", adapter)
         session.mount("https://", adapter)
         return session
 
 
+    def _key(self, point: Point, bearing: Optional[float]):
+        """Quantized cache key; also fixes the exact request sent to OSRM."""
+        lat = round(point.y, self.decimals)
+        lon = round(point.x, self.decimals)
+        bucket = None
+        if bearing is not None and not pd.isna(bearing):
+            bucket = int(bearing % 360 // self.bearing_bucket_deg)
+        return lat, lon, bucket
+
+    def _redis_key(self, key) -> str:
+        lat, lon, bucket = key
+        return f"snap:{lat:.{self.decimals}f}:{lon:.{self.decimals}f}:{'x' if bucket is None else bucket}"
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         retry=retry_if_exception_type(requests.exceptions.RequestException)
     )
+    def _nearest(self, lat: float, lon: float, bucket: Optional[int]):
+        """One OSRM nearest call. Returns (lon, lat) or None. Retries on network failure."""
+        session = OSRMMatcher._session
+        # OSRM expects {lon},{lat}
+        url = f"{self.base_url}/nearest/v1/driving/{lon},{lat}"
+
+        params = {}
+        if bucket is not None:
+            # Bucket center, widened by half a bucket so the caller's own ±20° window is covered
+            center = int(bucket * self.bearing_bucket_deg + self.bearing_bucket_deg / 2)
+            params['bearings'] = f"{center},{BEARING_RANGE_DEG + self.bearing_bucket_deg // 2}"
+
+        resp = session.get(url, params=params, timeout=1.0)
+
+        # If strict bearing fails (e.g. GPS bearing noise), retry without it
+        if resp.status_code != 200 and bucket is not None:
+                resp = session.get(url, timeout=1.0) # Fallback
+
+        resp.raise_for_status()
+
+        data = resp.json()
+        if data['code'] == 'Ok' and data['waypoints']:
+            snapped = data['waypoints'][0]['location']
+            return snapped[0], snapped[1]
+        return None
+
+    def _fetch(self, key):
+        try:
+            return self._nearest(*key)
+        except Exception as e:
+            logger.warning("OSRM Snap Failed", error=str(e))
+            return None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Singleton per process, like the session; its size is the in-flight limit
+        if OSRMMatcher._executor is None:
+            OSRMMatcher._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="osrm")
+        return OSRMMatcher._executor
+
+    def snap_many(self, points: Sequence[Point], bearings: Sequence[Optional[float]] = None) -> List[Point]:
+        """
+        Snaps points to the nearest road, results in input order.
+        Each distinct quantized key is requested at most once; cache misses go out
+        concurrently (at most max_in_flight at a time). Points that can't be
+        snapped come back unchanged (failures are not cached).
+        """
+        if bearings is None:
+            bearings = [None] * len(points)
+        keys = [self._key(p, b) for p, b in zip(points, bearings)]
+
+        # 1. Process-local LRU
+        resolved = {}
+        with self.cache_lock:
+            for key in set(keys):
+                hit = self.cache.get(key)
+                if hit is not None:
+                    resolved[key] = hit
+        missing = [k for k in dict.fromkeys(keys) if k not in resolved]
+
+        # 2. Shared Redis tier
+        if missing and self.redis is not None:
+            try:
+                for key, raw in zip(missing, self.redis.mget([self._redis_key(k) for k in missing])):
+                    if raw is not None:
+                        lon, lat = raw.decode().split(",")
+                        resolved[key] = (float(lon), float(lat))
+            except Exception as e:
+                logger.warning("Snap Cache Read Failed", error=str(e))
+            missing = [k for k in missing if k not in resolved]
+
+        # 3. OSRM, concurrently
+        if missing:
+            fetched = dict(zip(missing, self._pool().map(self._fetch, missing)))
+            fresh = {k: v for k, v in fetched.items() if v is not None}
+            resolved.update(fresh)
+            if fresh and self.redis is not None:
+                try:
+                    pipe = self.redis.pipeline(transaction=False)
+                    for key, (lon, lat) in fresh.items():
+                        pipe.setex(self._redis_key(key), self.cache_ttl_seconds, f"{lon},{lat}")
+                    pipe.execute()
+                except Exception as e:
+                    logger.warning("Snap Cache Write Failed", error=str(e))
+
+        with self.cache_lock:
+            for key, value in resolved.items():
+                self.cache[key] = value
+
+        return [Point(*resolved[k]) if k in resolved else p for k, p in zip(keys, points)]
+
     def snap_to_road(self, point: Point, bearing: float = None) -> Point:
         """
-        Snaps point to nearest road. Retries on network failure.
+        Snaps point to nearest road. Falls back to the original point.
         """
-        session = OSRMMatcher._session
-        try:
-            # OSRM expects {lon},{lat}
-            url = f"{self.base_url}/nearest/v1/driving/{point.x},{point.y}"
-
-            params = {}
-            if bearing is not None and not pd.isna(bearing):
-                # OSRM format: "value,range". 
-                # We allow a deviation of ±20 degrees.
-                params['bearings'] = f"{int(bearing)},20"
-
-            resp = session.get(url, params=params, timeout=1.0)
-            
-            # If strict bearing fails (e.g. GPS bearing noise), retry without it
-            if resp.status_code != 200 and bearing is not None:
-                    resp = session.get(url, timeout=1.0) # Fallback
-
-            resp.raise_for_status()
-            
-            data = resp.json()
-            if data['code'] == 'Ok' and data['waypoints']:
-                snapped = data['waypoints'][0]['location']
-                return Point(snapped[0], snapped[1])
-        except Exception:
-            pass # Fallback to original point handled by caller
-        
-        return point
\ No newline at end of file
+        return self.snap_many([point], [bearing])[0]
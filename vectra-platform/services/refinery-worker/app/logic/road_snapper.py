@@ -0,0 +1,102 @@
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from typing import List, Optional, Sequence
+from shapely.geometry import Point
+import structlog
+
+logger = structlog.get_logger()
+
+METERS_PER_DEGREE = 111320.0
+
+class LocalRoadSnapper:
+    """
+    In-process drop-in for OSRMMatcher: snaps points onto drivable road segments
+    loaded from a prebuilt segment file (scripts/extract_road_segments.py, run on
+    the same .osm.pbf as infrastructure/osrm).
+
+    Segments are stored in travel direction; two-way segments accept both headings.
+    Like OSRM's bearing fallback, a point with no bearing-compatible segment in
+    range snaps to the nearest segment regardless of heading, and a point with
+    no segment in range comes back unchanged.
+    """
+    def __init__(self, segments: np.ndarray, oneway: np.ndarray,
+                 max_distance_m: float = 50.0, bearing_range_deg: float = 20.0):
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2) # [[lon, lat], [lon, lat]]
+        self.oneway = np.asarray(oneway, dtype=bool)
+        self.max_distance_m = max_distance_m
+        self.bearing_range_deg = bearing_range_deg
+
+        start = time.perf_counter()
+        self.tree = shapely.STRtree(shapely.linestrings(self.segments))
+        # Travel heading of each segment, degrees clockwise from north
+        d = self.segments[:, 1] - self.segments[:, 0]
+        mid_lat = np.radians(self.segments[:, :, 1].mean(axis=1))
+        self.heading = np.degrees(np.arctan2(d[:, 0] * np.cos(mid_lat), d[:, 1])) % 360
+        logger.info("Road Index Built", segments=len(self.segments), seconds=round(time.perf_counter() - start, 3))
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "LocalRoadSnapper":
+        with np.load(path) as data:
+            return cls(data["segments"], data["oneway"], **kwargs)
+
+    def _bearing_ok(self, seg_idx: np.ndarray, bearings: np.ndarray) -> np.ndarray:
+        """Whether each (segment, bearing) pair is drivable within the bearing range."""
+        diff = np.abs((bearings - self.heading[seg_idx] + 180) % 360 - 180)
+        # Two-way segments can also be driven against their stored direction
+        reverse = np.where(self.oneway[seg_idx], np.inf, 180 - diff)
+        return np.minimum(diff, reverse) <= self.bearing_range_deg
+
+    def snap_many(self, points: Sequence[Point], bearings: Sequence[Optional[float]] = None) -> List[Point]:
+        """Snaps points to the nearest compatible segment, results in input order."""
+        if not len(points):
+            return []
+        lon = np.fromiter((p.x for p in points), dtype=np.float64, count=len(points))
+        lat = np.fromiter((p.y for p in points), dtype=np.float64, count=len(points))
+        if bearings is None:
+            bearings = [None] * len(points)
+        bearing = np.array([np.nan if b is None or pd.isna(b) else b for b in bearings], dtype=np.float64)
+
+        # Candidate segments: a degree radius that covers max_distance_m at the highest latitude
+        cos_max = max(np.cos(np.radians(np.abs(lat).max())), 1e-6)
+        radius_deg = self.max_distance_m / (METERS_PER_DEGREE * cos_max)
+        pt_idx, seg_idx = self.tree.query(shapely.points(lon, lat), predicate="dwithin", distance=radius_deg)
+
+        # Exact projection in local meters around each point
+        kx = METERS_PER_DEGREE * np.cos(np.radians(lat[pt_idx]))
+        seg = self.segments[seg_idx]
+        ax, ay = (seg[:, 0, 0] - lon[pt_idx]) * kx, (seg[:, 0, 1] - lat[pt_idx]) * METERS_PER_DEGREE
+        bx, by = (seg[:, 1, 0] - lon[pt_idx]) * kx, (seg[:, 1, 1] - lat[pt_idx]) * METERS_PER_DEGREE
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        dist = np.hypot(px, py)
+
+        # Prefer bearing-compatible segments; a point without a bearing accepts any
+        in_range = dist <= self.max_distance_m
+        has_bearing = ~np.isnan(bearing[pt_idx])
+        compatible = ~has_bearing | self._bearing_ok(seg_idx, np.nan_to_num(bearing[pt_idx]))
+        rank = np.where(in_range, np.where(compatible, dist, dist + 1e9), np.inf)
+
+        # Best candidate per point
+        order = np.lexsort((rank, pt_idx))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pt_idx[order][1:] != pt_idx[order][:-1]
+        best = order[first & np.isfinite(rank[order])]
+
+        hit = pt_idx[best]
+        snapped_lon = lon[hit] + px[best] / kx[best]
+        snapped_lat = lat[hit] + py[best] / METERS_PER_DEGREE
+
+        snapped = list(points)
+        for i, x, y in zip(hit, snapped_lon, snapped_lat):
+            snapped[i] = Point(x, y)
+        return snapped
+
+    def snap_to_road(self, point: Point, bearing: float = None) -> Point:
+        """
+        Snaps point to nearest road. Falls back to the original point.
+        """
+        return self.snap_many([point], [bearing])[0]
@@ -1,15 +1,27 @@
+import os
 import time
 import json
+import multiprocessing
+import numpy as np
 import pandas as pd
 import structlog
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from sqlalchemy import create_engine, text
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy import create_engine
+from shapely.geometry import Point
+from kafka import KafkaConsumer
+from services.common.python import geohash as vgh
 from app.core.config import settings
+from app.core.debounce import GeohashDebouncer
 from app.logic.clustering import LocationHeuristics
-from app.logic.osrm_client import OSRMMatcher
+from app.logic.osrm_clinent import OSRMMatcher
+from app.logic.road_snapper import LocalRoadSnapper
+from app.db.repository import (
+    load_batch_traces, claim_dirty_geohashes, claim_geohashes, release_dirty_geohashes,
+    upsert_refined_locations
+)
 import redis
-from contextlib import contextmanager
-import pygeohash as pgh
 # Structured Logging
 structlog.configure(processors=[structlog.processors.JSONRenderer()])
 logger = structlog.get_logger()
@@ -18,160 +30,304 @@ logger = structlog.get_logger()
 engine = create_engine(settings.DATABASE_URL, pool_size=10, max_overflow=20)
 
 
-# Initialize Redis (Thread-safe connection pool)
-redis_pool = redis.ConnectionPool.from_url(settings.REDIS_URL)
+redis_client = redis.from_url(settings.REDIS_URL)
 
+def create_matcher():
+    """
+    Road snapping runs once per batch in the main process. Both engines expose
+    snap_many / snap_to_road: OSRM (concurrent misses, local LRU + shared Redis
+    cache of quantized keys) or the in-process segment index.
+    """
+    if settings.SNAP_ENGINE == "local":
+        return LocalRoadSnapper.from_file(
+            settings.ROAD_SEGMENTS_PATH,
+            max_distance_m=settings.LOCAL_SNAP_MAX_DISTANCE_M
+        )
+    return OSRMMatcher(
+        settings.OSRM_HOST,
+        redis_client=redis_client,
+        max_in_flight=settings.OSRM_MAX_IN_FLIGHT,
+        cache_size=settings.OSRM_SNAP_CACHE_SIZE,
+        cache_ttl_seconds=settings.OSRM_SNAP_CACHE_TTL_SECONDS,
+        decimals=settings.OSRM_SNAP_DECIMALS,
+        bearing_bucket_deg=settings.OSRM_BEARING_BUCKET_DEG
+    )
 
-redis_client = redis.from_url(settings.REDIS_URL)
-def update_hot_cache(geohash: str, np_point, ep_point):
+def update_hot_cache(rows: list):
     """
     Optimization: Push fresh data to Redis immediately.
     Eliminates the 'stale data' window of the nightly batch job.
+    One pipelined round-trip per batch, built straight from the row coordinates.
     """
     try:
-        data = {
-            "address_id": geohash,
-            "navigation_point": {"lat": np_point.y, "lon": np_point.x},
-            "entry_point": {"lat": ep_point.y, "lon": ep_point.x},
-            "source": "live_refinery"
-        }
-        # Set with 48h TTL
-        redis_client.set(f"loc:{geohash}", json.dumps(data), ex=172800)
-        logger.info("Cache Invalidated/Updated", geohash=geohash)
+        pipe = redis_client.pipeline(transaction=False)
+        for r in rows:
+            data = {
+                "address_id": r["id"],
+                "navigation_point": {"lat": r["nav_lat"], "lon": r["nav_lon"]},
+                "entry_point": {"lat": r["ep_lat"], "lon": r["ep_lon"]},
+                "source": "live_refinery"
+            }
+            # Set with 48h TTL
+            pipe.setex(f"loc:{r['id']}", 172800, json.dumps(data))
+        pipe.execute()
+        logger.info("Cache Invalidated/Updated", count=len(rows))
     except Exception as e:
         logger.error("Cache Update Failed", error=str(e))
 
-@contextmanager
-def redis_lock(lock_name, expire=60):
-    r = redis.Redis(connection_pool=redis_pool)
-    # NX=True (Only set if not exists), EX=expire (Auto-expire lock)
-    have_lock = r.set(lock_name, "locked", nx=True, ex=expire)
-    try:
-        yield have_lock
-    finally:
-        if have_lock:
-            r.delete(lock_name)
+# Per-process singletons, built once by the pool initializer (not per task)
+_worker = {}
+
+def init_worker():
+    """
+    ProcessPoolExecutor initializer: builds the heuristics once for the
+    lifetime of the process.
+    """
+    _worker["heuristics"] = LocationHeuristics(
+        eps_meters=settings.DBSCAN_EPS_METERS,
+        min_samples=settings.MIN_SAMPLES_CLUSTER,
+        engine=settings.CLUSTERING_ENGINE
+    )
+
+def _worker_state() -> dict:
+    # Also covers in-process callers (scripts, tests) that never ran the initializer
+    if not _worker:
+        init_worker()
+    return _worker
+
+def create_worker_pool() -> ProcessPoolExecutor:
+    """
+    Long-lived pool shared by every batch. Workers are recycled after
+    WORKER_MAX_TASKS_PER_CHILD tasks to bound leaks; recycling needs a
+    non-fork start method, forkserver keeps the respawn cheap.
+    """
+    return ProcessPoolExecutor(
+        max_workers=settings.WORKER_THREADS,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=init_worker,
+        max_tasks_per_child=settings.WORKER_MAX_TASKS_PER_CHILD
+    )
 
-def process_single_geohash(ghash: str):
+def process_single_geohash(ghash: str, df_scans: pd.DataFrame, df_traces: pd.DataFrame):
     """
     Isolated function for parallel execution.
-    Re-initializes connections to be process-safe.
-    """
-    # Optimization 2: Distributed Lock
-    lock_key = f"lock:refine:{ghash}"
-    
-    with redis_lock(lock_key, expire=30) as acquired:
-        if not acquired:
-            # Another worker is processing this. Skip.
-            return None
-
-        # Each process needs its own connection/matcher
-        local_engine = create_engine(settings.DATABASE_URL)
-        matcher = OSRMMatcher(settings.OSRM_HOST)
-        heuristics = LocationHeuristics(
-            eps_meters=settings.DBSCAN_EPS_METERS,
-            min_samples=settings.MIN_SAMPLES_CLUSTER
-        )
-        neighbors = pgh.neighbors(ghash) # Returns list of 8 strings
-        search_hashes = [ghash] + neighbors
-        search_hashes_str = "'" + "','".join(search_hashes) + "'"
-        result = None
+    Pure compute: the trace rows come pre-fetched from the batch loader and the
+    parking candidate is snapped to the road by the main process, batch-wide.
+    Exclusivity comes from the dirty_geohashes lease, so no per-cell lock is taken here.
+    """
+    heuristics = _worker_state()["heuristics"]
+    result = None
+    try:
+        # 1. SCANs (Only from CENTER geohash - the address is here)
+        ep_point, ep_conf = heuristics.find_entry_point(df_scans)
+        if not ep_point: return None
+
+        # 2. TRACES (From CENTER + NEIGHBORS - parking could be anywhere near)
+        raw_np, avg_bearing = heuristics.find_parking_candidate(df_traces, ep_point)
+        
+        final_conf = ep_conf * 0.9 
+        # 4. Prepare Result (Don't write or call OSRM in subprocess, return to main)
+        # Raw (lon, lat) tuples: cheap to pickle, no WKT on either side
+        result = {
+            "id": ghash,
+            "raw_np": (raw_np.x, raw_np.y) if raw_np else None,
+            "bearing": avg_bearing,
+            "ep": (ep_point.x, ep_point.y),
+            "conf": final_conf
+        }
+    except Exception as e:
+        logger.error("Processing Failed", geohash=ghash, error=str(e))
+        
+    return result
+
+def timed_process_geohash(ghash: str, df_scans: pd.DataFrame, df_traces: pd.DataFrame):
+    """Runs one task and reports (result, worker pid, busy seconds) for utilization metrics."""
+    start = time.perf_counter()
+    result = process_single_geohash(ghash, df_scans, df_traces)
+    return result, os.getpid(), time.perf_counter() - start
+
+def snap_parking_points(matcher, results: list) -> list:
+    """
+    Snaps every parking candidate of the batch in one call (bearing passed to OSRM)
+    and returns the rows to upsert. Cells without a candidate navigate to the entry point.
+    """
+    to_snap = [r for r in results if r["raw_np"]]
+    snapped = matcher.snap_many([Point(*r["raw_np"]) for r in to_snap], [r["bearing"] for r in to_snap])
+    final_np = {r["id"]: (p.x, p.y) for r, p in zip(to_snap, snapped)}
+    rows = []
+    for r in results:
+        nav_lon, nav_lat = final_np.get(r["id"], r["ep"])
+        rows.append({
+            "id": r["id"],
+            "nav_lon": nav_lon, "nav_lat": nav_lat,
+            "ep_lon": r["ep"][0], "ep_lat": r["ep"][1],
+            "conf": r["conf"]
+        })
+    return rows
+
+def log_utilization(busy: dict, tasks: dict, wall_seconds: float):
+    """Per-worker busy fraction of the batch's parallel phase."""
+    if wall_seconds <= 0:
+        return
+    workers = {
+        str(pid): {"tasks": tasks[pid], "busy_s": round(busy[pid], 3), "utilization": round(busy[pid] / wall_seconds, 3)}
+        for pid in busy
+    }
+    logger.info(
+        "Worker Utilization",
+        wall_s=round(wall_seconds, 3),
+        pool_utilization=round(sum(busy.values()) / (wall_seconds * settings.WORKER_THREADS), 3),
+        workers=workers
+    )
+
+def refine_batch(executor, matcher, claimed: list):
+    """
+    Refines one batch of claimed dirty cells end to end. Returns the executor
+    to keep using (rebuilt if a worker died).
+    """
+    candidates = [c[0] for c in claimed]
+    logger.info("Starting Batch", size=len(candidates))
+
+    try:
+        # 2. One bulk read for every candidate cell + neighbors, partitioned in memory
+        batch = load_batch_traces(engine, candidates, lookback_days=settings.TRACE_LOOKBACK_DAYS)
+
+        # 3. Parallel Execution on the persistent pool (each task only carries its own slice)
+        updates = []
+        busy, tasks = defaultdict(float), defaultdict(int)
+        started = time.perf_counter()
+        futures = {
+            executor.submit(timed_process_geohash, g, batch.scans(g), batch.traces(g)): g
+            for g in candidates
+        }
+
+        for future in as_completed(futures):
+            res, pid, seconds = future.result()
+            busy[pid] += seconds
+            tasks[pid] += 1
+            if res:
+                updates.append(res)
+        log_utilization(busy, tasks, time.perf_counter() - started)
+
+        # Road snapping for the whole batch (cached, concurrent, in order)
+        updates = snap_parking_points(matcher, updates)
+
+        # 4. Bulk Write (Main Process): COPY into staging + one upsert, acknowledging
+        # the claims in the same transaction, then one Redis pipeline
+        upsert_refined_locations(engine, updates, claimed)
+        if updates:
+            update_hot_cache(updates)
+
+            logger.info("Batch Complete", updated_count=len(updates))
+    except Exception as e:
+        # Claims are still leased; hand the cells back now rather than at lease expiry
+        logger.error("Batch Failed", error=str(e), size=len(candidates))
         try:
-            with local_engine.connect() as conn:
-                # 1. Fetch SCANs (Only from CENTER geohash - the address is here)
-                df_scans = pd.read_sql(
-                    text(f"SELECT * FROM raw_gps_traces WHERE geohash = '{ghash}' AND event_type = 'SCAN'"), 
-                    conn
-                )
-                
-                ep_point, ep_conf = heuristics.find_entry_point(df_scans)
-                if not ep_point: return None
-
-                # 2. Fetch TRACES (From CENTER + NEIGHBORS - parking could be anywhere near)
-                df_traces = pd.read_sql(
-                    text(f"SELECT * FROM raw_gps_traces WHERE geohash IN ({search_hashes_str})"), 
-                    conn
-                )
-                
-                # Logic continues...
-                raw_np, avg_bearing = heuristics.find_parking_candidate(df_traces, ep_point)
-                
-                # Pass bearing to OSRM
-                final_np = matcher.snap_to_road(raw_np, bearing=avg_bearing) if raw_np else ep_point
-                final_conf = ep_conf * 0.9 
-                # 4. Prepare Result (Don't write in subprocess, return to main)
-                result = {
-                    "id": ghash,
-                    "np_wkt": final_np.wkt,
-                    "ep_wkt": ep_point.wkt,
-                    "conf": final_conf
-                }
-        except Exception as e:
-            logger.error("Processing Failed", geohash=ghash, error=str(e))
-        finally:
-            local_engine.dispose()
-            
-        return result
+            release_dirty_geohashes(engine, claimed)
+        except Exception as release_error:
+            # The leases expire after DIRTY_CLAIM_LEASE_SECONDS and the cells are claimed again
+            logger.error("Release Failed", error=str(release_error), size=len(claimed))
+        if isinstance(e, BrokenProcessPool):
+            # A worker died hard (OOM kill, segfault); rebuild the pool
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = create_worker_pool()
+    return executor
 
 def run_batch_job():
+    executor = create_worker_pool()
+    matcher = create_matcher()
     while True:
-        with engine.connect() as conn:
-            # 1. Find "Dirty" Geohashes (New scans received recently)
-            # This logic finds geohashes where new raw data exists that hasn't been refined yet
-            # (Simplified for Phase 2: Just take top N unprocessed/outdated)
-            query = text(f"""
-                SELECT t.geohash 
-                FROM raw_gps_traces t
-                LEFT JOIN refined_locations r ON t.geohash = r.id
-                WHERE t.event_type = 'SCAN'
-                AND (r.updated_at IS NULL OR t.timestamp > r.updated_at)
-                GROUP BY t.geohash
-                LIMIT {settings.BATCH_SIZE}
-            """)
-            candidates = [r[0] for r in conn.execute(query).fetchall()]
-
-        if not candidates:
+        # 1. Claim "Dirty" Geohashes (cells the stream consumer saw new SCANs in)
+        # O(dirty cells): reads the small work-queue table, never raw_gps_traces
+        claimed = claim_dirty_geohashes(engine, settings.BATCH_SIZE, lease_seconds=settings.DIRTY_CLAIM_LEASE_SECONDS)
+
+        if not claimed:
             logger.info("No dirty records found. Sleeping...")
             time.sleep(60)
             continue
 
-        logger.info("Starting Batch", size=len(candidates))
+        executor = refine_batch(executor, matcher, claimed)
 
-        # 2. Parallel Execution
-        updates = []
-        with ProcessPoolExecutor(max_workers=settings.WORKER_THREADS) as executor:
-            futures = {executor.submit(process_single_geohash, g): g for g in candidates}
-            
-            for future in as_completed(futures):
-                res = future.result()
-                if res:
-                    updates.append(res)
-
-        # 3. Bulk Write (Main Process)
-        if updates:
-            with engine.begin() as conn: # Transaction
-                for up in updates:
-                    sql = text("""
-                        INSERT INTO refined_locations (id, nav_point, entry_point, confidence_score, updated_at)
-                        VALUES (:id, ST_GeomFromText(:np_wkt), ST_GeomFromText(:ep_wkt), :conf, NOW())
-                        ON CONFLICT (id) DO UPDATE SET
-                            nav_point = EXCLUDED.nav_point,
-                            entry_point = EXCLUDED.entry_point,
-                            updated_at = NOW()
-                    """)
-                    conn.execute(sql, up)
-
-            for item in updates:
-                # We need to parse WKT back to objects or store raw points in item dict
-                # Assuming item has 'np_wkt' and 'ep_wkt'
-                from shapely import wkt
-                np_obj = wkt.loads(item['np_wkt'])
-                ep_obj = wkt.loads(item['ep_wkt'])
-                
-                update_hot_cache(item['id'], np_obj, ep_obj)
+def scan_geohashes(messages) -> list:
+    """p7 geohash of every SCAN in a poll batch (one vectorized encode)."""
+    scans = [m.value for m in messages if m.value.get("event_type") == "SCAN"]
+    if not scans:
+        return []
+    lat = np.fromiter((s["latitude"] for s in scans), dtype=np.float64, count=len(scans))
+    lon = np.fromiter((s["longitude"] for s in scans), dtype=np.float64, count=len(scans))
+    return list(vgh.encode(lat, lon, precision=7))
 
-            logger.info("Batch Complete", updated_count=len(updates))
+def run_streaming_job():
+    """
+    Kafka-driven mode: watches the raw trace topic and refines a cell seconds
+    after its activity settles, instead of polling every 60s.
+
+    The debouncer only decides *when*; cells are still claimed by key from
+    dirty_geohashes. A row there is committed together with its traces by the
+    stream consumer, so a claimed cell's data is always visible, and concurrent
+    instances never refine the same cell. Due cells without a claimable row
+    (the consumer hasn't committed it yet, or another instance holds the lease)
+    are retried shortly; after STREAM_MAX_WAIT_SECONDS the periodic backstop
+    sweep owns them.
+
+    Batches run on a refiner thread, one at a time, so this thread keeps
+    polling (a slow batch must not exceed max.poll.interval.ms and trigger a
+    rebalance); new SCANs keep accumulating in the debouncer meanwhile.
+    """
+    executor = create_worker_pool()
+    matcher = create_matcher()
+    debouncer = GeohashDebouncer(
+        scan_threshold=settings.STREAM_SCAN_THRESHOLD,
+        idle_seconds=settings.STREAM_IDLE_SECONDS,
+        max_wait_seconds=settings.STREAM_MAX_WAIT_SECONDS
+    )
+    consumer = KafkaConsumer(
+        settings.KAFKA_TOPIC_TRACES,
+        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+        value_deserializer=lambda x: json.loads(x.decode('utf-8')),
+        group_id='vectra-refinery-stream',
+        # In-memory debounce state is rebuilt from the dirty table after a restart
+        enable_auto_commit=True,
+        auto_offset_reset='latest',
+        max_poll_records=5000
+    )
+    logger.info("Streaming Refinery Started", topic=settings.KAFKA_TOPIC_TRACES)
+
+    refiner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refiner")
+    running = None # Future of the batch in progress; resolves to the (possibly rebuilt) pool
+    last_sweep = time.monotonic()
+    while True:
+        for messages in consumer.poll(timeout_ms=500).values():
+            debouncer.add(scan_geohashes(messages))
+
+        if running is not None:
+            if not running.done():
+                continue
+            executor = running.result()
+            running = None
+
+        due = debouncer.pop_due(limit=settings.BATCH_SIZE)
+        if due:
+            claimed = claim_geohashes(engine, due, lease_seconds=settings.DIRTY_CLAIM_LEASE_SECONDS)
+            claimed_cells = {c[0] for c in claimed}
+            retried = debouncer.retry([g for g in due if g not in claimed_cells], settings.STREAM_CLAIM_RETRY_SECONDS)
+            if claimed:
+                running = refiner.submit(refine_batch, executor, matcher, claimed)
+            logger.info("Stream Cells Due", due=len(due), claimed=len(claimed), retried=retried, pending=len(debouncer))
+
+        # Backstop: cells marked dirty but never seen here (restart, consumer lag, other partitions)
+        if running is None and time.monotonic() - last_sweep >= settings.STREAM_SWEEP_SECONDS:
+            last_sweep = time.monotonic()
+            claimed = claim_dirty_geohashes(
+                engine, settings.BATCH_SIZE, min_age_seconds=settings.STREAM_MAX_WAIT_SECONDS,
+                lease_seconds=settings.DIRTY_CLAIM_LEASE_SECONDS
+            )
+            if claimed:
+                running = refiner.submit(refine_batch, executor, matcher, claimed)
 
 if __name__ == "__main__":
-    logger.info("Refinery Worker Started (Enterprise Mode)")
-    run_batch_job()
\ No newline at end of file
+    logger.info("Refinery Worker Started (Enterprise Mode)", mode=settings.REFINERY_MODE)
+    if settings.REFINERY_MODE == "stream":
+        run_streaming_job()
+    else:
+        run_batch_job()
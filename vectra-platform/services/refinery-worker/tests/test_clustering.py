@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.cluster import DBSCAN
+
+from app.logic.clustering import LocationHeuristics
+from app.logic.grid_dbscan import grid_dbscan, project_enu, EARTH_RADIUS_M
+
+
+def _scene(rng, n_clusters, n_points, n_noise, spread):
+    centers = rng.uniform(-75, 75, (n_clusters, 2))
+    clustered = centers[rng.integers(0, n_clusters, n_points)] + rng.normal(0, spread, (n_points, 2))
+    noise = rng.uniform(-80, 80, (n_noise, 2))
+    return np.concatenate([clustered, noise])
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_grid_dbscan_matches_sklearn(seed):
+    rng = np.random.default_rng(seed)
+    xy = _scene(rng, int(rng.integers(1, 6)), int(rng.integers(1, 400)), int(rng.integers(0, 60)), rng.uniform(2, 15))
+    eps, min_samples = float(rng.uniform(3, 25)), int(rng.integers(1, 8))
+
+    expected = DBSCAN(eps=eps, min_samples=min_samples, algorithm="kd_tree").fit(xy).labels_
+    np.testing.assert_array_equal(grid_dbscan(xy, eps, min_samples), expected)
+
+
+def test_grid_dbscan_dense_hub_matches_sklearn():
+    rng = np.random.default_rng(7)
+    xy = np.concatenate([rng.normal(0, 8, (3000, 2)), rng.uniform(-75, 75, (300, 2))])
+
+    expected = DBSCAN(eps=20.0, min_samples=3, algorithm="kd_tree").fit(xy).labels_
+    np.testing.assert_array_equal(grid_dbscan(xy, 20.0, 3), expected)
+
+
+def test_grid_dbscan_edge_cases():
+    assert len(grid_dbscan(np.empty((0, 2)), 20.0, 3)) == 0
+    # Isolated points are noise; a point is its own neighbor
+    far = np.array([[0.0, 0.0], [100.0, 0.0], [0.0, 100.0]])
+    np.testing.assert_array_equal(grid_dbscan(far, 20.0, 2), [-1, -1, -1])
+    np.testing.assert_array_equal(grid_dbscan(far, 20.0, 1), [0, 1, 2])
+
+
+def test_find_entry_point_engines_agree():
+    rng = np.random.default_rng(3)
+    lat0, lon0 = 40.7128, -74.0060
+    offsets = _scene(rng, 3, 300, 40, 6.0)
+    scans = pd.DataFrame({
+        "latitude": lat0 + offsets[:, 1] / 111320.0,
+        "longitude": lon0 + offsets[:, 0] / (111320.0 * np.cos(np.radians(lat0))),
+    })
+
+    haversine_pt, haversine_conf = LocationHeuristics(20, 3, engine="sklearn").find_entry_point(scans)
+    grid_pt, grid_conf = LocationHeuristics(20, 3, engine="grid").find_entry_point(scans)
+    assert grid_pt.equals_exact(haversine_pt, 1e-9)
+    assert grid_conf == haversine_conf
+
+
+def test_project_enu_preserves_local_distances():
+    lat = np.array([40.7128, 40.7129, 40.7135])
+    lon = np.array([-74.0060, -74.0050, -74.0061])
+    xy = project_enu(lat, lon)
+    # Haversine between the first two points
+    phi, lam = np.radians(lat[:2]), np.radians(lon[:2])
+    a = np.sin((phi[1] - phi[0]) / 2) ** 2 + np.cos(phi[0]) * np.cos(phi[1]) * np.sin((lam[1] - lam[0]) / 2) ** 2
+    expected = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    assert abs(np.hypot(*(xy[0] - xy[1])) - expected) < 1e-3
+
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError):
+        LocationHeuristics(engine="optics")
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+from app.logic.clustering import LocationHeuristics
+from app.logic.kinematics import METERS_PER_DEGREE, circular_mean, stop_segments, trace_kinematics
+
+LAT0, LON0 = 40.7128, -74.0060
+T0 = 1_700_000_000_000
+
+
+def _drive(driver, bearing_deg, approach_m, stop_s, start_ms=T0, lat=LAT0, lon=LON0, step_m=10.0):
+    """Fixes every second: drives `approach_m` along `bearing_deg` at step_m/s, then parks for `stop_s`."""
+    rad = np.radians(bearing_deg)
+    steps = np.arange(int(approach_m / step_m) + 1) * step_m
+    north, east = steps * np.cos(rad), steps * np.sin(rad)
+    n_stop = int(stop_s)
+    north = np.concatenate([north, np.full(n_stop, north[-1])])
+    east = np.concatenate([east, np.full(n_stop, east[-1])])
+    moving = len(steps)
+    return pd.DataFrame({
+        "driver_id": driver,
+        "timestamp_ms": start_ms + np.arange(len(north)) * 1000,
+        "latitude": lat + north / METERS_PER_DEGREE,
+        "longitude": lon + east / (METERS_PER_DEGREE * np.cos(np.radians(lat))),
+        "speed": np.concatenate([np.full(moving - 1, step_m), np.zeros(n_stop + 1)]),
+        "event_type": "PING",
+    })
+
+
+def test_stop_segments_dwell_and_arrival_bearing():
+    traces = _drive("d1", bearing_deg=90.0, approach_m=200.0, stop_s=60)
+    stops = stop_segments(traces)
+
+    assert len(stops) == 1
+    stop = stops.iloc[0]
+    assert stop["driver_id"] == "d1"
+    assert stop["n_points"] == 61 # Last moving fix reports 0 m/s on arrival, plus 60 parked fixes
+    assert stop["dwell_s"] == pytest.approx(60.0)
+    assert stop["arrival_bearing"] == pytest.approx(90.0, abs=0.01)
+    assert stop["latitude"] == pytest.approx(LAT0, abs=1e-7)
+
+
+def test_stop_segments_split_at_driver_boundary():
+    # Both drivers are stopped across the boundary of the (driver, time) sort
+    a = _drive("a", bearing_deg=0.0, approach_m=100.0, stop_s=30)
+    b = _drive("b", bearing_deg=180.0, approach_m=0.0, stop_s=30, lat=LAT0 + 0.01)
+    b["speed"] = 0.0
+    stops = stop_segments(pd.concat([b, a], ignore_index=True)).set_index("driver_id")
+
+    assert sorted(stops.index) == ["a", "b"]
+    assert stops.loc["a", "n_points"] == 31
+    assert stops.loc["b", "n_points"] == 31
+    assert stops.loc["a", "arrival_bearing"] == pytest.approx(0.0, abs=0.01)
+    # Never moved: no arrival heading, and none inherited from driver a
+    assert np.isnan(stops.loc["b", "arrival_bearing"])
+
+
+def test_stop_events_mark_dwell_without_speed():
+    traces = _drive("d1", bearing_deg=45.0, approach_m=100.0, stop_s=0)
+    traces["speed"] = np.nan # Derived from positions instead
+    traces.loc[[3, 4], "event_type"] = "STOP"
+    stops = stop_segments(traces)
+
+    assert len(stops) == 1
+    assert stops.iloc[0]["n_points"] == 2
+    assert stops.iloc[0]["arrival_bearing"] == pytest.approx(45.0, abs=0.01)
+
+
+def test_trace_kinematics_ignores_jitter_for_heading():
+    traces = _drive("d1", bearing_deg=270.0, approach_m=50.0, stop_s=5)
+    k = trace_kinematics(traces)
+
+    assert np.isnan(k["heading"][0])
+    assert np.isnan(k["heading"][-1]) # Parked: below MIN_MOVE_M
+    assert k["last_heading"][-1] == pytest.approx(270.0, abs=0.01)
+    assert np.nanmax(np.abs(k["turn"][1:6])) < 0.01
+    assert k["speed_mps"][1] == pytest.approx(10.0, rel=1e-3)
+
+
+def test_circular_mean_wraps_at_north():
+    mean = circular_mean(np.array([359.0, 1.0]))
+    assert min(mean, 360 - mean) == pytest.approx(0.0, abs=1e-9) # Not the arithmetic 180
+    assert circular_mean(np.array([350.0, 20.0, np.nan])) == pytest.approx(5.0)
+    assert np.isnan(circular_mean(np.array([np.nan])))
+
+
+def test_circular_mean_per_label():
+    means = circular_mean(np.array([359.0, 1.0, 90.0, np.nan]), labels=np.array([0, 0, 1, 2]), n_labels=4)
+    assert min(means[0], 360 - means[0]) == pytest.approx(0.0, abs=1e-9)
+    assert means[1] == pytest.approx(90.0)
+    assert np.isnan(means[2]) and np.isnan(means[3])
+
+
+def test_find_parking_candidate_none_when_no_stop_nearby():
+    heuristics = LocationHeuristics(20, 3)
+    traces = _drive("d1", bearing_deg=90.0, approach_m=200.0, stop_s=60)
+    far_entry = Point(LON0 + 0.05, LAT0 + 0.05)
+    assert heuristics.find_parking_candidate(traces, far_entry) == (None, None)
+    assert heuristics.find_parking_candidate(traces.iloc[0:0], far_entry) == (None, None)
+
+
+def test_find_parking_candidate_near_stop():
+    heuristics = LocationHeuristics(20, 3)
+    traces = _drive("d1", bearing_deg=90.0, approach_m=200.0, stop_s=60)
+    parked = traces.iloc[-1]
+    point, bearing = heuristics.find_parking_candidate(traces, Point(parked["longitude"], parked["latitude"]))
+
+    assert point.y == pytest.approx(parked["latitude"], abs=1e-7)
+    assert point.x == pytest.approx(parked["longitude"], abs=1e-7)
+    assert bearing == pytest.approx(90.0, abs=0.01)
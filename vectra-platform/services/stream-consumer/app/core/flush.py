@@ -0,0 +1,46 @@
+import time
+from typing import Optional
+
+class FlushPolicy:
+    """
+    Decides when the consumer's pending batch is written. The batch flushes on
+    whichever threshold is crossed first:
+      - `max_records` records (refinery freshness on busy partitions),
+      - `max_bytes` serialized bytes (right-sized Parquet files / COPYs),
+      - `linger_seconds` since its first record arrived (bounded staleness on quiet partitions).
+    """
+    def __init__(self, max_records: int = 1000, max_bytes: int = 4 * 1024 * 1024, linger_seconds: float = 5.0):
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.linger_seconds = linger_seconds
+        self.records = 0
+        self.bytes = 0
+        self.opened_at: Optional[float] = None
+
+    def add(self, records: int, nbytes: int, now: Optional[float] = None):
+        if self.opened_at is None and records:
+            self.opened_at = time.monotonic() if now is None else now
+        self.records += records
+        self.bytes += nbytes
+
+    def time_left(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the linger deadline; None while the batch is empty (nothing to wait for)."""
+        if self.opened_at is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.opened_at + self.linger_seconds - now)
+
+    def reason(self, now: Optional[float] = None) -> Optional[str]:
+        """"records", "bytes" or "linger" when the batch is due, else None."""
+        if self.records >= self.max_records:
+            return "records"
+        if self.bytes >= self.max_bytes:
+            return "bytes"
+        if self.opened_at is not None and self.time_left(now) == 0.0:
+            return "linger"
+        return None
+
+    def reset(self):
+        self.records = 0
+        self.bytes = 0
+        self.opened_at = None
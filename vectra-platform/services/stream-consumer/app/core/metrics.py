@@ -0,0 +1,17 @@
+from prometheus_client import Counter, Histogram
+
+# Served by prometheus_client.start_http_server (the consumer has no web app)
+BATCH_RECORDS = Histogram(
+    "consumer_batch_records", "Records per flushed batch (before filtering)",
+    buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+)
+BATCH_BYTES = Histogram(
+    "consumer_batch_bytes", "Serialized Kafka bytes per flushed batch",
+    buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 128e6)
+)
+FLUSHES = Counter("consumer_flushes_total", "Flushed batches by trigger", ["reason"])
+END_TO_END_LAG = Histogram(
+    "consumer_end_to_end_lag_seconds", "Kafka record timestamp of a batch's oldest record to both sinks written",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+)
+DEAD_LETTERED = Counter("consumer_dead_lettered_batches_total", "Batches a sink rejected after retries", ["sink"])
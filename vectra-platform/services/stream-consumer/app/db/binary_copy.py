@@ -0,0 +1,104 @@
+"""
+PostgreSQL binary COPY payloads for raw_gps_traces, built column-wise.
+
+Every field is laid out with NumPy scatter writes into one preallocated buffer:
+no per-row Python, no text for the server to parse. Geometry goes as EWKB
+(what PostGIS' geometry_recv reads), timestamps as int64 microseconds since
+2000-01-01. Shared by the asyncpg sink (copy_to_table(format='binary')) and
+scripts/benchmark_copy.py (psycopg2 copy_expert ... FORMAT binary).
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+COPY_COLUMNS = ('driver_id', 'vehicle_id', 'timestamp', 'geom', 'speed', 'event_type', 'geohash')
+
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"  # signature, flags, extension length
+PGCOPY_TRAILER = b"\xff\xff"
+PG_EPOCH_MS = 946684800000  # 2000-01-01T00:00:00Z
+
+EWKB_POINT = np.dtype([("order", "u1"), ("type", "<u4"), ("srid", "<u4"), ("x", "<f8"), ("y", "<f8")])
+EWKB_POINT_SRID = 0x20000001  # wkbPoint | SRID flag
+
+def ewkb_points(lon: np.ndarray, lat: np.ndarray, srid: int = 4326) -> np.ndarray:
+    """(n, 25) uint8: little-endian EWKB POINT with SRID, one row per point."""
+    out = np.empty(len(lon), dtype=EWKB_POINT)
+    out["order"], out["type"], out["srid"] = 1, EWKB_POINT_SRID, srid
+    out["x"], out["y"] = lon, lat
+    return out.view(np.uint8).reshape(len(lon), EWKB_POINT.itemsize)
+
+def pg_timestamps(timestamp_ms: np.ndarray) -> np.ndarray:
+    """Unix epoch millis -> PostgreSQL timestamptz wire value (int64 us since 2000)."""
+    return (np.asarray(timestamp_ms, dtype=np.int64) - PG_EPOCH_MS) * 1000
+
+def _text_field(column):
+    """(lengths with -1 for NULL, utf-8 data, per-row start in data) of a string column."""
+    arr = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    arr = arr.cast(pa.string())
+    n = len(arr)
+    offsets = np.frombuffer(arr.buffers()[1], dtype=np.int32, count=arr.offset + n + 1)[arr.offset:]
+    data = np.frombuffer(arr.buffers()[2], dtype=np.uint8) if arr.buffers()[2] is not None else np.empty(0, np.uint8)
+    lengths = np.diff(offsets).astype(np.int64)
+    if arr.null_count:
+        lengths[~pc.is_valid(arr).to_numpy(zero_copy_only=False)] = -1
+    return lengths, data, offsets[:-1].astype(np.int64)
+
+def _be(values: np.ndarray, dtype: str) -> np.ndarray:
+    return np.ascontiguousarray(values, dtype=dtype).view(np.uint8).reshape(len(values), -1)
+
+def _scatter_fixed(buf: np.ndarray, pos: np.ndarray, rows: np.ndarray):
+    buf[pos[:, None] + np.arange(rows.shape[1])] = rows
+
+def _scatter_var(buf: np.ndarray, pos: np.ndarray, lengths: np.ndarray, data: np.ndarray, starts: np.ndarray):
+    sizes = np.maximum(lengths, 0)
+    total = int(sizes.sum())
+    if total == 0:
+        return
+    # Destination and source index of every byte: run starts repeated plus the offset inside the run
+    run_offset = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    buf[np.repeat(pos, sizes) + run_offset] = data[np.repeat(starts, sizes) + run_offset]
+
+def encode_copy(n: int, fields) -> bytes:
+    """
+    Binary COPY payload of n rows from per-column field specs, in column order.
+    A spec is ("fixed", (n, k) uint8 rows) or ("text", (lengths, data, starts)).
+    """
+    lengths = [np.full(n, value.shape[1], dtype=np.int64) if kind == "fixed" else value[0] for kind, value in fields]
+    sizes = [np.maximum(l, 0) for l in lengths]
+    row_size = 2 + 4 * len(fields) + np.sum(sizes, axis=0) if n else np.empty(0, dtype=np.int64)
+    row_start = len(PGCOPY_HEADER) + np.concatenate([[0], np.cumsum(row_size)[:-1]]).astype(np.int64)
+    body_end = len(PGCOPY_HEADER) + int(np.sum(row_size))
+
+    buf = np.empty(body_end + len(PGCOPY_TRAILER), dtype=np.uint8)
+    buf[:len(PGCOPY_HEADER)] = np.frombuffer(PGCOPY_HEADER, dtype=np.uint8)
+    buf[body_end:] = np.frombuffer(PGCOPY_TRAILER, dtype=np.uint8)
+    if n == 0:
+        return buf.tobytes()
+
+    _scatter_fixed(buf, row_start, _be(np.full(n, len(fields)), ">i2"))
+    pos = row_start + 2
+    for (kind, value), field_len, size in zip(fields, lengths, sizes):
+        _scatter_fixed(buf, pos, _be(field_len, ">i4"))
+        pos = pos + 4
+        if kind == "fixed":
+            _scatter_fixed(buf, pos, value)
+        else:
+            _scatter_var(buf, pos, *value)
+        pos = pos + size
+    return buf.tobytes()
+
+def encode_traces(table: pa.Table) -> bytes:
+    """Binary COPY payload of a trace batch (decode_traces + enrich_data columns) for COPY_COLUMNS."""
+    if table.num_rows == 0:
+        return encode_copy(0, [])
+    lon = table['longitude'].to_numpy()
+    lat = table['latitude'].to_numpy()
+    return encode_copy(table.num_rows, [
+        ("text", _text_field(table['driver_id'])),
+        ("text", _text_field(table['vehicle_id'])),
+        ("fixed", _be(pg_timestamps(table['timestamp_ms'].to_numpy()), ">i8")),
+        ("fixed", ewkb_points(lon, lat)),
+        ("fixed", _be(table['speed_mps'].to_numpy(), ">f8")),
+        ("text", _text_field(table['event_type'])),
+        ("text", _text_field(table['geohash'])),
+    ])
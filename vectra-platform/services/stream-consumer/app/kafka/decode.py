@@ -0,0 +1,67 @@
+import io
+import json
+import structlog
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+
+logger = structlog.get_logger()
+
+# Columns of a trace batch, as produced by ingestion-edge (TracePayload / GpsTrace)
+TRACE_SCHEMA = pa.schema([
+    ("driver_id", pa.string()),
+    ("vehicle_id", pa.string()),
+    ("latitude", pa.float64()),
+    ("longitude", pa.float64()),
+    ("speed_mps", pa.float64()),
+    ("timestamp_ms", pa.int64()),
+    ("event_type", pa.string()),
+    ("accuracy_m", pa.float64()),
+])
+
+# TracePayload defaults; protobuf JSON also omits zero-valued fields
+DEFAULTS = {"speed_mps": 0.0, "event_type": "PING", "accuracy_m": 0.0}
+
+_PARSE_OPTIONS = pa_json.ParseOptions(explicit_schema=TRACE_SCHEMA, unexpected_field_behavior="ignore")
+
+def _fill_defaults(table: pa.Table) -> pa.Table:
+    for name, value in DEFAULTS.items():
+        i = table.schema.get_field_index(name)
+        table = table.set_column(i, name, table.column(name).fill_null(value))
+    return table
+
+def _decode_rows(values) -> pa.Table:
+    """Slow path: per-message parsing with coercion; malformed messages are dropped."""
+    columns = {field.name: [] for field in TRACE_SCHEMA}
+    casts = {pa.string(): lambda v: None if v is None else str(v),
+             pa.float64(): lambda v: None if v is None else float(v),
+             pa.int64(): lambda v: None if v is None else int(v)}
+    for raw in values:
+        try:
+            record = json.loads(raw)
+            row = {f.name: casts[f.type](record.get(f.name)) for f in TRACE_SCHEMA}
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error("Poison pill detected", error=str(e))
+            continue
+        for name, value in row.items():
+            columns[name].append(value)
+    return pa.Table.from_pydict(columns, schema=TRACE_SCHEMA)
+
+def decode_traces(values) -> pa.Table:
+    """
+    Decodes raw Kafka values (JSON bytes) into one Arrow table with TRACE_SCHEMA.
+    The batch is parsed as newline-delimited JSON by Arrow's C++ reader, straight
+    into column buffers; batches it rejects (protobuf-JSON int64 strings, bad
+    messages) go through the per-message path instead.
+    """
+    if not values:
+        return TRACE_SCHEMA.empty_table()
+    try:
+        table = pa_json.read_json(io.BytesIO(b"\n".join(values)), parse_options=_PARSE_OPTIONS)
+    except pa.ArrowInvalid:
+        table = _decode_rows(values)
+    # Coordinates and time are required
+    valid = table.column("latitude").is_valid()
+    for name in ("longitude", "timestamp_ms", "driver_id"):
+        valid = pc.and_(valid, table.column(name).is_valid())
+    return _fill_defaults(table.filter(valid))
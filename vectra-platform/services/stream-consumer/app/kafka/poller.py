@@ -0,0 +1,173 @@
+import asyncio
+import queue
+import threading
+import structlog
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, NamedTuple, Optional
+from kafka import KafkaConsumer, TopicPartition
+from kafka.structs import OffsetAndMetadata
+
+logger = structlog.get_logger()
+
+class PollChunk(NamedTuple):
+    """One poll result."""
+    values: List[bytes]
+    offsets: Dict[TopicPartition, int] # Per partition, the next offset to consume
+    first_offset: int
+    nbytes: int # Serialized size of the values
+    oldest_ms: int # Kafka timestamp of the oldest record
+
+class KafkaPoller:
+    """
+    Runs the blocking kafka-python consumer on its own thread and feeds poll
+    results into a bounded asyncio.Queue, so fetching overlaps with the event
+    loop's writes. KafkaConsumer is not thread-safe: commits requested from the
+    loop are queued and executed here, between polls.
+
+    When the queue is full the assigned partitions are paused and polling
+    continues empty, which keeps the member alive in the group (max.poll.interval)
+    without fetching more than the pipeline can absorb.
+
+    If the thread fails, the exception is put on the queue behind the chunks
+    already handed off; the reader must raise it instead of waiting forever.
+    """
+    def __init__(self, consumer_factory: Callable[[], KafkaConsumer], loop: asyncio.AbstractEventLoop,
+                 out: asyncio.Queue, poll_timeout_ms: int = 100):
+        self.consumer_factory = consumer_factory
+        self.loop = loop
+        self.out = out
+        self.poll_timeout_ms = poll_timeout_ms
+        self._commits: "queue.Queue[Dict[TopicPartition, int]]" = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="kafka-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Stops polling; commits queued before the call are still executed."""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def commit(self, offsets: Dict[TopicPartition, int]):
+        """Thread-safe: schedules a commit of {partition: next offset}."""
+        self._commits.put(offsets)
+
+    def _drain_commits(self, consumer: KafkaConsumer):
+        while True:
+            try:
+                offsets = self._commits.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                consumer.commit({tp: OffsetAndMetadata(offset, None) for tp, offset in offsets.items()})
+            except Exception as e:
+                # Revoked partitions (rebalance): the new owner resumes from the last commit
+                logger.error("Offset Commit Failed", error=str(e))
+
+    def _hand_off(self, consumer: KafkaConsumer, chunk: PollChunk) -> Dict[TopicPartition, list]:
+        """
+        Blocks until the loop accepts the chunk. Returns the records polled
+        meanwhile, which become the next chunk (never dropped: later commits
+        would skip them).
+        """
+        future = asyncio.run_coroutine_threadsafe(self.out.put(chunk), self.loop)
+        carried: Dict[TopicPartition, list] = {}
+        throttled = False
+        while True:
+            try:
+                future.result(timeout=self.poll_timeout_ms / 1000)
+                break
+            except FutureTimeout:
+                if self._stopping.is_set():
+                    # Never handed off, never committed: redelivered after restart
+                    future.cancel()
+                    return {}
+                # Backpressure: stay in the group without fetching. Re-paused on
+                # every pass: a rebalance inside poll() rebuilds the assignment unpaused.
+                consumer.pause(*consumer.assignment())
+                throttled = True
+                self._drain_commits(consumer)
+                for tp, messages in consumer.poll(timeout_ms=self.poll_timeout_ms).items():
+                    carried.setdefault(tp, []).extend(messages)
+        if throttled:
+            # Only what is still assigned (and paused) after any rebalance
+            consumer.resume(*consumer.paused())
+        return carried
+
+    @staticmethod
+    def _chunk(records: Dict[TopicPartition, list]) -> PollChunk:
+        values, offsets, oldest_ms = [], {}, None
+        for tp, messages in records.items():
+            values.extend(msg.value for msg in messages)
+            offsets[tp] = messages[-1].offset + 1
+            first_ms = min(msg.timestamp for msg in messages)
+            oldest_ms = first_ms if oldest_ms is None else min(oldest_ms, first_ms)
+        first_offset = next(iter(records.values()))[0].offset
+        nbytes = sum(len(v) for v in values)
+        return PollChunk(values, offsets, first_offset, nbytes, oldest_ms)
+
+    def _fail(self, error: Exception):
+        try:
+            asyncio.run_coroutine_threadsafe(self.out.put(error), self.loop)
+        except RuntimeError:
+            pass # Loop already closed: nobody left to tell
+
+    def _run(self):
+        try:
+            consumer = self.consumer_factory()
+        except Exception as e:
+            logger.critical("Kafka Poller Crashed", error=str(e))
+            self._fail(e)
+            return
+        logger.info("Kafka Poller Started")
+        try:
+            records = {}
+            while not self._stopping.is_set():
+                self._drain_commits(consumer)
+                if not records:
+                    records = consumer.poll(timeout_ms=self.poll_timeout_ms)
+                    if not records:
+                        continue
+                records = self._hand_off(consumer, self._chunk(records))
+        except Exception as e:
+            logger.critical("Kafka Poller Crashed", error=str(e))
+            self._fail(e)
+        finally:
+            self._drain_commits(consumer)
+            consumer.close(autocommit=False)
+            logger.info("Kafka Poller Stopped")
+
+class OffsetTracker:
+    """
+    In-order commits for batches that complete out of order: a batch's offsets
+    become committable only once every earlier batch has completed.
+    """
+    def __init__(self):
+        self._next_seq = 0
+        self._next_commit = 0
+        self._offsets: Dict[int, Dict[TopicPartition, int]] = {}
+        self._done = set()
+
+    def begin(self, offsets: Dict[TopicPartition, int]) -> int:
+        seq = self._next_seq
+        self._next_seq += 1
+        self._offsets[seq] = offsets
+        return seq
+
+    def complete(self, seq: int) -> Optional[Dict[TopicPartition, int]]:
+        """Marks a batch done; returns the offsets now safe to commit, if any."""
+        self._done.add(seq)
+        ready: Dict[TopicPartition, int] = {}
+        while self._next_commit in self._done:
+            self._done.remove(self._next_commit)
+            for tp, offset in self._offsets.pop(self._next_commit).items():
+                ready[tp] = max(offset, ready.get(tp, 0))
+            self._next_commit += 1
+        return ready or None
+
+    @property
+    def pending(self) -> int:
+        return len(self._offsets)
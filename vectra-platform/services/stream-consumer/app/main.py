@@ -1,78 +1,198 @@
 import asyncio
-import json
 import structlog
 import aioboto3
 import asyncpg
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import io
 import time
-import pygeohash as pgh
+from datetime import datetime, timezone
+from services.common.python import geohash as vgh
+from services.common.python import lake
 from kafka import KafkaConsumer
 from app.core.config import settings
+from app.kafka.decode import decode_traces
+from app.kafka.poller import KafkaPoller, OffsetTracker
+from app.core.flush import FlushPolicy
+from app.core import metrics
+from prometheus_client import start_http_server
+from botocore.exceptions import ClientError, HTTPClientError
+from app.db.binary_copy import COPY_COLUMNS, encode_traces
 
 logger = structlog.get_logger()
 
 # --- Optimization 2: The Stillness Filter ---
-def filter_noise(df: pd.DataFrame) -> pd.DataFrame:
+def filter_noise(table: pa.Table) -> pa.Table:
     """
     Remove points where vehicle is stopped to save DB space.
     Logic: If speed < 0.5 m/s, it's noise/stopped.
     Exception: Keep the FIRST and LAST point of a stop (to mark duration).
     """
-    if df.empty: return df
+    if table.num_rows == 0: return table
     
     # Simple vectorization: Keep if speed > 0.5 OR event is not 'PING'
     # (Events like 'SCAN' or 'STOP' must always be kept)
-    mask = (df['speed_mps'] > 0.5) | (df['event_type'] != 'PING')
-    return df[mask]
+    mask = pc.or_(pc.greater(table['speed_mps'], 0.5), pc.not_equal(table['event_type'], 'PING'))
+    return table.filter(mask)
 
 # --- Optimization 3: Geohashing ---
-def enrich_data(df: pd.DataFrame) -> pd.DataFrame:
+def enrich_data(table: pa.Table) -> pa.Table:
     """Add Geohash for fast string-based indexing"""
-    if df.empty: return df
+    if table.num_rows == 0: return table
     # Generate Geohash (Precision 7 is ~150m, good for neighborhood lookups)
-    df['geohash'] = df.apply(lambda x: pgh.encode(x['latitude'], x['longitude'], precision=7), axis=1)
-    return df
+    # Vectorized bit-interleaving over the whole batch (no per-row apply)
+    ghash = vgh.encode(table['latitude'].to_numpy(), table['longitude'].to_numpy(), precision=7)
+    return table.append_column('geohash', pa.array(ghash, pa.string()))
 
-async def write_to_s3(session, df, first_offset):
-    """Async S3 Upload"""
-    if df.empty: return
+def lake_files(table: pa.Table, batch_id: str) -> list:
+    """(key, Parquet bytes) per lake partition (date, geohash_p4) of the batch."""
+    return [(f"{path}/part-{batch_id}.parquet", lake.to_parquet_bytes(part))
+            for path, part in lake.split_partitions(table)]
+
+async def write_to_s3(session, table, batch_id):
+    """Async S3 Upload, one file per Hive partition. Keys depend only on the batch, so retries overwrite."""
+    if table.num_rows == 0: return
     
-    buffer = io.BytesIO()
-    df.to_parquet(buffer, index=False)
-    buffer.seek(0)
-    file_key = f"traces/{int(time.time())}_{first_offset}.parquet"
+    # zstd encoding is CPU work: keep it off the event loop
+    files = await asyncio.get_running_loop().run_in_executor(None, lake_files, table, batch_id)
     
     async with session.client("s3", endpoint_url=settings.S3_ENDPOINT,
                               aws_access_key_id=settings.AWS_ACCESS_KEY,
                               aws_secret_access_key=settings.AWS_SECRET_KEY) as s3:
-        await s3.upload_fileobj(buffer, settings.S3_BUCKET_NAME, file_key)
-        logger.info("S3 Write Success", key=file_key)
+        await asyncio.gather(*(
+            s3.upload_fileobj(io.BytesIO(body), settings.S3_BUCKET_NAME, key) for key, body in files
+        ))
+        logger.info("S3 Write Success", batch=batch_id, files=len(files), bytes=sum(len(body) for _, body in files))
+
+# One upsert per batch: counts SCANs per geohash so the refinery only visits touched cells
+MARK_DIRTY_SQL = """
+    INSERT INTO dirty_geohashes (geohash, last_event_at, pending_count)
+    SELECT * FROM unnest($1::varchar[], $2::timestamptz[], $3::int[])
+    ON CONFLICT (geohash) DO UPDATE SET
+        last_event_at = GREATEST(dirty_geohashes.last_event_at, EXCLUDED.last_event_at),
+        pending_count = dirty_geohashes.pending_count + EXCLUDED.pending_count
+"""
 
-async def write_to_postgres(pool, df):
+def dirty_cells(table: pa.Table):
+    """(geohashes, last_event_at, scan_counts) for the SCAN events of a batch."""
+    scans = table.filter(pc.equal(table['event_type'], 'SCAN'))
+    if scans.num_rows == 0:
+        return None
+    # Sorted keys: concurrent consumers lock overlapping rows in the same order (no deadlocks)
+    cells, inverse, counts = np.unique(scans['geohash'].to_numpy(zero_copy_only=False), return_inverse=True, return_counts=True)
+    last_ms = np.full(len(cells), np.iinfo(np.int64).min)
+    np.maximum.at(last_ms, inverse, scans['timestamp_ms'].to_numpy())
+    last_event_at = [datetime.fromtimestamp(ms / 1000, tz=timezone.utc) for ms in last_ms.tolist()]
+    return cells.tolist(), last_event_at, counts.tolist()
+
+async def write_to_postgres(pool, table):
     """Async PostGIS Copy"""
-    if df.empty: return
-
-    # Prepare CSV buffer for COPY
-    output = io.StringIO()
-    # Note: We added 'geohash' to the columns
-    for _, r in df.iterrows():
-        output.write(f"{r['driver_id']}\t{r['vehicle_id']}\t"
-                     f"{pd.to_datetime(r['timestamp_ms'], unit='ms').isoformat()}\t"
-                     f"SRID=4326;POINT({r['longitude']} {r['latitude']})\t"
-                     f"{r['speed_mps']}\t{r['event_type']}\t{r['geohash']}\n")
-    output.seek(0)
+    if table.num_rows == 0: return
+
+    # Binary COPY buffer: EWKB geometry and int64 timestamps, nothing for the server to parse
+    output = io.BytesIO(encode_traces(table))
 
+    dirty = dirty_cells(table)
     async with pool.acquire() as conn:
-        # Use Copy protocol
-        await conn.copy_from_table(
-            'raw_gps_traces',
-            columns=('driver_id', 'vehicle_id', 'timestamp', 'geom', 'speed', 'event_type', 'geohash'),
-            format='csv',
-            delimiter='\t',
-            source=output
+        # Traces and their dirty marks land atomically
+        async with conn.transaction():
+            # Use Copy protocol
+            await conn.copy_to_table(
+                'raw_gps_traces',
+                columns=COPY_COLUMNS,
+                format='binary',
+                source=output
+            )
+            if dirty:
+                await conn.execute(MARK_DIRTY_SQL, *dirty)
+        logger.info("DB Write Success", rows=table.num_rows, dirty_cells=len(dirty[0]) if dirty else 0)
+
+def transform(values: list) -> pa.Table:
+    """Decode + optimizations; runs off the event loop (Arrow releases the GIL)."""
+    table = decode_traces(values)
+    table = filter_noise(table)
+    return enrich_data(table)
+
+# Errors of the infrastructure, not of the batch: retried until they clear
+TRANSIENT_ERRORS = (
+    OSError, asyncio.TimeoutError, HTTPClientError,
+    asyncpg.PostgresConnectionError, asyncpg.ConnectionDoesNotExistError,
+    asyncpg.InsufficientResourcesError, asyncpg.OperatorInterventionError,
+    asyncpg.SerializationError, asyncpg.DeadlockDetectedError,
+)
+S3_RETRYABLE_CODES = {"SlowDown", "RequestTimeout", "RequestTimeTooSkewed", "Throttling", "InternalError"}
+
+def is_transient(e: Exception) -> bool:
+    if isinstance(e, TRANSIENT_ERRORS):
+        return True
+    if isinstance(e, ClientError):
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return status >= 500 or e.response.get("Error", {}).get("Code") in S3_RETRYABLE_CODES
+    return False
+
+async def with_retries(name: str, write) -> bool:
+    """
+    Retries one sink; later batches queue behind it (offsets stay uncommitted).
+    Transient errors are retried until they clear, anything else (constraint
+    violation, unencodable value) CONSUMER_WRITE_MAX_ATTEMPTS times so a poison
+    batch can't stall the partition. Returns False if the batch was given up on.
+    """
+    delay, attempts = 0.5, 0
+    while True:
+        try:
+            await write()
+            return True
+        except Exception as e:
+            transient = is_transient(e)
+            if not transient:
+                attempts += 1
+                if attempts >= settings.CONSUMER_WRITE_MAX_ATTEMPTS:
+                    logger.error("Batch Rejected", sink=name, error=str(e), attempts=attempts)
+                    return False
+            logger.error("Batch Failed", sink=name, error=str(e), transient=transient, retry_in=delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.CONSUMER_WRITE_RETRY_MAX_SECONDS)
+
+async def dead_letter(session, table, batch_id: str, sink: str):
+    """Parks a rejected batch as one Parquet file outside the lake, for inspection and replay."""
+    key = f"{settings.DEAD_LETTER_PREFIX}/{sink}/part-{batch_id}.parquet"
+
+    async def upload():
+        body = await asyncio.get_running_loop().run_in_executor(None, lake.to_parquet_bytes, table)
+        async with session.client("s3", endpoint_url=settings.S3_ENDPOINT,
+                                  aws_access_key_id=settings.AWS_ACCESS_KEY,
+                                  aws_secret_access_key=settings.AWS_SECRET_KEY) as s3:
+            await s3.upload_fileobj(io.BytesIO(body), settings.S3_BUCKET_NAME, key)
+
+    metrics.DEAD_LETTERED.labels(sink=sink).inc()
+    if await with_retries("dead_letter", upload):
+        logger.warning("Batch Dead-Lettered", sink=sink, key=key, rows=table.num_rows)
+    else:
+        logger.critical("Batch Dropped", sink=sink, batch=batch_id, rows=table.num_rows)
+
+async def write_batch(aws_session, db_pool, table, first_offset):
+    # Sinks retry independently: a Postgres failure never re-uploads the S3 files
+    batch_id = f"{int(time.time() * 1000)}-{first_offset}"
+    if table.num_rows > 0:
+        written = await asyncio.gather(
+            with_retries("s3", lambda: write_to_s3(aws_session, table, batch_id)),
+            with_retries("postgres", lambda: write_to_postgres(db_pool, table))
         )
-        logger.info("DB Write Success", rows=len(df))
+        # The batch's offsets still complete: a rejected sink write is parked, not retried forever
+        for sink, ok in zip(("s3", "postgres"), written):
+            if not ok:
+                await dead_letter(aws_session, table, batch_id, sink)
+
+def create_consumer() -> KafkaConsumer:
+    return KafkaConsumer(
+        settings.KAFKA_TOPIC_TRACES,
+        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+        # Raw bytes: the whole batch is decoded column-wise in decode_traces
+        group_id='vectra-lake-worker-async',
+        enable_auto_commit=False,
+        max_poll_records=settings.CONSUMER_MAX_POLL_RECORDS
+    )
 
 async def consume_loop():
     # 1. Setup Async Resources
@@ -85,50 +205,74 @@ async def consume_loop():
         command_timeout=60
     )
 
-    # Kafka is sync, but we batch process async
-    consumer = KafkaConsumer(
-        settings.KAFKA_TOPIC_TRACES,
-        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda x: json.loads(x.decode('utf-8')),
-        group_id='vectra-lake-worker-async',
-        enable_auto_commit=False,
-        max_poll_records=1000
-    )
+    # Kafka is sync: a poller thread fetches while the loop transforms and writes
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=settings.CONSUMER_POLL_QUEUE_SIZE)
+    poller = KafkaPoller(create_consumer, loop, chunks)
+    tracker = OffsetTracker()
+    # Bounded pipeline: batch N+1 is built while up to N batches are being written
+    in_flight = asyncio.Semaphore(settings.CONSUMER_MAX_IN_FLIGHT_BATCHES)
+    writers = set()
+
+    async def write_and_commit(seq, table, first_offset, oldest_ms):
+        try:
+            await write_batch(aws_session, db_pool, table, first_offset)
+        finally:
+            in_flight.release()
+        if oldest_ms is not None:
+            metrics.END_TO_END_LAG.observe(max(0.0, time.time() - oldest_ms / 1000))
+        offsets = tracker.complete(seq)
+        if offsets:
+            poller.commit(offsets)
 
+    policy = FlushPolicy(
+        max_records=settings.FLUSH_MAX_RECORDS,
+        max_bytes=settings.FLUSH_MAX_BYTES,
+        linger_seconds=settings.FLUSH_LINGER_SECONDS
+    )
+    start_http_server(settings.METRICS_PORT)
+    poller.start()
     logger.info("Async Consumer Started")
-    batch = []
+    batch, offsets, first_offset, oldest_ms = [], {}, None, None
     
-    while True:
-        # Poll is blocking, but fast
-        raw_msgs = consumer.poll(timeout_ms=100)
-        
-        for tp, messages in raw_msgs.items():
-            for msg in messages:
-                batch.append(msg.value)
-
-        if len(batch) >= 1000 or (len(batch) > 0 and time.time() % 5 == 0):
-            # Convert to DF
-            df = pd.DataFrame(batch)
-            
-            # Apply Optimizations
-            df = filter_noise(df) 
-            df = enrich_data(df)
-
-            # Parallel Write
+    try:
+        while True:
+            # Real timer: wake at the linger deadline even if nothing arrives
             try:
-                if not df.empty:
-                    await asyncio.gather(
-                        write_to_s3(aws_session, df, batch[0]['timestamp_ms']),
-                        write_to_postgres(db_pool, df)
-                    )
-                consumer.commit()
-                batch = []
-            except Exception as e:
-                logger.error("Batch Failed", error=str(e))
-                # In prod: Seek back or DLQ
-        
-        await asyncio.sleep(0.01) # Yield to event loop
+                chunk = await asyncio.wait_for(chunks.get(), timeout=policy.time_left())
+                if isinstance(chunk, Exception):
+                    # Poller thread died: exit non-zero, the unflushed batch is redelivered
+                    raise RuntimeError("Kafka poller failed") from chunk
+                if first_offset is None:
+                    first_offset = chunk.first_offset
+                oldest_ms = chunk.oldest_ms if oldest_ms is None else min(oldest_ms, chunk.oldest_ms)
+                batch.extend(chunk.values)
+                offsets.update(chunk.offsets)
+                policy.add(len(chunk.values), chunk.nbytes)
+            except asyncio.TimeoutError:
+                pass
+
+            reason = policy.reason()
+            if reason:
+                metrics.FLUSHES.labels(reason=reason).inc()
+                metrics.BATCH_RECORDS.observe(policy.records)
+                metrics.BATCH_BYTES.observe(policy.bytes)
+                logger.info("Batch Flush", reason=reason, records=policy.records, bytes=policy.bytes)
+                # Columnar batch, shared by both sinks
+                table = await loop.run_in_executor(None, transform, batch)
+                seq = tracker.begin(offsets)
+                await in_flight.acquire()
+                task = asyncio.create_task(write_and_commit(seq, table, first_offset, oldest_ms))
+                writers.add(task)
+                task.add_done_callback(writers.discard)
+                batch, offsets, first_offset, oldest_ms = [], {}, None, None
+                policy.reset()
+    finally:
+        # Finish what was handed to the sinks; the unflushed tail is redelivered
+        if writers:
+            await asyncio.gather(*writers, return_exceptions=True)
+        poller.stop()
+        await db_pool.close()
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(consume_loop())
\ No newline at end of file
+    asyncio.run(consume_loop())
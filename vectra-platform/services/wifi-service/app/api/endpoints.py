@@ -1,6 +1,7 @@
 from fastapi import APIRouter
-from pydantic import BaseModel
-from typing import Dict
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from app.core.config import settings
 from app.core.knn import WifiLocator
 
 router = APIRouter()
@@ -11,15 +12,51 @@ class WifiPayload(BaseModel):
     latitude: float
     longitude: float
     wifi_scan: Dict[str, int] # {"aa:bb:cc:dd": -50}
+    # Locate only: also search the 8 neighboring cells (defaults to LOCATE_INCLUDE_NEIGHBORS)
+    include_neighbors: Optional[bool] = None
+
+class WifiBatchPayload(BaseModel):
+    # Fleet devices upload scans in bursts
+    scans: List[WifiPayload] = Field(..., min_length=1, max_length=settings.INGEST_MAX_SCANS_PER_REQUEST)
+
+class WifiLocateBatchPayload(BaseModel):
+    # Indoor trajectory: sequence of scans, each with its own coarse fix
+    scans: List[WifiPayload] = Field(..., min_length=1, max_length=settings.LOCATE_BATCH_MAX_SCANS)
 
 @router.post("/ingest")
-def ingest_signal(payload: WifiPayload):
-    locator.ingest(payload.latitude, payload.longitude, payload.wifi_scan)
+async def ingest_signal(payload: WifiPayload):
+    await locator.ingest_batch_async([payload.latitude], [payload.longitude], [payload.wifi_scan])
     return {"status": "indexed"}
 
+@router.post("/ingest/batch")
+async def ingest_signal_batch(payload: WifiBatchPayload):
+    requests_sent = await locator.ingest_batch_async(
+        [s.latitude for s in payload.scans],
+        [s.longitude for s in payload.scans],
+        [s.wifi_scan for s in payload.scans]
+    )
+    return {"status": "indexed", "count": len(payload.scans), "requests": requests_sent}
+
 @router.post("/locate")
-def locate_device(payload: WifiPayload):
-    result = locator.locate(payload.latitude, payload.longitude, payload.wifi_scan)
+async def locate_device(payload: WifiPayload):
+    result = await locator.locate_async(
+        payload.latitude, payload.longitude, payload.wifi_scan,
+        include_neighbors=payload.include_neighbors
+    )
     if result:
         return {"source": "wifi_knn", "location": result}
-    return {"source": "failure", "detail": "not_enough_data"}
\ No newline at end of file
+    return {"source": "failure", "detail": "not_enough_data"}
+
+@router.post("/locate/batch")
+async def locate_device_batch(payload: WifiLocateBatchPayload):
+    results = await locator.locate_batch_async(
+        [s.latitude for s in payload.scans],
+        [s.longitude for s in payload.scans],
+        [s.wifi_scan for s in payload.scans]
+    )
+    return {
+        "results": [
+            {"source": "wifi_knn", "location": r} if r else {"source": "failure", "detail": "not_enough_data"}
+            for r in results
+        ]
+    }
@@ -0,0 +1,75 @@
+from cachetools import TLRUCache
+from threading import RLock
+from typing import Callable, Optional
+from app.core.config import settings
+from app.core.fingerprint import FingerprintIndex
+import structlog
+
+logger = structlog.get_logger()
+
+class CellIndexCache:
+    """
+    Bounded cache of compiled FingerprintIndex objects keyed by geohash_p6.
+    LRU eviction against a memory budget (bytes), entries expire after a TTL so
+    writes from other replicas are picked up on the next rebuild.
+
+    Entries are (index, expires_at): an index patched in place is re-inserted so
+    the budget sees its new size, while keeping the deadline of its build.
+    """
+    def __init__(self, max_bytes: int = None, ttl: int = None):
+        self.ttl = ttl or settings.CELL_INDEX_TTL_SECONDS
+        self.cache = TLRUCache(
+            maxsize=max_bytes or settings.CELL_INDEX_CACHE_MB * 1024 * 1024,
+            ttu=lambda ghash, entry, now: entry[1],
+            getsizeof=lambda entry: entry[0].nbytes
+        )
+        self.lock = RLock()
+
+    def get(self, ghash: str) -> Optional[FingerprintIndex]:
+        with self.lock:
+            entry = self.cache.get(ghash)
+            return entry[0] if entry is not None else None
+
+    def get_or_build(self, ghash: str, builder: Callable[[str], Optional[FingerprintIndex]]) -> Optional[FingerprintIndex]:
+        index = self.get(ghash)
+        if index is not None:
+            return index
+
+        # Build outside the lock so a cold cell doesn't stall every other cell
+        index = builder(ghash)
+        if index is None:
+            return None
+
+        return self.put(ghash, index)
+
+    def put(self, ghash: str, index: FingerprintIndex) -> FingerprintIndex:
+        """Stores a freshly built index; returns whichever copy ends up cached."""
+        with self.lock:
+            try:
+                # Another builder may have won the race; keep its copy
+                return self.cache.setdefault(ghash, (index, self.cache.timer() + self.ttl))[0]
+            except ValueError:
+                # Single cell larger than the whole budget: serve it uncached
+                logger.warning("Cell index exceeds cache budget", geohash=ghash, nbytes=index.nbytes)
+                return index
+
+    def patch(self, ghash: str, apply: Callable[[FingerprintIndex], None]) -> bool:
+        """
+        Applies an in-place update to a cached index (no-op for cold cells) and
+        re-inserts it so its grown size counts against the budget.
+        """
+        with self.lock:
+            entry = self.cache.get(ghash)
+            if entry is None:
+                return False
+            apply(entry[0])
+            try:
+                self.cache[ghash] = entry
+            except ValueError:
+                # Outgrew the whole budget: next lookup rebuilds it uncached
+                self.cache.pop(ghash, None)
+            return True
+
+    def invalidate(self, ghash: str):
+        with self.lock:
+            self.cache.pop(ghash, None)
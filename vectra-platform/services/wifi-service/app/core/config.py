@@ -0,0 +1,40 @@
+from typing import List
+from pydantic_settings import BaseSettings
+
+class Settings(BaseSettings):
+    CASSANDRA_HOSTS: List[str] = ["scylla"]
+    CASSANDRA_PORT: int = 9042
+    CASSANDRA_KEYSPACE: str = "vectra_wifi"
+    CASSANDRA_REQUEST_TIMEOUT: float = 2.0
+
+    # Rows per page when streaming a radio_map partition
+    RADIO_MAP_FETCH_SIZE: int = 5000
+
+    # Ingest pipeline: scans per unlogged batch (one partition each),
+    # max outstanding writes before callers block, max scans per /ingest/batch
+    INGEST_BATCH_MAX_STATEMENTS: int = 20
+    INGEST_MAX_IN_FLIGHT: int = 256
+    INGEST_MAX_SCANS_PER_REQUEST: int = 1000
+
+    # Async API concurrency: locates in flight per worker, threads for NumPy scoring
+    LOCATE_MAX_CONCURRENCY: int = 512
+    SCORING_THREADS: int = 4
+    LOCATE_BATCH_MAX_SCANS: int = 500
+
+    # Boundary-aware locate: also read the 8 neighboring p6 cells and keep
+    # references within this radius of the coarse fix
+    LOCATE_INCLUDE_NEIGHBORS: bool = False
+    NEIGHBOR_PRUNE_RADIUS_M: float = 300.0
+
+    # Inverted-index pre-filter: only score references sharing this many APs
+    # with the target (0 disables; relaxes automatically if fewer than k match)
+    LOCATE_MIN_SHARED_APS: int = 2
+
+    # Compiled cell index cache (one FingerprintIndex per geohash_p6)
+    CELL_INDEX_CACHE_MB: int = 512
+    CELL_INDEX_TTL_SECONDS: int = 300
+
+    class Config:
+        env_file = ".env"
+
+settings = Settings()
@@ -0,0 +1,442 @@
+import numpy as np
+from services.common.python import geohash as vgh
+from threading import RLock
+from typing import Dict, List, Optional, Sequence
+
+# Signal level assigned to an AP that a reference point never heard.
+RSSI_FLOOR = -100.0
+
+# Synthetic reference points are p8 bins (~38m x 19m, roughly room/small shop sized)
+BIN_PRECISION = 8
+
+METERS_PER_DEGREE = 111320.0
+
+# Ingested presence bits tolerated before the inverted index is rebuilt
+MAX_PENDING_POSTINGS = 1024
+
+
+class FingerprintIndex:
+    """
+    Compiled radio map of one geohash cell.
+    Rows are synthetic reference points (one per p8 bin), columns are BSSIDs of
+    the cell vocabulary. Missing readings hold RSSI_FLOOR and are False in the
+    presence mask. Buffers are over-allocated so ingest can patch the index in
+    place (running means, appended rows/columns) without a rebuild.
+    """
+    def __init__(self, capacity_rows: int = 16, capacity_cols: int = 32):
+        self.vocabulary: Dict[str, int] = {}
+        self.bins: Dict[str, int] = {}
+        self.n_rows = 0
+        self.lock = RLock()
+
+        self._rssi = np.full((capacity_rows, capacity_cols), RSSI_FLOOR, dtype=np.float32)
+        self._presence = np.zeros((capacity_rows, capacity_cols), dtype=bool)
+        # Readings averaged into each (bin, AP) cell, for the running mean
+        self._hits = np.zeros((capacity_rows, capacity_cols), dtype=np.int32)
+        self._coords = np.zeros((capacity_rows, 2), dtype=np.float64)
+        self._scan_counts = np.zeros(capacity_rows, dtype=np.int64)
+        self._ap_counts = np.zeros(capacity_rows, dtype=np.int64)
+
+        # Inverted index BSSID column -> reference rows (CSR), built lazily.
+        # Presence bits added by ingest since the last build stay in _pending_postings.
+        self._postings = None
+        self._pending_postings: List[tuple] = []
+        # Ephemeral snapshots (merge) count shared APs straight from presence
+        self.use_postings = True
+
+    # --- Views over the live part of the buffers ---
+    @property
+    def rssi(self) -> np.ndarray:
+        return self._rssi[:self.n_rows, :len(self.vocabulary)]
+
+    @property
+    def presence(self) -> np.ndarray:
+        return self._presence[:self.n_rows, :len(self.vocabulary)]
+
+    @property
+    def coords(self) -> np.ndarray:
+        return self._coords[:self.n_rows]
+
+    @property
+    def ap_counts(self) -> np.ndarray:
+        # Number of APs heard per reference (|B| term of the Jaccard union)
+        return self._ap_counts[:self.n_rows]
+
+    @property
+    def nbytes(self) -> int:
+        return (self._rssi.nbytes + self._presence.nbytes + self._hits.nbytes +
+                self._coords.nbytes + self._scan_counts.nbytes + self._ap_counts.nbytes)
+
+    def __len__(self):
+        return self.n_rows
+
+    @classmethod
+    def from_scans(cls, raw_rows: List[dict]) -> "FingerprintIndex":
+        """
+        Spatial Binning of raw scans given as dicts ({'latitude', 'longitude', 'bssids'}).
+        """
+        builder = FingerprintIndexBuilder()
+        builder.add_columns(
+            [r['latitude'] for r in raw_rows],
+            [r['longitude'] for r in raw_rows],
+            [r['bssids'] for r in raw_rows]
+        )
+        return builder.build()
+
+    @classmethod
+    def from_bins(cls, bins: Sequence[tuple]) -> "FingerprintIndex":
+        """
+        Loads offline-compacted bins: (bin_p8, latitude, longitude, scan_count, rssi_mean, rssi_hits)
+        tuples as stored in radio_map_compacted. No aggregation happens here.
+        """
+        n_rows = len(bins)
+        vocabulary: Dict[str, int] = {}
+        sizes = [len(b[4]) for b in bins]
+        total = sum(sizes)
+        rows = np.repeat(np.arange(n_rows), sizes)
+        cols = np.fromiter((vocabulary.setdefault(mac, len(vocabulary)) for b in bins for mac in b[4]), dtype=np.intp, count=total)
+        means = np.fromiter((v for b in bins for v in b[4].values()), dtype=np.float32, count=total)
+        hits = np.fromiter((b[5].get(mac, 1) for b in bins for mac in b[4]), dtype=np.int32, count=total)
+
+        index = cls(capacity_rows=max(n_rows, 16), capacity_cols=max(len(vocabulary), 32))
+        index.vocabulary = vocabulary
+        index.bins = {b[0]: row for row, b in enumerate(bins)}
+        index.n_rows = n_rows
+        index._rssi[rows, cols] = means
+        index._presence[rows, cols] = True
+        index._hits[rows, cols] = hits
+        index._coords[:n_rows] = np.array([(b[1], b[2]) for b in bins], dtype=np.float64).reshape(n_rows, 2)
+        index._scan_counts[:n_rows] = [b[3] for b in bins]
+        index._ap_counts[:n_rows] = sizes
+        return index
+
+    def _grow(self, rows: int, cols: int):
+        """Doubles buffer capacity until (rows, cols) fits."""
+        cap_rows, cap_cols = self._rssi.shape
+        if rows <= cap_rows and cols <= cap_cols:
+            return
+        while cap_rows < rows:
+            cap_rows *= 2
+        while cap_cols < cols:
+            cap_cols *= 2
+
+        def resized(buf, fill, shape):
+            out = np.full(shape, fill, dtype=buf.dtype)
+            out[tuple(slice(0, s) for s in buf.shape)] = buf
+            return out
+
+        self._rssi = resized(self._rssi, RSSI_FLOOR, (cap_rows, cap_cols))
+        self._presence = resized(self._presence, False, (cap_rows, cap_cols))
+        self._hits = resized(self._hits, 0, (cap_rows, cap_cols))
+        self._coords = resized(self._coords, 0.0, (cap_rows, 2))
+        self._scan_counts = resized(self._scan_counts, 0, (cap_rows,))
+        self._ap_counts = resized(self._ap_counts, 0, (cap_rows,))
+
+    def add_scan(self, lat: float, lon: float, scan: Dict[str, int]):
+        """
+        Incremental ingest: folds one raw scan into its p8 bin (running mean),
+        appending a row for a new bin and columns for unseen BSSIDs.
+        """
+        bin_key = vgh.encode_one(lat, lon, precision=BIN_PRECISION)
+        with self.lock:
+            row = self.bins.get(bin_key)
+            new_macs = [mac for mac in scan if mac not in self.vocabulary]
+            self._grow(self.n_rows + (row is None), len(self.vocabulary) + len(new_macs))
+            for mac in new_macs:
+                self.vocabulary[mac] = len(self.vocabulary)
+
+            if row is None:
+                row = self.n_rows
+                self.bins[bin_key] = row
+                self.n_rows += 1
+
+            self._scan_counts[row] += 1
+            self._coords[row] += (np.array([lat, lon]) - self._coords[row]) / self._scan_counts[row]
+
+            cols = np.fromiter((self.vocabulary[mac] for mac in scan), dtype=np.intp, count=len(scan))
+            levels = np.fromiter(scan.values(), dtype=np.float64, count=len(scan))
+            if self._postings is not None:
+                fresh = cols[~self._presence[row, cols]]
+                self._pending_postings.extend((row, col) for col in fresh)
+                if len(self._pending_postings) > MAX_PENDING_POSTINGS:
+                    self._postings = None
+            self._hits[row, cols] += 1
+            current = self._rssi[row, cols].astype(np.float64)
+            # First reading replaces the floor: mean + (x - mean) / 1 == x
+            self._rssi[row, cols] = current + (levels - current) / self._hits[row, cols]
+            self._presence[row, cols] = True
+            self._ap_counts[row] = np.count_nonzero(self._presence[row, :len(self.vocabulary)])
+
+    def rows_within(self, lat: float, lon: float, radius_m: float) -> np.ndarray:
+        """Rows whose bin centroid lies within radius_m of (lat, lon) (equirectangular)."""
+        with self.lock:
+            coords = self.coords.copy()
+        d_lat = (coords[:, 0] - lat) * METERS_PER_DEGREE
+        d_lon = (coords[:, 1] - lon) * METERS_PER_DEGREE * np.cos(np.radians(lat))
+        return np.nonzero(d_lat ** 2 + d_lon ** 2 <= radius_m ** 2)[0]
+
+    @classmethod
+    def merge(cls, parts: Sequence[tuple]) -> "FingerprintIndex":
+        """
+        Stacks selected rows of several cell indexes, given as (index, rows) pairs,
+        into one candidate matrix over the union of their vocabularies.
+        The result is a per-request snapshot; it is not patched by ingest.
+        """
+        vocabulary: Dict[str, int] = {}
+        snapshots = []
+        for index, rows in parts:
+            with index.lock:
+                macs = list(index.vocabulary)
+                snapshots.append((
+                    macs,
+                    index.rssi[rows], index.presence[rows], index._hits[rows, :len(macs)],
+                    index.coords[rows], index._scan_counts[rows]
+                ))
+            for mac in macs:
+                vocabulary.setdefault(mac, len(vocabulary))
+
+        n_rows = sum(len(snap[4]) for snap in snapshots)
+        merged = cls(capacity_rows=max(n_rows, 1), capacity_cols=max(len(vocabulary), 1))
+        merged.vocabulary = vocabulary
+        offset = 0
+        for macs, rssi, presence, hits, coords, scan_counts in snapshots:
+            rows = slice(offset, offset + len(coords))
+            cols = np.fromiter((vocabulary[mac] for mac in macs), dtype=np.intp, count=len(macs))
+            merged._rssi[rows, cols] = rssi
+            merged._presence[rows, cols] = presence
+            merged._hits[rows, cols] = hits
+            merged._coords[rows] = coords
+            merged._scan_counts[rows] = scan_counts
+            merged._ap_counts[rows] = presence.sum(axis=1)
+            offset += len(coords)
+        merged.n_rows = n_rows
+        merged.use_postings = False
+        return merged
+
+    def _build_postings(self):
+        # nonzero over the transposed mask walks column by column, so rows come grouped by BSSID
+        cols, rows = np.nonzero(self.presence.T)
+        indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=len(self.vocabulary)), out=indptr[1:])
+        self._postings = (indptr, rows)
+        self._pending_postings = []
+
+    def shared_ap_counts(self, target_scan: Dict[str, int]) -> np.ndarray:
+        """Number of target APs each reference has heard, via the inverted index."""
+        with self.lock:
+            cols = [self.vocabulary[mac] for mac in target_scan if mac in self.vocabulary]
+            if not self.use_postings:
+                return self.presence[:, cols].sum(axis=1)
+
+            if self._postings is None:
+                self._build_postings()
+            indptr, postings = self._postings
+            # Columns added by ingest after the build only live in the pending list
+            indexed = [c for c in cols if c + 1 < len(indptr)]
+            counts = np.bincount(
+                np.concatenate([postings[indptr[c]:indptr[c + 1]] for c in indexed] or [np.empty(0, dtype=np.int64)]),
+                minlength=self.n_rows
+            )
+            if self._pending_postings:
+                pending = np.array(self._pending_postings, dtype=np.int64)
+                pending = pending[np.isin(pending[:, 1], cols)]
+                np.add.at(counts, pending[:, 0], 1)
+            return counts
+
+    def candidate_rows(self, scans: Sequence[Dict[str, int]], min_shared: int, k: int) -> Optional[np.ndarray]:
+        """
+        Pre-filter: references sharing at least min_shared APs with any target scan.
+        Relaxes to a single shared AP, then to all rows (None), if fewer than k survive.
+        """
+        best = np.zeros(len(self), dtype=np.int64)
+        for scan in scans:
+            np.maximum(best, self.shared_ap_counts(scan)[:len(best)], out=best)
+        for threshold in (min_shared, 1):
+            rows = np.nonzero(best >= threshold)[0]
+            if len(rows) >= k:
+                return rows
+        return None
+
+    def _project(self, scans: Sequence[Dict[str, int]]):
+        """
+        Maps target scans onto the columns they touch.
+        Returns (columns, values, mask, sizes, oov_sq) where columns is the union of
+        vocabulary columns seen by any scan and oov_sq is the squared distance
+        contributed by target APs unknown to this cell (every reference is at floor).
+        """
+        n_scans = len(scans)
+        local = {}
+        entries = []
+        sizes = np.zeros(n_scans, dtype=np.float64)
+        oov_sq = np.zeros(n_scans, dtype=np.float64)
+
+        for i, scan in enumerate(scans):
+            sizes[i] = len(scan)
+            for mac, level in scan.items():
+                col = self.vocabulary.get(mac)
+                if col is None:
+                    oov_sq[i] += (RSSI_FLOOR - level) ** 2
+                    continue
+                j = local.setdefault(col, len(local))
+                entries.append((i, j, level))
+
+        columns = np.fromiter(local.keys(), dtype=np.intp, count=len(local))
+        values = np.zeros((n_scans, len(columns)), dtype=np.float64)
+        mask = np.zeros((n_scans, len(columns)), dtype=np.float64)
+        if entries:
+            ii, jj, vv = np.array(entries, dtype=np.float64).T
+            ii, jj = ii.astype(np.intp), jj.astype(np.intp)
+            values[ii, jj] = vv
+            mask[ii, jj] = 1.0
+        return columns, values, mask, sizes, oov_sq
+
+    def distances(self, scans: Sequence[Dict[str, int]], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Jaccard-penalized RSSI distance of every scan to every reference (or to the
+        given rows only), shape (scans, refs).
+        Euclidean distance runs over the target's APs only; references missing one count as floor.
+        """
+        with self.lock:
+            if rows is None:
+                rows = np.arange(self.n_rows)
+            columns, values, mask, sizes, oov_sq = self._project(scans)
+            ref_rssi = self.rssi[np.ix_(rows, columns)].astype(np.float64)
+            ref_presence = self.presence[np.ix_(rows, columns)].astype(np.float64)
+            ap_counts = self.ap_counts[rows].astype(np.float64)
+
+        # sum_j m_ij (r_kj - t_ij)^2 expanded into three matrix products
+        sq_dist = (
+            mask @ (ref_rssi ** 2).T
+            - 2.0 * (values * mask) @ ref_rssi.T
+            + np.sum(values ** 2 * mask, axis=1)[:, None]
+            + oov_sq[:, None]
+        )
+        euclidean_dist = np.sqrt(np.maximum(sq_dist, 0.0))
+
+        # Jaccard Index = Intersection / Union
+        intersection = mask @ ref_presence.T
+        union = sizes[:, None] + ap_counts[None, :] - intersection
+        jaccard_index = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+        # Small overlap = Big Penalty
+        penalty = 1.0 + (1.0 - jaccard_index) * 2.0
+        return euclidean_dist * penalty
+
+    def locate_batch(self, scans: Sequence[Dict[str, int]], k: int = 5, min_shared: int = 0) -> List[Optional[Dict]]:
+        """
+        Weighted KNN for many scans against this cell in one pass.
+        With min_shared > 0 only references sharing that many APs are scored.
+        """
+        with self.lock:
+            n_refs = len(self)
+            if n_refs == 0 or len(scans) == 0:
+                return [None] * len(scans)
+
+            rows = self.candidate_rows(scans, min_shared, k) if min_shared > 0 else None
+            if rows is None:
+                rows = np.arange(n_refs)
+            coords = self.coords[rows]
+
+        final_distances = self.distances(scans, rows)
+        k = min(k, len(rows))
+
+        # argpartition is faster than sort for top-k
+        idx = np.argpartition(final_distances, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(final_distances, idx, axis=1)
+        order = np.argsort(top, axis=1)
+        nearest_indices = np.take_along_axis(idx, order, axis=1)
+        nearest_distances = np.take_along_axis(top, order, axis=1)
+
+        weights = 1.0 / (nearest_distances + 1e-6)
+        total_weight = weights.sum(axis=1)
+        weighted_lat = (coords[nearest_indices, 0] * weights).sum(axis=1) / total_weight
+        weighted_lon = (coords[nearest_indices, 1] * weights).sum(axis=1) / total_weight
+
+        return [
+            {
+                "lat": float(weighted_lat[i]),
+                "lon": float(weighted_lon[i]),
+                "uncertainty_m": float(nearest_distances[i, 0]), # Distance to nearest neighbor
+                "sample_size": n_refs
+            }
+            for i in range(len(scans))
+        ]
+
+    def locate(self, target_scan: Dict[str, int], k: int = 5, min_shared: int = 0) -> Optional[Dict]:
+        return self.locate_batch([target_scan], k, min_shared)[0]
+
+
+class FingerprintIndexBuilder:
+    """
+    Streaming Spatial Binning: consumes raw scans page by page as columns and
+    compiles them into a FingerprintIndex of p8 bins (mean coordinates and
+    mean RSSI per AP). Only flat NumPy buffers are kept between pages.
+    """
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.n_scans = 0
+        self._lats = []
+        self._lons = []
+        self._cols = []
+        self._vals = []
+        self._sizes = []
+
+    def add_columns(self, lats: Sequence[float], lons: Sequence[float], bssid_maps: Sequence[Dict[str, int]]):
+        n = len(bssid_maps)
+        vocabulary = self.vocabulary
+        sizes = np.fromiter((len(m) for m in bssid_maps), dtype=np.intp, count=n)
+        total = int(sizes.sum())
+
+        self._lats.append(np.asarray(lats, dtype=np.float64))
+        self._lons.append(np.asarray(lons, dtype=np.float64))
+        self._sizes.append(sizes)
+        self._cols.append(np.fromiter(
+            (vocabulary.setdefault(mac, len(vocabulary)) for m in bssid_maps for mac in m),
+            dtype=np.intp, count=total
+        ))
+        self._vals.append(np.fromiter((val for m in bssid_maps for val in m.values()), dtype=np.float64, count=total))
+        self.n_scans += n
+
+    def add_rows(self, rows: Sequence[tuple]):
+        """Page of (latitude, longitude, bssids) tuples, as returned by tuple_factory."""
+        if not rows:
+            return
+        lats, lons, bssid_maps = zip(*rows)
+        self.add_columns(lats, lons, bssid_maps)
+
+    def build(self) -> FingerprintIndex:
+        lats = np.concatenate(self._lats) if self._lats else np.empty(0)
+        lons = np.concatenate(self._lons) if self._lons else np.empty(0)
+        sizes = np.concatenate(self._sizes) if self._sizes else np.empty(0, dtype=np.intp)
+        cols = np.concatenate(self._cols) if self._cols else np.empty(0, dtype=np.intp)
+        vals = np.concatenate(self._vals) if self._vals else np.empty(0)
+
+        # Bin on integer cell IDs; strings are only materialized once per bin
+        cell_ids, row_of_scan = np.unique(vgh.encode_int(lats, lons, BIN_PRECISION), return_inverse=True)
+        row_of_scan = row_of_scan.reshape(-1)
+        rows = np.repeat(row_of_scan, sizes)
+
+        n_rows, n_cols = len(cell_ids), len(self.vocabulary)
+        index = FingerprintIndex(capacity_rows=max(n_rows, 16), capacity_cols=max(n_cols, 32))
+        index.vocabulary = self.vocabulary
+        index.bins = {key: row for row, key in enumerate(vgh.int_to_str(cell_ids, BIN_PRECISION))}
+        index.n_rows = n_rows
+
+        # Sum + count per (bin, AP) in one scatter, then divide
+        sums = np.zeros((n_rows, n_cols), dtype=np.float64)
+        hits = np.zeros((n_rows, n_cols), dtype=np.int32)
+        np.add.at(sums, (rows, cols), vals)
+        np.add.at(hits, (rows, cols), 1)
+        heard = hits > 0
+        index._rssi[:n_rows, :n_cols][heard] = (sums[heard] / hits[heard]).astype(np.float32)
+        index._presence[:n_rows, :n_cols] = heard
+        index._hits[:n_rows, :n_cols] = hits
+
+        # Average Coordinates
+        counts = np.bincount(row_of_scan, minlength=n_rows)
+        if n_rows:
+            index._coords[:n_rows, 0] = np.bincount(row_of_scan, weights=lats, minlength=n_rows) / counts
+            index._coords[:n_rows, 1] = np.bincount(row_of_scan, weights=lons, minlength=n_rows) / counts
+        index._scan_counts[:n_rows] = counts
+        index._ap_counts[:n_rows] = heard.sum(axis=1)
+        return index
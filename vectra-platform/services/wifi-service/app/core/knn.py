@@ -1,164 +1,317 @@
+import asyncio
 import numpy as np
 import pandas as pd
-import pygeohash as pgh
-from typing import Dict, List
-from cachetools import TTLCache, cachedmethod
-from threading import RLock
-from app.db.cassandra_client import CassandraManager
+from services.common.python import geohash as vgh
+from typing import Dict, List, Optional
+from threading import BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+from cassandra.query import BatchStatement, BatchType
+from app.db.cassandra_client import CassandraManager, EXEC_PROFILE_COLUMNAR
+from app.db.aio import as_awaitable, iter_pages
+from app.core.config import settings
+from app.core.cell_cache import CellIndexCache
+from app.core.fingerprint import FingerprintIndex, FingerprintIndexBuilder
 import structlog
 
 logger = structlog.get_logger()
 
+RADIO_MAP_SELECT = "SELECT latitude, longitude, bssids FROM radio_map WHERE geohash_p6 = ?"
+# Offline-compacted bins (batch-precompute radio_map_compactor) and raw scans newer than them
+RADIO_MAP_COMPACTED_SELECT = """
+    SELECT bin_p8, latitude, longitude, scan_count, rssi_mean, rssi_hits, compacted_at
+    FROM radio_map_compacted WHERE geohash_p6 = ?
+"""
+# Single-partition filter: the scan stays server-side, only new rows cross the wire
+RADIO_MAP_SELECT_SINCE = (
+    "SELECT latitude, longitude, bssids FROM radio_map WHERE geohash_p6 = ? AND created_at > ? ALLOW FILTERING"
+)
+RADIO_MAP_INSERT = """
+    INSERT INTO radio_map (geohash_p6, scan_id, latitude, longitude, bssids, created_at)
+    VALUES (?, uuid(), ?, ?, ?, toTimestamp(now()))
+"""
+
 class WifiLocator:
     def __init__(self):
         self.session = CassandraManager.get_session()
-        # Cache reference data for a geohash for 5 minutes
-        self.cache = TTLCache(maxsize=1000, ttl=300)
-        self.lock = RLock()
+        # Compiled radio map per geohash_p6 (LRU + TTL, memory-budgeted)
+        self.cell_cache = CellIndexCache()
+        # Caps outstanding async writes (ingest backpressure)
+        self._in_flight = BoundedSemaphore(settings.INGEST_MAX_IN_FLIGHT)
+
+        # Asyncio path: NumPy work runs on a small bounded pool (matmul releases
+        # the GIL), Scylla I/O is awaited on the event loop itself.
+        self._executor = ThreadPoolExecutor(max_workers=settings.SCORING_THREADS, thread_name_prefix="wifi-knn")
+        self._locate_slots = asyncio.Semaphore(settings.LOCATE_MAX_CONCURRENCY)
+        self._write_slots = asyncio.Semaphore(settings.INGEST_MAX_IN_FLIGHT)
+        # Single-flight cell builds: concurrent misses on a cell share one fetch
+        self._building: Dict[str, asyncio.Future] = {}
 
     def ingest(self, lat: float, lon: float, scan: Dict[str, int]):
         """
         Enterprise: Async Insert (Fire and Forget)
         """
-        ghash = pgh.encode(lat, lon, precision=6)
-        query = """
-            INSERT INTO radio_map (geohash_p6, scan_id, latitude, longitude, bssids, created_at)
-            VALUES (%s, uuid(), %s, %s, %s, toTimestamp(now()))
-        """
-        # Execute Async to not block the API thread
-        future = self.session.execute_async(query, (ghash, lat, lon, scan))
-        # Optional: Add callback for error logging
-        future.add_errback(lambda e: logger.error("Cassandra Write Failed", error=str(e)))
-
-    def _fetch_reference_data(self, ghash: str):
-        """
-        Fetches all scans in a geohash and converts to a DataFrame.
-        """
-        query = "SELECT latitude, longitude, bssids FROM radio_map WHERE geohash_p6 = %s"
-        rows = self.session.execute(query, (ghash,))
-        return list(rows)
-
-    def _compact_fingerprints(self, raw_rows: List[dict]) -> List[dict]:
-        """
-        Optimization: Spatial Binning.
-        Group raw scans by Fine Geohash (Precision 8 ~38m x 19m) or 
-        super-fine Precision 9 (~4m x 4m) to create 'Synthetic Reference Points'.
-        """
-        grouped = {}
-        
-        for row in raw_rows:
-            # Create a spatial key (Precision 8 is roughly room-sized/small shop)
-            # You can also simply round Lat/Lon to 5 decimal places (~1.1m)
-            spatial_key = pgh.encode(row['latitude'], row['longitude'], precision=8)
-            
-            if spatial_key not in grouped:
-                grouped[spatial_key] = {'lat_sum': 0, 'lon_sum': 0, 'count': 0, 'signals': []}
-            
-            group = grouped[spatial_key]
-            group['lat_sum'] += row['latitude']
-            group['lon_sum'] += row['longitude']
-            group['count'] += 1
-            group['signals'].append(row['bssids'])
-
-        compacted = []
-        for key, data in grouped.items():
-            # Average Coordinates
-            avg_lat = data['lat_sum'] / data['count']
-            avg_lon = data['lon_sum'] / data['count']
-            
-            # Average Signals (The tricky part)
-            # We aggregate all RSSIs seen in this grid cell
-            agg_signals = {}
-            mac_counts = {}
-            
-            for scan in data['signals']:
-                for mac, rssi in scan.items():
-                    agg_signals[mac] = agg_signals.get(mac, 0) + rssi
-                    mac_counts[mac] = mac_counts.get(mac, 0) + 1
-            
-            # Calculate mean RSSI per MAC
-            mean_signals = {mac: int(val / mac_counts[mac]) for mac, val in agg_signals.items()}
-            
-            compacted.append({
-                'latitude': avg_lat,
-                'longitude': avg_lon,
-                'bssids': mean_signals
-            })
-            
-        return compacted
-    
-    @cachedmethod(lambda self: self.cache, lock=lambda self: self.lock)
+        self.ingest_batch([lat], [lon], [scan])
+
+    def ingest_batch(self, lats: List[float], lons: List[float], scans: List[Dict[str, int]]) -> int:
+        """
+        Writes many scans with one prepared INSERT, grouped into unlogged batches
+        per geohash_p6 partition (a single-partition batch is one mutation on one
+        replica set, so it stays token-aware). Returns the number of requests sent.
+        """
+        sent = 0
+        for statement, ghash, size in self._ingest_statements(lats, lons, scans):
+            self._submit(statement, ghash, size)
+            sent += 1
+        return sent
+
+    def _ingest_statements(self, lats: List[float], lons: List[float], scans: List[Dict[str, int]]):
+        """Yields (statement, geohash_p6, scan_count) and patches hot cell indexes."""
+        insert = CassandraManager.prepare(RADIO_MAP_INSERT)
+        ghashes = vgh.encode(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), precision=6)
+
+        by_cell = {}
+        for i, ghash in enumerate(ghashes):
+            by_cell.setdefault(ghash, []).append(i)
+
+        max_statements = settings.INGEST_BATCH_MAX_STATEMENTS
+        for ghash, rows in by_cell.items():
+            for start in range(0, len(rows), max_statements):
+                chunk = rows[start:start + max_statements]
+                if len(chunk) == 1:
+                    i = chunk[0]
+                    statement = insert.bind((ghash, lats[i], lons[i], scans[i]))
+                else:
+                    statement = BatchStatement(batch_type=BatchType.UNLOGGED)
+                    for i in chunk:
+                        statement.add(insert, (ghash, lats[i], lons[i], scans[i]))
+                yield statement, ghash, len(chunk)
+
+            # Patch the compiled index in place if the cell is hot; cold cells
+            # pick the scans up from Scylla on their next build.
+            def patch(index):
+                for i in rows:
+                    index.add_scan(lats[i], lons[i], scans[i])
+            self.cell_cache.patch(ghash, patch)
+
+    def _submit(self, statement, ghash: str, size: int):
+        """
+        Execute Async with backpressure: blocks once INGEST_MAX_IN_FLIGHT writes are
+        outstanding instead of piling futures onto the driver's request slots.
+        """
+        self._in_flight.acquire()
+
+        def on_success(_):
+            self._in_flight.release()
+
+        def on_error(e):
+            self._in_flight.release()
+            logger.error("Cassandra Write Failed", geohash=ghash, scans=size, error=str(e))
+
+        try:
+            future = self.session.execute_async(statement)
+        except Exception:
+            self._in_flight.release()
+            raise
+        future.add_callbacks(on_success, on_error)
+
+    def _fetch_reference_data(self, ghash: str) -> FingerprintIndexBuilder:
+        """
+        Streams all scans in a geohash page by page (prepared, tuple rows) straight
+        into the index builder; no full partition is ever held as dicts.
+        """
+        statement = CassandraManager.prepare(RADIO_MAP_SELECT, fetch_size=settings.RADIO_MAP_FETCH_SIZE)
+        result = self.session.execute(statement, (ghash,), execution_profile=EXEC_PROFILE_COLUMNAR)
+
+        builder = FingerprintIndexBuilder()
+        while True:
+            builder.add_rows(result.current_rows)
+            if not result.has_more_pages:
+                break
+            result.fetch_next_page()
+        return builder
+
+    @staticmethod
+    def _replay_scans(index: FingerprintIndex, rows) -> FingerprintIndex:
+        for lat, lon, bssids in rows:
+            index.add_scan(lat, lon, bssids)
+        return index
+
+    def _build_cell_index(self, ghash: str) -> Optional[FingerprintIndex]:
+        # 1. Compacted cell: load bins as-is, fold in only the scans since compaction
+        statement = CassandraManager.prepare(RADIO_MAP_COMPACTED_SELECT, fetch_size=settings.RADIO_MAP_FETCH_SIZE)
+        compacted = list(self.session.execute(statement, (ghash,), execution_profile=EXEC_PROFILE_COLUMNAR))
+        if compacted:
+            index = FingerprintIndex.from_bins(compacted)
+            since = min(row[6] for row in compacted)
+            statement = CassandraManager.prepare(RADIO_MAP_SELECT_SINCE, fetch_size=settings.RADIO_MAP_FETCH_SIZE)
+            tail = self.session.execute(statement, (ghash, since), execution_profile=EXEC_PROFILE_COLUMNAR)
+            return self._replay_scans(index, tail)
+
+        # 2. Not compacted yet: aggregate raw scans
+        builder = self._fetch_reference_data(ghash)
+        if builder.n_scans == 0:
+            return None
+        return builder.build()
+
     def locate(self, coarse_lat: float, coarse_lon: float, target_scan: Dict[str, int], k=5) -> Dict:
         """
         Vectorized KNN Lookup.
         """
-        ghash = pgh.encode(coarse_lat, coarse_lon, precision=6)
-        
-        # 1. Get Reference Data (Cached)
-        raw_references = self._fetch_reference_data(ghash)
-        if not references:
+        ghash = vgh.encode_one(coarse_lat, coarse_lon, precision=6)
+
+        # 1. Get the compiled cell index (Cached)
+        index = self.cell_cache.get_or_build(ghash, self._build_cell_index)
+        if index is None:
+            return None
+
+        # 2. Euclidean distance + Jaccard penalty for all references in one NumPy pass
+        return index.locate(target_scan, k=k, min_shared=settings.LOCATE_MIN_SHARED_APS)
+
+
+    # --- Asyncio-native API (used by the FastAPI handlers) ---
+
+    async def ingest_batch_async(self, lats: List[float], lons: List[float], scans: List[Dict[str, int]]) -> int:
+        """
+        Same pipeline as ingest_batch; backpressure awaits a write slot instead of
+        blocking a thread.
+        """
+        sent = 0
+        for statement, ghash, size in self._ingest_statements(lats, lons, scans):
+            await self._write_slots.acquire()
+            try:
+                write = as_awaitable(self.session.execute_async(statement))
+            except Exception:
+                self._write_slots.release()
+                raise
+            write.add_done_callback(lambda f, ghash=ghash, size=size: self._on_write_done(f, ghash, size))
+            sent += 1
+        return sent
+
+    def _on_write_done(self, fut: asyncio.Future, ghash: str, size: int):
+        self._write_slots.release()
+        if not fut.cancelled() and fut.exception() is not None:
+            logger.error("Cassandra Write Failed", geohash=ghash, scans=size, error=str(fut.exception()))
+
+    async def _build_cell_index_async(self, ghash: str) -> Optional[FingerprintIndex]:
+        loop = asyncio.get_running_loop()
+
+        # 1. Compacted cell: load bins as-is, fold in only the scans since compaction
+        statement = CassandraManager.prepare(RADIO_MAP_COMPACTED_SELECT, fetch_size=settings.RADIO_MAP_FETCH_SIZE)
+        response = self.session.execute_async(statement, (ghash,), execution_profile=EXEC_PROFILE_COLUMNAR)
+        compacted = [row async for page in iter_pages(response) for row in page]
+        if compacted:
+            index = await loop.run_in_executor(self._executor, FingerprintIndex.from_bins, compacted)
+            since = min(row[6] for row in compacted)
+            statement = CassandraManager.prepare(RADIO_MAP_SELECT_SINCE, fetch_size=settings.RADIO_MAP_FETCH_SIZE)
+            response = self.session.execute_async(statement, (ghash, since), execution_profile=EXEC_PROFILE_COLUMNAR)
+            async for page in iter_pages(response):
+                await loop.run_in_executor(self._executor, self._replay_scans, index, page)
+            return index
+
+        # 2. Not compacted yet: aggregate raw scans
+        statement = CassandraManager.prepare(RADIO_MAP_SELECT, fetch_size=settings.RADIO_MAP_FETCH_SIZE)
+        response = self.session.execute_async(statement, (ghash,), execution_profile=EXEC_PROFILE_COLUMNAR)
+
+        builder = FingerprintIndexBuilder()
+        async for page in iter_pages(response):
+            await loop.run_in_executor(self._executor, builder.add_rows, page)
+        if builder.n_scans == 0:
             return None
-        references = self._compact_fingerprints(raw_references)
-        # 2. Vectorization Preparation
-        # Create a list of reference RSSI dicts and coordinates
-        ref_bssids_list = [r['bssids'] for r in references]
-        ref_coords = np.array([[r['latitude'], r['longitude']] for r in references])
-        
-        # Identify common MAC addresses (Features)
-        # We only care about MACs seen in the Target Scan to reduce dimensionality
-        target_macs = list(target_scan.keys())
-        target_vector = np.array([target_scan[mac] for mac in target_macs])
-        
-         # 3. Calculate Euclidean Distance
-        diff = matrix - target_vector
-        sq_dist = np.sum(diff ** 2, axis=1)
-        euclidean_dist = np.sqrt(sq_dist)
-        
-        # OPTIMIZATION: Jaccard Penalty
-        # We want to penalize references that don't share MACs with the target
-        penalized_distances = []
-        
-        target_macs_set = set(target_macs)
-        
-        for i, ref_row in enumerate(references):
-            ref_macs_set = set(ref_row['bssids'].keys())
-            
-            # Jaccard Index = Intersection / Union
-            intersection = len(target_macs_set.intersection(ref_macs_set))
-            union = len(target_macs_set.union(ref_macs_set))
-            
-            jaccard_index = intersection / union if union > 0 else 0
-            
-            # Invert index: 1.0 is perfect overlap, 0.0 is no overlap
-            # Penalty Factor: Small overlap = Big Penalty
-            penalty = 1.0 + (1.0 - jaccard_index) * 2.0 
-            
-            # Apply penalty to geometric distance
-            penalized_distances.append(euclidean_dist[i] * penalty)
-
-        final_distances = np.array(penalized_distances)
-
-        
-        # 4. Find Top K
-        # argpartition is faster than sort for top-k
-        if len(final_distances) < k:
-            k = len(final_distances)
-            
-        idx = np.argpartition(final_distances, k)[:k]
-        nearest_indices = idx[np.argsort(final_distances[idx])]
-        
-        # 5. Weighted Average
-        weights = 1.0 / (final_distances[nearest_indices] + 1e-6)
-        total_weight = np.sum(weights)
-        
-        weighted_lat = np.sum(ref_coords[nearest_indices, 0] * weights) / total_weight
-        weighted_lon = np.sum(ref_coords[nearest_indices, 1] * weights) / total_weight
-        
-        uncertainty = final_distances[nearest_indices[0]] # Distance to nearest neighbor
-        
-        return {
-            "lat": weighted_lat,
-            "lon": weighted_lon,
-            "uncertainty_m": float(uncertainty),
-            "sample_size": len(references)
-        }
\ No newline at end of file
+        return await loop.run_in_executor(self._executor, builder.build)
+
+    async def get_cell_index_async(self, ghash: str) -> Optional[FingerprintIndex]:
+        index = self.cell_cache.get(ghash)
+        if index is not None:
+            return index
+
+        pending = self._building.get(ghash)
+        if pending is None:
+            pending = asyncio.ensure_future(self._build_cell_index_async(ghash))
+            self._building[ghash] = pending
+            pending.add_done_callback(lambda _: self._building.pop(ghash, None))
+
+        # shield: one cancelled request must not abort the build for the others
+        index = await asyncio.shield(pending)
+        if index is None:
+            return None
+        return self.cell_cache.put(ghash, index)
+
+    async def locate_async(self, coarse_lat: float, coarse_lon: float, target_scan: Dict[str, int], k=5,
+                           include_neighbors: Optional[bool] = None) -> Optional[Dict]:
+        """
+        Non-blocking KNN Lookup: Scylla pages are awaited, scoring runs on the bounded executor.
+        With include_neighbors, the 8 surrounding p6 cells are loaded concurrently so
+        fixes near a cell edge still see the references across it.
+        """
+        if include_neighbors is None:
+            include_neighbors = settings.LOCATE_INCLUDE_NEIGHBORS
+
+        async with self._locate_slots:
+            ghash = vgh.encode_one(coarse_lat, coarse_lon, precision=6)
+            loop = asyncio.get_running_loop()
+
+            if not include_neighbors:
+                index = await self.get_cell_index_async(ghash)
+                if index is None:
+                    return None
+                return await loop.run_in_executor(
+                    self._executor, index.locate, target_scan, k, settings.LOCATE_MIN_SHARED_APS
+                )
+
+            # Parallel fetch; every cell index is cached and reused across requests
+            cells = [ghash] + vgh.neighbors_one(ghash)
+            indexes = await asyncio.gather(*(self.get_cell_index_async(g) for g in cells))
+            return await loop.run_in_executor(
+                self._executor, self._locate_multi_cell, indexes, coarse_lat, coarse_lon, target_scan, k
+            )
+
+    async def locate_batch_async(self, lats: List[float], lons: List[float], scans: List[Dict[str, int]],
+                                 k=5) -> List[Optional[Dict]]:
+        """
+        Trajectory-level KNN: scans are grouped by p6 cell, each cell index is loaded
+        once (concurrently) and all of a cell's scans are scored with one
+        matrix-matrix distance pass. Results come back in input order.
+        """
+        ghashes = vgh.encode(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), precision=6)
+        by_cell: Dict[str, List[int]] = {}
+        for i, ghash in enumerate(ghashes):
+            by_cell.setdefault(ghash, []).append(i)
+
+        async with self._locate_slots:
+            cells = list(by_cell)
+            indexes = await asyncio.gather(*(self.get_cell_index_async(g) for g in cells))
+
+            loop = asyncio.get_running_loop()
+            scored = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self._executor, index.locate_batch,
+                    [scans[i] for i in by_cell[ghash]], k, settings.LOCATE_MIN_SHARED_APS
+                )
+                for ghash, index in zip(cells, indexes) if index is not None
+            ))
+
+        results: List[Optional[Dict]] = [None] * len(scans)
+        scored_cells = (ghash for ghash, index in zip(cells, indexes) if index is not None)
+        for ghash, cell_results in zip(scored_cells, scored):
+            for i, result in zip(by_cell[ghash], cell_results):
+                results[i] = result
+        return results
+
+    def _locate_multi_cell(self, indexes: List[Optional[FingerprintIndex]], coarse_lat: float, coarse_lon: float,
+                           target_scan: Dict[str, int], k: int) -> Optional[Dict]:
+        """Prunes each cell to references near the coarse fix, merges them, then scores once."""
+        radius = settings.NEIGHBOR_PRUNE_RADIUS_M
+        parts = []
+        for index in indexes:
+            if index is None:
+                continue
+            rows = index.rows_within(coarse_lat, coarse_lon, radius)
+            if len(rows):
+                parts.append((index, rows))
+
+        if not parts:
+            # Nothing near the fix (large GPS drift): fall back to the containing cell
+            center = indexes[0]
+            return center.locate(target_scan, k=k, min_shared=settings.LOCATE_MIN_SHARED_APS) if center is not None else None
+
+        return FingerprintIndex.merge(parts).locate(target_scan, k=k, min_shared=settings.LOCATE_MIN_SHARED_APS)
@@ -0,0 +1,46 @@
+import asyncio
+from typing import AsyncIterator, List
+
+# Bridges cassandra-driver ResponseFutures (resolved on the driver's event
+# thread) into asyncio awaitables without parking a worker thread on them.
+
+def _resolve(fut: asyncio.Future, result=None, error: BaseException = None):
+    if fut.done(): # Caller was cancelled / timed out
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+def as_awaitable(response_future) -> asyncio.Future:
+    """
+    Wraps a ResponseFuture; the awaitable resolves with the first page of rows.
+    """
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    response_future.add_callbacks(
+        lambda rows: loop.call_soon_threadsafe(_resolve, fut, rows),
+        lambda exc: loop.call_soon_threadsafe(_resolve, fut, None, exc)
+    )
+    return fut
+
+async def iter_pages(response_future) -> AsyncIterator[List[tuple]]:
+    """
+    Yields each page of a paged query as it arrives. The next page is only
+    requested after the consumer has taken the current one (natural backpressure).
+    """
+    loop = asyncio.get_running_loop()
+    pages: asyncio.Queue = asyncio.Queue()
+    # Callbacks stay registered across start_fetch_next_page()
+    response_future.add_callbacks(
+        lambda rows: loop.call_soon_threadsafe(pages.put_nowait, (rows, None)),
+        lambda exc: loop.call_soon_threadsafe(pages.put_nowait, (None, exc))
+    )
+    while True:
+        rows, error = await pages.get()
+        if error is not None:
+            raise error
+        yield rows
+        if not response_future.has_more_pages:
+            return
+        response_future.start_fetch_next_page()
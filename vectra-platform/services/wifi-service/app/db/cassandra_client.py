@@ -1,13 +1,19 @@
 from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
 from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
-from cassandra.query import dict_factory
+from cassandra.query import dict_factory, tuple_factory
+from threading import RLock
 from app.core.config import settings
 import structlog
 
 logger = structlog.get_logger()
 
+# Profile for bulk reads: plain tuples, no per-row dict construction
+EXEC_PROFILE_COLUMNAR = "columnar"
+
 class CassandraManager:
     _session = None
+    _prepared = {}
+    _lock = RLock()
 
     @classmethod
     def get_session(cls):
@@ -15,22 +21,41 @@ class CassandraManager:
             # Enterprise Load Balancing Policy
             # TokenAware: Sends query directly to the node holding the data
             # DCAware: Prioritizes local datacenter nodes
-            lb_policy = TokenAwarePolicy(DCAwareRoundRobinPolicy())
-            
             profile = ExecutionProfile(
-                load_balancing_policy=lb_policy,
-                request_timeout=2.0, # Fast fail
+                load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+                request_timeout=settings.CASSANDRA_REQUEST_TIMEOUT, # Fast fail
+                row_factory=dict_factory
+            )
+            # Paged scans: the timeout applies per page, not to the whole partition
+            columnar_profile = ExecutionProfile(
+                load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+                request_timeout=settings.CASSANDRA_REQUEST_TIMEOUT,
+                row_factory=tuple_factory
             )
 
             cluster = Cluster(
                 contact_points=settings.CASSANDRA_HOSTS,
                 port=settings.CASSANDRA_PORT,
-                execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+                execution_profiles={EXEC_PROFILE_DEFAULT: profile, EXEC_PROFILE_COLUMNAR: columnar_profile},
                 protocol_version=4 # Efficient binary protocol
             )
             
             cls._session = cluster.connect(settings.CASSANDRA_KEYSPACE)
-            cls._session.row_factory = dict_factory
             logger.info("Connected to ScyllaDB (Enterprise Profile)")
             
-        return cls._session
\ No newline at end of file
+        return cls._session
+
+    @classmethod
+    def prepare(cls, cql: str, fetch_size: int = None):
+        """
+        Prepared statement registry: each CQL string is parsed by Scylla once per
+        process, and bound statements are routed token-aware by partition key.
+        """
+        with cls._lock:
+            statement = cls._prepared.get(cql)
+            if statement is None:
+                statement = cls.get_session().prepare(cql)
+                if fetch_size:
+                    statement.fetch_size = fetch_size
+                cls._prepared[cql] = statement
+            return statement